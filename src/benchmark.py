@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+import fonts.builders
+import fonts.cff.builders
+import fonts.cff.charstrings
+import fonts.ttf.builders
+
+
+FONT_EXTENSIONS = ('.ttf', '.otf', '.cff')
+
+
+class PhaseTimer(object):
+    """
+    Accumulates exclusive wall time per phase, time spent in a nested phase is only counted against that phase.
+    Recursive calls into a phase that is already running are counted as part of the outer call.
+    """
+    def __init__(self):
+        self.totals = {}
+        self._stack = []
+
+    def wrap(self, function, phase):
+        """
+        :param function: the function to time
+        :param phase: phase name, or a callable taking the function's arguments and returning the phase name
+        """
+        def timed(*args, **kwargs):
+            if callable(phase):
+                name = phase(*args, **kwargs)
+            else:
+                name = phase
+            if self._stack and self._stack[-1][0] == name:
+                return function(*args, **kwargs)
+            self._stack.append([name, time.time(), 0.0])
+            try:
+                return function(*args, **kwargs)
+            finally:
+                (name, started, child_time) = self._stack.pop()
+                elapsed = time.time() - started
+                self.totals[name] = self.totals.get(name, 0.0) + elapsed - child_time
+                if self._stack:
+                    self._stack[-1][2] += elapsed
+        return timed
+
+    def instrument(self):
+        """
+        Wraps the parser entry points for each phase, returning a function that undoes it.
+        """
+        phases = [
+            (fonts.ttf.builders.TtfFont, 'read_from_content', 'ttf.directory'),
+            (fonts.ttf.builders.TtfFont, '_load_table', lambda font, tag, content: 'ttf.table.' + tag.strip()),
+            (fonts.ttf.builders.TtfGlyfTable, '_decode_glyph', 'ttf.glyph_decode'),
+            (fonts.cff.builders.CffFont, 'read_from_content', 'cff.other'),
+            (fonts.cff.builders.CffFont, 'read_index_table', 'cff.index'),
+            (fonts.cff.charstrings.Type2CharStringParser, 'parse', 'cff.charstring_parse'),
+            (fonts.cff.charstrings.Type2CharString, 'render', 'cff.metrics'),
+            (fonts.cff.charstrings.Type2CharString, '_convert_type2_to_type1', 'cff.type2_to_type1'),
+        ]
+        originals = []
+        for (cls, attribute, phase) in phases:
+            original = cls.__dict__[attribute]
+            originals.append((cls, attribute, original))
+            setattr(cls, attribute, self.wrap(original, phase))
+
+        def restore():
+            for (cls, attribute, original) in originals:
+                setattr(cls, attribute, original)
+        return restore
+
+
+def find_fonts(directory):
+    file_names = []
+    for root, dirs, files in os.walk(directory):
+        for found_file in files:
+            if found_file.lower().endswith(FONT_EXTENSIONS):
+                file_names.append(os.path.join(root, found_file))
+    return sorted(file_names)
+
+
+def decode_glyphs(font):
+    """
+    Touches every glyph, so lazily decoded glyph data is included in the timing. CFF glyphs are also measured, since
+    their outlines are only interpreted for width and bounds.
+    """
+    if isinstance(font, fonts.ttf.builders.TtfFont):
+        glyph_table = font.get_table('glyf')
+        if glyph_table is not None:
+            for glyph_id in range(glyph_table.glyph_count()):
+                glyph_table.get_glyph(glyph_id)
+    elif isinstance(font, fonts.cff.builders.CffFont):
+        for font_index in range(len(font.font_names)):
+            for glyph_id in range(font.glyph_count(font_index)):
+                font.get_glyph(glyph_id, font_index).get_bounds()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def run(file_names, repeat, include_glyphs, timer, lazy=False):
+    latencies = []
+    failures = {}
+    total_bytes = 0
+    started = time.time()
+    for i in range(repeat):
+        for file_name in file_names:
+            with open(file_name, 'rb') as font_file:
+                content = font_file.read()
+            font_started = time.time()
+            try:
+                font = fonts.builders.parse_font(content, lazy)
+                if include_glyphs:
+                    decode_glyphs(font)
+            except Exception as e:
+                failures[file_name] = repr(e)
+                continue
+            latencies.append(time.time() - font_started)
+            total_bytes += len(content)
+    elapsed = time.time() - started
+    parse_time = sum(latencies)
+    return {
+        'fonts': len(file_names),
+        'lazy': lazy,
+        'repeat': repeat,
+        'parsed': len(latencies),
+        'failures': failures,
+        'seconds': elapsed,
+        'fonts_per_second': len(latencies) / parse_time if parse_time else 0.0,
+        'megabytes_per_second': total_bytes / parse_time / 2 ** 20 if parse_time else 0.0,
+        'latency_p50': percentile(latencies, .5),
+        'latency_p99': percentile(latencies, .99),
+        'peak_memory_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'phases': dict(timer.totals) if timer else {},
+    }
+
+
+def print_report(results, baseline=None):
+    baseline = baseline or {}
+    baseline_phases = baseline.get('phases', {})
+    print 'parsed {0} of {1} fonts ({2} passes over {3} files)'.format(
+        results['parsed'], results['fonts'] * results['repeat'], results['repeat'], results['fonts'])
+    for key in ('fonts_per_second', 'megabytes_per_second', 'latency_p50', 'latency_p99', 'peak_memory_kb'):
+        _print_value(key, results[key], baseline.get(key))
+    for phase, seconds in sorted(results['phases'].items()):
+        _print_value(phase, seconds, baseline_phases.get(phase))
+    for file_name, error in sorted(results['failures'].items()):
+        print 'failed {0}: {1}'.format(file_name, error)
+
+
+def _print_value(label, value, baseline_value):
+    if baseline_value:
+        print '{0:<28} {1:>14.6f} ({2:+.1%})'.format(label, value, float(value) / baseline_value - 1)
+    else:
+        print '{0:<28} {1:>14.6f}'.format(label, value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time parse_font over a directory of fonts')
+    parser.add_argument('directory', help="directory to search for ttf, otf and cff files")
+    parser.add_argument('--repeat', type=int, default=1, help="number of passes over the fonts")
+    parser.add_argument('--no-glyphs', action='store_true', help="don't decode every glyph after parsing")
+    parser.add_argument('--no-phases', action='store_true',
+                        help="skip the per-phase instrumentation, which adds some overhead to the totals")
+    parser.add_argument('--lazy', action='store_true',
+                        help="only read the table directory when parsing, tables are parsed as they're used")
+    parser.add_argument('--output', help="write the results as json to this file")
+    parser.add_argument('--compare', help="json results from an earlier run to compare against")
+    args = parser.parse_args()
+
+    file_names = find_fonts(args.directory)
+    timer = None
+    restore = None
+    if not args.no_phases:
+        timer = PhaseTimer()
+        restore = timer.instrument()
+    try:
+        results = run(file_names, args.repeat, not args.no_glyphs, timer, args.lazy)
+    finally:
+        if restore:
+            restore()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+    return 0 if not results['failures'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
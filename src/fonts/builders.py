@@ -1,17 +1,130 @@
+import mmap
+import Queue
+import sys
+import threading
 import cff.builders
 import ttf.builders
 
 
-def parse_font(encoded_data):
+def parse_font(encoded_data, lazy=False):
+    """
+    :param encoded_data: the font data
+    :param bool lazy: only read a TrueType or OpenType font's table directory now, parsing each table the first time
+                      it is requested. CFF fonts already parse their charstrings on demand, so it doesn't change them
+    :rtype: cff.builders.CffFont | ttf.builders.TtfFont
+    """
     if encoded_data[0:3] == "\x01\x00\x04":
         font = cff.builders.CffFont()
+        font.read_from_content(encoded_data)
     elif encoded_data[0:4] in set(["\x00\x01\x00\x00", "OTTO", "true"]):
         font = ttf.builders.TtfFont()
+        font.read_from_content(encoded_data, lazy)
     else:
         raise NotImplementedError
-    font.read_from_content(encoded_data)
+    return font
 
-def parse_file(file_name):
-    font_file = open(file_name, 'rb')
-    content = font_file.read()
-    return parse_font(content)
\ No newline at end of file
+
+def map_file(file_name):
+    """
+    Maps a font file read-only into memory, so parsing only faults in the pages that are actually read.
+    The file handle is closed before returning, the mapping stays valid as long as something references it.
+    :param str file_name:
+    :rtype: mmap.mmap | str
+    """
+    with open(file_name, 'rb') as font_file:
+        try:
+            return mmap.mmap(font_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            return font_file.read()
+
+
+def parse_file(file_name, lazy=False):
+    """
+    :param str file_name:
+    :param bool lazy: see parse_font
+    """
+    return parse_font(map_file(file_name), lazy)
+
+
+def iter_fonts(sources, read_ahead=4, keep_content=True, lazy=False):
+    """
+    Parses a stream of fonts, yielding (name, font) as each one is parsed, or (name, exception) if it couldn't be.
+    Sources are read on a background thread at most read_ahead fonts ahead of the one being parsed, so memory
+    stays bounded however many sources there are.
+    :param Iterable sources: file names, open files, or (name, data) tuples
+    :param int read_ahead: how many sources to read ahead of the parser
+    :param bool keep_content: when False, each font copies the bytes it still needs out of its source before it's
+                              yielded, so the source can be freed, and a mapped file is closed as soon as the next
+                              font is requested. The fonts stay usable, but any lazily read tables are read up front
+    :param bool lazy: see parse_font
+    :rtype: Iterable of tuples
+    """
+    pending = Queue.Queue(read_ahead)
+    stopped = threading.Event()
+    # sys.exc_info() of an error iterating the sources, re-raised with its traceback once the fonts before it are out
+    errors = []
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                pending.put(item, timeout=.1)
+                return
+            except Queue.Full:
+                pass
+
+    def read_sources():
+        try:
+            for source in sources:
+                if stopped.is_set():
+                    return
+                put(_read_source(source))
+        except Exception:
+            errors.append(sys.exc_info())
+        put(None)
+
+    reader = threading.Thread(target=read_sources)
+    reader.daemon = True
+    reader.start()
+    try:
+        while True:
+            item = pending.get()
+            if item is None:
+                if errors:
+                    (error_type, error, error_traceback) = errors[0]
+                    raise error_type, error, error_traceback
+                return
+            (name, content) = item
+            if isinstance(content, Exception):
+                yield name, content
+                continue
+            try:
+                font = parse_font(content, lazy)
+                if not keep_content:
+                    font.release_content()
+            except Exception as e:
+                font = e
+            yield name, font
+            if not keep_content and isinstance(content, mmap.mmap):
+                content.close()
+            del font, content, item
+    finally:
+        stopped.set()
+
+
+def _read_source(source):
+    """
+    :rtype: tuple of (name, content), content is the exception raised if the source couldn't be read
+    """
+    if isinstance(source, basestring):
+        name = source
+    elif hasattr(source, 'read'):
+        name = getattr(source, 'name', None)
+    else:
+        return source
+    try:
+        if isinstance(source, basestring):
+            return name, map_file(source)
+        return name, source.read()
+    except Exception as e:
+        return name, e
@@ -0,0 +1,48 @@
+import collections
+
+
+class LruCache(object):
+    """
+    A bounded mapping that evicts the least recently used entry once it holds more than max_size entries.
+    """
+    def __init__(self, max_size):
+        """
+        :param int max_size: number of entries to keep, 0 disables caching and None keeps everything
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        if key in self._entries:
+            self.hits += 1
+            value = self._entries.pop(key)
+            self._entries[key] = value  # re-inserting marks the entry as most recently used
+            return value
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        if self.max_size == 0:
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        if self.max_size is not None and len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def set_max_size(self, max_size):
+        self.max_size = max_size
+        while self.max_size is not None and len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,7 +1,11 @@
 from encodings import Encoding
 from charstrings import Type2CharString, Type2CharStringParser
+from fdselect import FdSelect
+from indexes import Index
+from fonts.cache import LruCache
 from fonts.walkable import WalkableString as WalkableString
 import fonts.cff.rawdata
+import fonts.cff.charsets
 import fonts.cff.encodings
 
 
@@ -40,7 +44,7 @@ class CffFont(object):
         'oacute', 'ocircumflex', 'odieresis', 'ograve', 'otilde', 'scaron', 'uacute', 'ucircumflex',  # 216-223
         'udieresis', 'ugrave', 'yacute', 'ydieresis', 'zcaron', 'exclamsmall', 'Hungarumlautsmall',  # 224-230
         'dollaroldstyle', 'dollarsuperior', 'ampersandsmall', 'Acutesmall', 'parenleftsuperior',  # 231-235
-        'parenrightsuperior4', 'twodotenleader', 'onedotenleader', 'zerooldstyle', 'oneoldstyle',  # 236-240
+        'parenrightsuperior', 'twodotenleader', 'onedotenleader', 'zerooldstyle', 'oneoldstyle',  # 236-240
         'twooldstyle', 'threeoldstyle', 'fouroldstyle', 'fiveoldstyle', 'sixoldstyle', 'sevenoldstyle',  # 241-246
         'eightoldstyle', 'nineoldstyle', 'commasuperior', 'threequartersemdash', 'periodsuperior',  # 247-251
         'questionsmall', 'asuperior', 'bsuperior', 'centsuperior', 'dsuperior', 'esuperior', 'isuperior',  # 252-258
@@ -52,7 +56,7 @@ class CffFont(object):
         'onefitted', 'rupiah', 'Tildesmall', 'exclamdownsmall', 'centoldstyle', 'Lslashsmall',  # 301-306
         'Scaronsmall', 'Zcaronsmall', 'Dieresissmall', 'Brevesmall', 'Caronsmall', 'Dotaccentsmall',  # 307-312
         'Macronsmall', 'figuredash', 'hypheninferior', 'Ogoneksmall', 'Ringsmall', 'Cedillasmall',  # 313-318
-        'questiondownsmall', 'oneeighth', 'threeeighths', 'fiveeighths', 'seveneigths', 'onethird',  # 319-324
+        'questiondownsmall', 'oneeighth', 'threeeighths', 'fiveeighths', 'seveneighths', 'onethird',  # 319-324
         'twothirds', 'zerosuperior', 'foursuperior', 'fivesuperior', 'sixsuperior', 'sevensuperior',  # 325-330
         'eightsuperior', 'ninesuperior', 'zeroinferior', 'oneinferior', 'twoinferior', 'threeinferior',  # 331-336
         'fourinferior', 'fiveinferior', 'sixinferior', 'seveninferior', 'eightinferior', 'nineinferior',  # 337-342
@@ -124,12 +128,16 @@ class CffFont(object):
         (21,): ('nominalWidthX', (OPERAND_NUMBER,), 0),
     }
 
+    default_cache_size = 1024
+    _stock_char_sets = (fonts.cff.charsets.ISOAdobe, fonts.cff.charsets.Expert, fonts.cff.charsets.ExpertSubset)
+    _stock_char_set_names = {}
+
     def __init__(self):
-        self._glyphs = []
         self.custom_string_table = None
         self.top_dicts = None
         self.global_subroutine_table = None
-        self._local_subr_table = None
+        self.local_subr_tables = []
+        self.font_names = []
         self.encodings = []
         self.char_sets = []
         self.char_strings = []
@@ -139,6 +147,9 @@ class CffFont(object):
         self.font_dict_mapping = []
         self.is_cid_font = False
         self.data = WalkableString('')
+        self._glyph_ids_by_name = {}
+        self._glyph_cache = LruCache(self.default_cache_size)
+        self._private_contexts = {}
 
     def read_from_content(self, encoded_data):
         self.data = WalkableString(encoded_data)
@@ -150,7 +161,8 @@ class CffFont(object):
         self.global_subroutine_table = self.read_index_table()
         for i in range(len(font_name_table)):
             top_dict = self.top_dicts[i]
-            if 'CharStrings' in top_dict:
+            self.font_names.append(font_name_table[i].get_data())
+            if top_dict['CharStrings'] is not None:
                 self.data.set_position(top_dict['CharStrings'])
                 char_string_table = self.read_index_table()
                 self.char_strings.append(char_string_table)
@@ -167,55 +179,135 @@ class CffFont(object):
                 self.char_sets.append(self.parse_char_set(self.data, top_dict['charset'], len(char_string_table)))
             else:
                 self.char_sets.append([])
-            if 'ROS' in top_dict:
+            if top_dict['ROS'] is not None:
                 self.is_cid_font = True
                 # CID font, need to read all the CID info
                 self.data.set_position(top_dict['FDArray'])
                 font_dict_array_table = self.read_index_table()
                 font_dicts = self.build_tables(font_dict_array_table, self.top_dict_operation_map)
                 for font_dict in font_dicts:
-                    private_operands = font_dict['Private']
-                    private_data_list = self.parse_private_data(self.data, private_operands[1],
-                                                                private_operands[0])
-                    font_dict['PrivateData'] = private_data_list[0]
+                    # each font dict has its own private data and local subroutines, resolved once up front
+                    (font_dict['PrivateData'], font_dict['LocalSubrs']) = self.read_private(font_dict['Private'])
                 self.font_dict_lists.append(font_dicts)
                 self.font_dict_mapping.append(self.read_font_dict_mapping(top_dict['FDSelect'], len(char_string_table)))
             else:
                 self.font_dict_lists.append([])
                 self.font_dict_mapping.append([])
 
-            if 'Private' in top_dict and top_dict['Private']:
-                private_operands = top_dict['Private']
-                self.private_data.append(self.parse_private_data(self.data, private_operands[1], private_operands[0]))
-                if 'Subrs' in self.private_data:
-                    self.data.set_position(self.private_data['Subrs'])
-                    self._local_subr_table = self.read_index_table()
-            else:
-                self.private_data.append(None)
-            parser = Type2CharStringParser()
-            for j in range(len(char_string_table)):
-                if j == 0:
-                    char = '.notdef'
-                else:
-                    char = self.char_sets[i][j - 1]
+            (private_data, local_subr_table) = self.read_private(top_dict.get('Private'))
+            self.private_data.append(private_data)
+            self.local_subr_tables.append(local_subr_table)
+        self.name = self.font_names[0]
 
-                if self.is_cid_font:
-                    private_data = self.font_dict_lists[i][self.font_dict_mapping[i][j]]['PrivateData']
-                else:
-                    private_data = self.private_data[-1]
+    def release_content(self):
+        """
+        Copies the INDEX entries glyphs are still parsed from out of the font data, so the font no longer refers to
+        the data it was read from and that can be closed or freed.
+        """
+        indexes = [self.custom_string_table, self.global_subroutine_table]
+        indexes.extend(self.char_strings)
+        indexes.extend(self.local_subr_tables)
+        for font_dicts in self.font_dict_lists:
+            indexes.extend(font_dict['LocalSubrs'] for font_dict in font_dicts)
+        for index in indexes:
+            if isinstance(index, Index):
+                index.release_content()
+        self.data = WalkableString('')
 
-                if private_data:
-                    default_width = private_data['defaultWidthX']
-                    nominal_width = private_data['nominalWidthX']
-                else:
-                    default_width = 0
-                    nominal_width = 0
+    def glyph_count(self, font_index=0):
+        return len(self.char_strings[font_index])
+
+    def get_glyph(self, glyph_id, font_index=0):
+        """
+        Returns the glyph with the given id, parsing its charstring the first time it is requested.
+        :param int glyph_id:
+        :param int font_index: which font of the font set the glyph belongs to
+        :rtype: Type2CharString
+        """
+        key = (font_index, glyph_id)
+        glyph = self._glyph_cache.get(key)
+        if glyph is None:
+            glyph = self._parse_glyph(glyph_id, font_index)
+            self._glyph_cache.put(key, glyph)
+        return glyph
+
+    def get_glyph_by_name(self, name, font_index=0):
+        """
+        :param str name:
+        :param int font_index: which font of the font set the glyph belongs to
+        :rtype: Type2CharString or None if the font has no glyph with that name
+        """
+        if font_index not in self._glyph_ids_by_name:
+            glyph_ids = dict((char, j + 1) for (j, char) in enumerate(self.char_sets[font_index]))
+            glyph_ids['.notdef'] = 0
+            self._glyph_ids_by_name[font_index] = glyph_ids
+        glyph_id = self._glyph_ids_by_name[font_index].get(name)
+        if glyph_id is None or glyph_id >= self.glyph_count(font_index):
+            return None
+        return self.get_glyph(glyph_id, font_index)
+
+    def set_cache_size(self, cache_size):
+        """
+        :param int cache_size: number of parsed glyphs to keep, 0 disables caching and None keeps every glyph
+        """
+        self._glyph_cache.set_max_size(cache_size)
+
+    def get_cache(self):
+        """
+        The cache of parsed glyphs, which keeps hit and miss counts
+        :rtype: LruCache
+        """
+        return self._glyph_cache
+
+    def _parse_glyph(self, glyph_id, font_index):
+        char_string_table = self.char_strings[font_index]
+        if not 0 <= glyph_id < len(char_string_table):
+            raise IndexError("Glyph id {0} out of range".format(glyph_id))
+        if glyph_id == 0:
+            char = '.notdef'
+        else:
+            char = self.char_sets[font_index][glyph_id - 1]
+
+        font_dict_mapping = self.font_dict_mapping[font_index]
+        if font_dict_mapping:
+            font_dict_index = font_dict_mapping[glyph_id]
+        else:
+            font_dict_index = None
+        (default_width, nominal_width, local_subr_table, subroutine_cache) = self._get_private_context(
+            font_index, font_dict_index)
 
-                self._glyphs.append(Type2CharString(
-                    font_name_table[i].data, char,
-                    parser.parse(char_string_table[j], self.global_subroutine_table, self._local_subr_table),
-                        default_width, nominal_width))
-        self.name = font_name_table[0].data
+        parser = Type2CharStringParser(subroutine_cache)
+        sequence = parser.parse(char_string_table[glyph_id], self.global_subroutine_table, local_subr_table)
+        return Type2CharString(self.font_names[font_index], char, sequence, default_width, nominal_width)
+
+    def _get_private_context(self, font_index, font_dict_index):
+        """
+        Returns what parsing a glyph needs from the private data of its font, or of its font dict for CID fonts. This
+        is resolved once and shared by every glyph using the same private data.
+        :param int font_index:
+        :param int font_dict_index: None unless the font is a CID font
+        :rtype: tuple of (default width, nominal width, local subroutine INDEX, subroutine cache)
+        """
+        key = (font_index, font_dict_index)
+        context = self._private_contexts.get(key)
+        if context is None:
+            if font_dict_index is None:
+                private_data = self.private_data[font_index]
+                local_subr_table = self.local_subr_tables[font_index]
+            else:
+                font_dict = self.font_dict_lists[font_index][font_dict_index]
+                private_data = font_dict['PrivateData']
+                local_subr_table = font_dict['LocalSubrs']
+            if private_data:
+                default_width = private_data['defaultWidthX']
+                nominal_width = private_data['nominalWidthX']
+            else:
+                default_width = 0
+                nominal_width = 0
+            # subroutines decode the same way for every glyph sharing the local subroutines, so share the cache too
+            context = (default_width, nominal_width, local_subr_table, {})
+            self._private_contexts[key] = context
+        return context
 
     def move_to_end_of_header(self):
         self.data.set_position(2)  # This is the location of the header size
@@ -262,9 +354,8 @@ class CffFont(object):
             for value in operation_map.values():
                 # initialize defaults
                 table[value[0]] = value[2]
-            while not table_data.is_exhausted():
-                (operator_type, value) = fonts.cff.rawdata.read_unknown_thing(table_data)
-                if operator_type == OPERAND_OPERATION:
+            for value in fonts.cff.rawdata.read_tokens(table_data):
+                if isinstance(value, tuple):
                     operation = operation_map[value]
                     (key, operand_types, default_value) = operation
                     values = self.get_values(operand_types, stack)
@@ -273,34 +364,13 @@ class CffFont(object):
                     else:
                         table[key] = values
                 else:
-                    stack.append((operator_type, value))
+                    stack.append((OPERAND_NUMBER, value))
             tables.append(table)
         return tables
 
     def read_font_dict_mapping(self, offset, num_glyphs):
         self.data.set_position(offset)
-        format = self.data.read_integer(1)
-        glyph_id_to_font_dict_index = []
-        if format == 0:
-            for i in range(num_glyphs):
-                glyph_id_to_font_dict_index[i] = self.data.read_integer(1)
-        else:
-            num_ranges = self.data.read_integer(2)
-            range_starting_points = []
-            dict_indexes = []
-            for i in range(num_ranges):
-                range_starting_points.append(self.data.read_integer(2))
-                dict_indexes.append(self.data.read_integer(1))
-            range_starting_points.append(self.data.read_integer(2))
-            glyph_id = range_starting_points[0]
-            assert(glyph_id, 0)
-            # according to the spec the first range doesn't have to start with 0, but the last range is supposed to be
-            # the count, so this format doesn't make sense if the first starting point is non-zero
-            for i in range(num_ranges):
-                while glyph_id < range_starting_points[i + 1]:
-                    glyph_id_to_font_dict_index.append(dict_indexes[i])
-                    glyph_id += 1
-        return glyph_id_to_font_dict_index
+        return FdSelect(self.data, num_glyphs)
 
     @staticmethod
     def get_header_size(data):
@@ -308,26 +378,15 @@ class CffFont(object):
         return header_size
 
     def read_index_table(self):
-        count = self.data.read_integer(2)
-        if count == 0:
-            return []
-        offset_size = self.data.read_integer(1)
-        offsets = []
-        for i in range(count + 1):
-            offsets.append(self.data.read_integer(offset_size))
-        byte_chunks = []
-        for i in range(count):
-            size = offsets[i + 1] - offsets[i]
-            byte_chunks.append(self.data.read_chunk(size))
-        return byte_chunks
+        return Index(self.data)
 
     @staticmethod
     def parse_encoding(data, offset):
         data.set_position(offset)
         if offset == 0:
-            return fonts.cff.encodings.Standard()
+            return fonts.cff.encodings.Standard.get_instance()
         elif offset == 1:
-            return fonts.cff.encodings.Expert()
+            return fonts.cff.encodings.Expert.get_instance()
 
         encoding = fonts.cff.encodings.Encoding()
 
@@ -368,8 +427,8 @@ class CffFont(object):
         char_set_format = data.read_integer(1)
         char_set = []
         if char_set_format == 0:
-            for i in range(num_glyphs):
-                sid = data.read_integer(2)
+            # .notdef glyph isn't included in the charset, even though it's counted in total
+            for sid in data.read_integers(num_glyphs - 1, 2):
                 char_set.append(self.lookup_string_by_index(sid))
         else:
             range_count_size = char_set_format  # format 1 means 1-byte count, format 2 means a 2-byte count
@@ -384,29 +443,37 @@ class CffFont(object):
         return char_set
 
     def stock_char_set(self, offset, num_glyphs):
-        expert_sids = [1, 13, 14, 15, 27, 28, 99, 109, 110, 150, 155, 158, 163, 164, 169]
-        if offset == 0:
-            # ISO/Adobe is just 1-228 inclusive
-            sids_to_include = range(1, 229)
-        else:
-            sids_to_include = expert_sids
-            if offset == 1:
-                # Full expert add all ids from 229 to 378
-                sids_to_include.extend(range(229, 379))
-            else:
-                # Expert subset, which has a bunch of small ranges and random SIDs
-                sids_to_include.extend([231, 232, 272, 300, 301, 302, 305, 314, 315])
-                sids_to_include.extend(range(235, 252))  # 252 is skipped
-                sids_to_include.extend(range(253, 271))  # 271 is skipped
-                sids_to_include.extend(range(320, 347))  # 271 is skipped
-
-        char_set = []
-        for sid in sids_to_include:
-            if len(char_set) == num_glyphs:
-                # This was a request for only the first part of the stock set
-                return char_set
-            char_set.append(self.lookup_string_by_index(sid))
-        return char_set
+        """
+        Returns the glyph names of a predefined charset, which are the same for every font so they're shared.
+        :param int offset: 0 for ISOAdobe, 1 for Expert and 2 for ExpertSubset
+        :param int num_glyphs: number of glyphs in the font, the charset is cut short for fonts with fewer glyphs
+        :rtype: tuple of str
+        """
+        names = self._stock_char_set_names.get(offset)
+        if names is None:
+            char_set = self._stock_char_sets[offset].get_instance()
+            names = tuple(entry.name for entry in char_set.get_entries())
+            self._stock_char_set_names[offset] = names
+        if len(names) > num_glyphs:
+            # This was a request for only the first part of the stock set
+            return names[:num_glyphs]
+        return names
+
+    def read_private(self, private_operands):
+        """
+        Reads a Private DICT along with the local subroutines it points to.
+        :param list private_operands: size and offset of the Private DICT, from a top or font dict
+        :rtype: tuple of (dict, Index), either is None if the font doesn't have it
+        """
+        if not private_operands:
+            return None, None
+        private_data = self.parse_private_data(self.data, private_operands[1], private_operands[0])[0]
+        local_subr_table = None
+        if private_data['Subrs'] is not None:
+            # the Subrs offset is relative to the start of the private dict
+            self.data.set_position(private_operands[1] + private_data['Subrs'])
+            local_subr_table = self.read_index_table()
+        return private_data, local_subr_table
 
     def parse_private_data(self, data, offset, length):
         data.set_position(offset)
@@ -0,0 +1,98 @@
+import array
+from commands import Command, get_command
+
+# the low two bits of each code say what it holds, the rest is the value
+OPERAND_TAG = 0  # an integer operand
+OPERATOR_TAG = 1  # an operator, see COMMANDS_BY_CODE
+REAL_TAG = 2  # an index into the side array of fractional operands
+
+# one byte operators use their own code, escaped operators (12, b1) use 32 + b1
+COMMANDS_BY_CODE = [get_command((b0,)) for b0 in range(32)] + [get_command((12, b1)) for b1 in range(256)]
+CODES_BY_KEY = dict((command.key, code) for (code, command) in enumerate(COMMANDS_BY_CODE))
+
+# charstring integers are at most 16 bits, anything that won't fit in the tagged code goes in the side array
+_MAX_OPERAND = 2 ** 29
+
+
+def index_by_code(handlers_by_key):
+    """
+    Turns a dict keyed by operator into a list indexed by operator code, with None for operators that aren't in it.
+    :param dict handlers_by_key:
+    :rtype: list
+    """
+    return [handlers_by_key.get(command.key) for command in COMMANDS_BY_CODE]
+
+
+class Type2Bytecode(object):
+    """
+    A parsed Type 2 charstring, stored as an array of tagged integers plus a side array for fractional operands rather
+    than a list of objects. Iterating yields the same numbers and Commands as the old list based sequence.
+    """
+    __slots__ = ('_codes', '_reals')
+
+    def __init__(self, codes=None, reals=None):
+        """
+        :param array.array codes: tagged codes, array('i')
+        :param array.array reals: fractional operands, array('d')
+        """
+        if codes is None:
+            codes = array.array('i')
+        if reals is None:
+            reals = array.array('d')
+        self._codes = codes
+        self._reals = reals
+
+    @classmethod
+    def from_sequence(cls, sequence):
+        """
+        :param Iterable sequence: numbers and Commands
+        :rtype: Type2Bytecode
+        """
+        bytecode = cls()
+        for item in sequence:
+            if isinstance(item, Command):
+                bytecode.append_operator(item.key)
+            else:
+                bytecode.append_operand(item)
+        return bytecode
+
+    def append_operand(self, value):
+        if isinstance(value, float) or not -_MAX_OPERAND < value < _MAX_OPERAND:
+            self._codes.append(len(self._reals) << 2 | REAL_TAG)
+            self._reals.append(value)
+        else:
+            self._codes.append(value << 2)
+
+    def append_operator(self, key):
+        self._codes.append(CODES_BY_KEY[key] << 2 | OPERATOR_TAG)
+
+    def get_codes(self):
+        """
+        :rtype: array.array
+        """
+        return self._codes
+
+    def get_reals(self):
+        """
+        :rtype: array.array
+        """
+        return self._reals
+
+    def _decode(self, code):
+        tag = code & 3
+        if tag == OPERAND_TAG:
+            return code >> 2
+        elif tag == OPERATOR_TAG:
+            return COMMANDS_BY_CODE[code >> 2]
+        else:
+            return self._reals[code >> 2]
+
+    def __iter__(self):
+        for code in self._codes:
+            yield self._decode(code)
+
+    def __getitem__(self, index):
+        return self._decode(self._codes[index])
+
+    def __len__(self):
+        return len(self._codes)
@@ -1,6 +1,25 @@
 class Charset(object):
     def __init__(self):
         self._entries = []
+        # indexes into _entries in both directions, the first entry wins when a name or SID repeats
+        self._sids_by_name = {}
+        self._names_by_sid = {}
+        self._frozen = False
+
+    @classmethod
+    def get_instance(cls):
+        """
+        Returns the shared instance of a predefined charset, building it the first time it's needed. Every font using
+        the charset references this instance, so it can't be changed.
+        :rtype: Charset
+        """
+        instance = cls.__dict__.get('_instance')
+        if instance is None:
+            instance = cls()
+            instance._entries = tuple(instance._entries)
+            instance._frozen = True
+            cls._instance = instance
+        return instance
 
     @staticmethod
     def is_font_specific():
@@ -16,10 +35,7 @@ class Charset(object):
         :param int name:
         :rtype: int
         """
-        for entry in self._entries:
-            if entry.name == name:
-                return entry.sid
-        return -1
+        return self._sids_by_name.get(name, -1)
 
     def get_name(self, sid):
         """
@@ -27,10 +43,7 @@ class Charset(object):
         :param int sid:
         :rtype: str
         """
-        for entry in self._entries:
-            if entry.sid == sid:
-                return entry.name
-        return None
+        return self._names_by_sid.get(sid)
 
     def register(self, sid, name):
         """
@@ -46,17 +59,23 @@ class Charset(object):
         Add a single entry.
         :param Entry entry:
         """
+        if self._frozen:
+            raise TypeError("Shared predefined charsets can't be changed")
         self._entries.append(entry)
+        self._sids_by_name.setdefault(entry.name, entry.sid)
+        self._names_by_sid.setdefault(entry.sid, entry.name)
 
     def get_entries(self):
         """
-        A list of all entries within this charset.
+        A list of all entries within this charset, a tuple for the shared predefined charsets.
         :rtype: list of entries
         """
         return self._entries
 
 
 class Entry(object):
+    __slots__ = ('sid', 'name')
+
     def __init__(self, sid, name):
         self.sid = sid
         self.name = name
@@ -1,4 +1,6 @@
-from commands import Command
+from array import array
+from bytecode import CODES_BY_KEY, COMMANDS_BY_CODE, OPERAND_TAG, OPERATOR_TAG, REAL_TAG, Type2Bytecode, index_by_code
+from commands import Command, get_command
 from rawdata import *
 from math import ceil
 
@@ -83,6 +85,20 @@ TYPE2_VOCABULARY = {
     (31,): "hvcurveto",
 }
 
+HSTEM = get_command((1,))
+HSTEMHM = get_command((18,))
+RLINETO = get_command((5,))
+HLINETO = get_command((6,))
+VLINETO = get_command((7,))
+RRCURVETO = get_command((8,))
+CLOSEPATH = get_command((9,))
+HSBW = get_command((13,))
+RMOVETO = get_command((21,))
+SEAC = get_command((12, 6))
+
+RETURN_CODE = CODES_BY_KEY[(11,)] << 2 | OPERATOR_TAG
+_stem_keys = frozenset([(1,), (3,), (18,), (19,), (20,), (23,)])
+
 
 class Type1CharString(object):
     def __init__(self, font_name, glyph_name, sequence=()):
@@ -154,11 +170,7 @@ class Type1CharString(object):
         self._left_side_bearing = Point()
 
         self.handle_sequence(self._sequence)
-
-    def _hsbw(self, stack):
-        left_side_bearing = Point(x=stack[0])
-        self._width = stack[1]
-        self._current_position = left_side_bearing
+        self._rendered = True
 
     def _handle_command(self, stack, command):
         """
@@ -167,69 +179,101 @@ class Type1CharString(object):
         :param Command command:
         :rtype: list
         """
-        name = TYPE1_VOCABULARY[command.key]
-        if name == 'rmoveto':  # since we aren't drawing, only checking bounding box, line and move can share logic
-            if self._is_flex:
-                self._flex_points.append(Point(stack[0], stack[1]))
-            else:
-                self._rline_to(stack[0], stack[1])
-        elif name == 'vmoveto':
-            if self._is_flex:
-                # not in the Type 1 spec, but exists in some fonts
-                self._flex_points.append(Point(y=stack[0]))
-            else:
-                self._rline_to(0, stack[0])
-        elif name == 'hmoveto':
-            if self._is_flex:
-                # not in the Type 1 spec, but exists in some fonts
-                self._flex_points.append(Point(x=stack[0]))
-            else:
-                self._rline_to(stack[0], 0)
-        elif name == 'rlineto':
+        handler = self._command_handlers.get(command.key)
+        if handler is None:
+            raise ValueError("Unknown command: " + TYPE1_VOCABULARY.get(command.key, repr(command.key)))
+        return handler(self, stack)
+
+    # since we aren't drawing, only checking bounding box, line and move can share logic
+    def _rmoveto(self, stack):
+        if self._is_flex:
+            self._flex_points.append(Point(stack[0], stack[1]))
+        else:
             self._rline_to(stack[0], stack[1])
-        elif name == 'hlineto':
-            self._rline_to(stack[0], 0)
-        elif name == 'vlineto':
+
+    def _vmoveto(self, stack):
+        if self._is_flex:
+            # not in the Type 1 spec, but exists in some fonts
+            self._flex_points.append(Point(y=stack[0]))
+        else:
             self._rline_to(0, stack[0])
-        elif name == 'rrcurveto':
-            self._rrcurve_to(stack[0], stack[1], stack[2],
-                             stack[3], stack[4], stack[5])
-        elif name == 'closepath':
-            pass  # we are only checking the bounding box, so nothing to do here
-        elif name == 'sbw':
-            left_side_bearing = Point(stack[0], stack[1])
-            self._width = stack[2]
-            self._current_position = left_side_bearing
-        elif name == 'hsbw':
-            self._hsbw(stack)
-        elif name == 'vhcurveto':
-            self._rrcurve_to(0, stack[0], stack[1],
-                             stack[2], stack[3], 0)
-        elif name == 'hvcurveto':
-            self._rrcurve_to(stack[0], 0, stack[1],
-                             stack[2], 0, stack[3])
-        elif name == 'setcurrentpoint':
-            self.set_current_point(stack[0], stack[1])
-        elif name == 'callothersubr':
-            self._call_other_subr(stack[0])
-        elif name == 'div':
-            result = float(stack[-2]) / float(stack[-1])
-            del stack[-2:-1]
-            return [result]
-        elif (name == 'hstem' or name == 'vstem' or
-              name == 'hstem3' or name == 'vstem3' or name == 'dotsection'):
-            # ignore hints
-            pass
-        elif name == 'seac':
-            # currently ignoring the drawing of standard encoding accented characters, it's non-trivial to compute
-            # bbox calculations
-            pass
-        elif name == 'endchar':
-            # end
-            pass
+
+    def _hmoveto(self, stack):
+        if self._is_flex:
+            # not in the Type 1 spec, but exists in some fonts
+            self._flex_points.append(Point(x=stack[0]))
         else:
-            raise ValueError("Unknown command: " + name)
-        return []
+            self._rline_to(stack[0], 0)
+
+    def _rlineto(self, stack):
+        self._rline_to(stack[0], stack[1])
+
+    def _hlineto(self, stack):
+        self._rline_to(stack[0], 0)
+
+    def _vlineto(self, stack):
+        self._rline_to(0, stack[0])
+
+    def _rrcurveto(self, stack):
+        self._rrcurve_to(stack[0], stack[1], stack[2],
+                         stack[3], stack[4], stack[5])
+
+    def _sbw(self, stack):
+        left_side_bearing = Point(stack[0], stack[1])
+        self._width = stack[2]
+        self._current_position = left_side_bearing
+
+    def _hsbw(self, stack):
+        left_side_bearing = Point(x=stack[0])
+        self._width = stack[1]
+        self._current_position = left_side_bearing
+
+    def _vhcurveto(self, stack):
+        self._rrcurve_to(0, stack[0], stack[1],
+                         stack[2], stack[3], 0)
+
+    def _hvcurveto(self, stack):
+        self._rrcurve_to(stack[0], 0, stack[1],
+                         stack[2], 0, stack[3])
+
+    def _setcurrentpoint(self, stack):
+        self.set_current_point(stack[0], stack[1])
+
+    def _callothersubr(self, stack):
+        self._call_other_subr(stack[0])
+
+    def _div(self, stack):
+        return stack[:-2] + [float(stack[-2]) / float(stack[-1])]
+
+    def _ignore(self, stack):
+        # hints, closepath and endchar don't change the bounding box, and seac is currently ignored since drawing
+        # standard encoding accented characters is non-trivial for bbox calculations
+        pass
+
+    _command_handlers = {
+        (21,): _rmoveto,
+        (4,): _vmoveto,
+        (22,): _hmoveto,
+        (5,): _rlineto,
+        (6,): _hlineto,
+        (7,): _vlineto,
+        (8,): _rrcurveto,
+        (12, 7): _sbw,
+        (13,): _hsbw,
+        (30,): _vhcurveto,
+        (31,): _hvcurveto,
+        (12, 33): _setcurrentpoint,
+        (12, 16): _callothersubr,
+        (12, 12): _div,
+        (9,): _ignore,
+        (1,): _ignore,
+        (3,): _ignore,
+        (12, 0): _ignore,
+        (12, 1): _ignore,
+        (12, 2): _ignore,
+        (12, 6): _ignore,
+        (14,): _ignore,
+    }
 
     def set_current_point(self, x, y):
         """
@@ -313,15 +357,20 @@ class Type1CharString(object):
 
 class Type2CharString(Type1CharString):
     """
-    Represents a Type 2 CharString by converting it into an equivalent Type 1 CharString.
+    Represents a Type 2 CharString. Width and bounds come straight from the Type 2 sequence, the equivalent Type 1
+    sequence is only built if it's asked for.
     """
     def __init__(self, font_name, glyph_name, sequence, default_width, nominal_width):
         super(Type2CharString, self).__init__(font_name, glyph_name)
         self._default_width = default_width or 0
         self._nominal_width = nominal_width or 0
         self._path_count = 0
+        if not isinstance(sequence, Type2Bytecode):
+            sequence = Type2Bytecode.from_sequence(sequence)
         self._type2sequence = sequence
-        self._sequence = self._convert_type2_to_type1(sequence)
+        self._sequence = None
+        self._x = 0
+        self._y = 0
 
     def get_width(self):
         width = super(Type2CharString, self).get_width()
@@ -331,6 +380,10 @@ class Type2CharString(Type1CharString):
             return width
 
     def get_type2_sequence(self):
+        """
+        Returns the Type 2 sequence, iterating it yields numbers and Commands.
+        :rtype: Type2Bytecode
+        """
         return self._type2sequence
 
     def _get_width_from_stack(self, stack):
@@ -343,6 +396,209 @@ class Type2CharString(Type1CharString):
 
         return width
 
+    def get_sequence(self):
+        """
+        Returns the equivalent Type 1 sequence of commands, converting it the first time it's needed.
+        :rtype: list of commands
+        """
+        if self._sequence is None:
+            self._sequence = self._convert_type2_to_type1(self._type2sequence)
+        return self._sequence
+
+    def render(self):
+        """
+        Computes the width and bounds in one pass straight over the Type 2 sequence, without converting it to Type 1.
+        Like the Type 1 rendering, the bounds cover the origin and the end point of every segment.
+        """
+        self._x = 0
+        self._y = 0
+        self._width = None
+        self._bounding_box = BoundingBox()
+        handlers = self._metrics_handlers_by_code
+        reals = self._type2sequence.get_reals()
+        stack = []
+        for code in self._type2sequence.get_codes():
+            tag = code & 3
+            if tag == OPERAND_TAG:
+                stack.append(code >> 2)
+            elif tag == OPERATOR_TAG:
+                handler = handlers[code >> 2]
+                if handler is None:
+                    key = COMMANDS_BY_CODE[code >> 2].key
+                    raise ValueError("Unknown command: " + TYPE2_VOCABULARY.get(key, repr(key)))
+                results = handler(self, stack)
+                del stack[:]
+                if results:
+                    stack.extend(results)
+            else:
+                stack.append(reals[code >> 2])
+        if self._width is None:
+            self._width = self._default_width
+        self._rendered = True
+
+    def _check_width(self, stack, width_present):
+        # only the first stack clearing operator can have the width in front of its arguments
+        if self._width is None:
+            if width_present:
+                self._width = stack[0] + self._nominal_width
+            else:
+                self._width = self._default_width
+
+    def _move_by(self, delta_x, delta_y):
+        x = self._x = self._x + delta_x
+        y = self._y = self._y + delta_y
+        bounding_box = self._bounding_box
+        if x < bounding_box.min_x:
+            bounding_box.min_x = x
+        elif x > bounding_box.max_x:
+            bounding_box.max_x = x
+        if y < bounding_box.min_y:
+            bounding_box.min_y = y
+        elif y > bounding_box.max_y:
+            bounding_box.max_y = y
+
+    def _measure_hints(self, stack):
+        # stems and masks (with their implied vstems) take pairs of arguments
+        self._check_width(stack, len(stack) % 2 == 1)
+
+    def _measure_rmoveto(self, stack):
+        self._check_width(stack, len(stack) > 2)
+        self._move_by(stack[-2], stack[-1])
+
+    def _measure_hmoveto(self, stack):
+        self._check_width(stack, len(stack) > 1)
+        self._move_by(stack[-1], 0)
+
+    def _measure_vmoveto(self, stack):
+        self._check_width(stack, len(stack) > 1)
+        self._move_by(0, stack[-1])
+
+    def _measure_endchar(self, stack):
+        # endchar takes either nothing or the four seac arguments, the accent isn't included in the bounds
+        self._check_width(stack, len(stack) % 2 == 1)
+
+    def _measure_rlineto(self, stack):
+        for i in range(0, len(stack) - 1, 2):
+            self._move_by(stack[i], stack[i + 1])
+
+    def _measure_hlineto(self, stack):
+        self._measure_alternating_lines(stack, True)
+
+    def _measure_vlineto(self, stack):
+        self._measure_alternating_lines(stack, False)
+
+    def _measure_alternating_lines(self, stack, is_horizontal):
+        for value in stack:
+            if is_horizontal:
+                self._move_by(value, 0)
+            else:
+                self._move_by(0, value)
+            is_horizontal = not is_horizontal
+
+    def _measure_rrcurveto(self, stack):
+        self._measure_curves(stack, 0, len(stack))
+
+    def _measure_curves(self, stack, start, end):
+        for i in range(start, end - 5, 6):
+            self._move_by(stack[i] + stack[i + 2] + stack[i + 4], stack[i + 1] + stack[i + 3] + stack[i + 5])
+
+    def _measure_rcurveline(self, stack):
+        self._measure_curves(stack, 0, len(stack) - 2)
+        self._move_by(stack[-2], stack[-1])
+
+    def _measure_rlinecurve(self, stack):
+        for i in range(0, len(stack) - 7, 2):
+            self._move_by(stack[i], stack[i + 1])
+        self._measure_curves(stack, len(stack) - 6, len(stack))
+
+    def _measure_hhcurveto(self, stack):
+        # an odd argument at the start moves the first curve off the axis
+        start = len(stack) % 4
+        delta_y = stack[0] if start else 0
+        for i in range(start, len(stack) - 3, 4):
+            self._move_by(stack[i] + stack[i + 1] + stack[i + 3], delta_y + stack[i + 2])
+            delta_y = 0
+
+    def _measure_vvcurveto(self, stack):
+        start = len(stack) % 4
+        delta_x = stack[0] if start else 0
+        for i in range(start, len(stack) - 3, 4):
+            self._move_by(delta_x + stack[i + 1], stack[i] + stack[i + 2] + stack[i + 3])
+            delta_x = 0
+
+    def _measure_hvcurveto(self, stack):
+        self._measure_alternating_curves(stack, True)
+
+    def _measure_vhcurveto(self, stack):
+        self._measure_alternating_curves(stack, False)
+
+    def _measure_alternating_curves(self, stack, is_horizontal):
+        count = len(stack)
+        for i in range(0, count - 3, 4):
+            # the last curve can have a fifth argument that moves its end off the axis
+            last = stack[i + 4] if count - i == 5 else 0
+            if is_horizontal:
+                self._move_by(stack[i] + stack[i + 1] + last, stack[i + 2] + stack[i + 3])
+            else:
+                self._move_by(stack[i + 1] + stack[i + 3], stack[i] + stack[i + 2] + last)
+            is_horizontal = not is_horizontal
+
+    def _measure_div(self, stack):
+        # the quotient stays on the stack for the next operator
+        return self._div(stack)
+
+    def _measure_flex(self, stack):
+        # the flex depth at the end is only a rendering hint
+        self._measure_curves(stack, 0, 12)
+
+    def _measure_hflex(self, stack):
+        self._move_by(stack[0] + stack[1] + stack[3], stack[2])
+        self._move_by(stack[4] + stack[5] + stack[6], -stack[2])
+
+    def _measure_hflex1(self, stack):
+        # the last point returns to the starting y
+        self._move_by(stack[0] + stack[2] + stack[4], stack[1] + stack[3])
+        self._move_by(stack[5] + stack[6] + stack[8], -(stack[1] + stack[3]))
+
+    def _measure_flex1(self, stack):
+        delta_x = stack[0] + stack[2] + stack[4] + stack[6] + stack[8]
+        delta_y = stack[1] + stack[3] + stack[5] + stack[7] + stack[9]
+        self._move_by(stack[0] + stack[2] + stack[4], stack[1] + stack[3] + stack[5])
+        # the last argument is along whichever axis the flex travels furthest, the other returns to the start
+        if abs(delta_x) > abs(delta_y):
+            self._move_by(stack[6] + stack[8] + stack[10], -(stack[1] + stack[3] + stack[5]))
+        else:
+            self._move_by(-(stack[0] + stack[2] + stack[4]), stack[7] + stack[9] + stack[10])
+
+    _metrics_handlers = {
+        (1,): _measure_hints,
+        (3,): _measure_hints,
+        (18,): _measure_hints,
+        (23,): _measure_hints,
+        (19,): _measure_hints,
+        (20,): _measure_hints,
+        (21,): _measure_rmoveto,
+        (22,): _measure_hmoveto,
+        (4,): _measure_vmoveto,
+        (14,): _measure_endchar,
+        (5,): _measure_rlineto,
+        (6,): _measure_hlineto,
+        (7,): _measure_vlineto,
+        (8,): _measure_rrcurveto,
+        (24,): _measure_rcurveline,
+        (25,): _measure_rlinecurve,
+        (26,): _measure_vvcurveto,
+        (27,): _measure_hhcurveto,
+        (30,): _measure_vhcurveto,
+        (31,): _measure_hvcurveto,
+        (12, 35): _measure_flex,
+        (12, 34): _measure_hflex,
+        (12, 36): _measure_hflex1,
+        (12, 37): _measure_flex1,
+        (12, 12): _measure_div,
+    }
+    _metrics_handlers_by_code = index_by_code(_metrics_handlers)
+
     def _convert_type2_to_type1(self, type2_sequence):
         """
         Converts a sequence of Type 2 commands into a sequence of Type 1 commands.
@@ -351,10 +607,12 @@ class Type2CharString(Type1CharString):
         """
         type1sequence = []
         stack = []
+        conversions = self._conversions
         for obj in type2_sequence:
             if isinstance(obj, Command):
-                self._convert_command(stack, obj, type1sequence)
-                del stack[:]
+                conversion = conversions.get(obj.key, Type2CharString._convert_other)
+                # conversions only return anything for operators that leave results on the stack
+                stack = conversion(self, stack, obj, type1sequence) or []
             else:
                 stack.append(obj)
         return type1sequence
@@ -371,97 +629,129 @@ class Type2CharString(Type1CharString):
             type1sequence.extend(stack)
         type1sequence.append(command)
 
-    def _convert_command(self, stack, command, type1sequence):
-        name = TYPE2_VOCABULARY[command.key]
-        if name == 'hstem':
-            stack = self._clear_stack(stack, len(stack) % 2 != 0, type1sequence)
-            self._expand_stem_hints(stack, True, type1sequence)
-        elif name == 'vstem':
-            stack = self._clear_stack(stack, len(stack) % 2 != 0, type1sequence)
-            self._expand_stem_hints(stack, True, type1sequence)
-        elif name == 'vmoveto':
-            stack = self._clear_stack(stack, len(stack) > 1, type1sequence)
-            self._mark_path(type1sequence)
-            self._add_command(command, stack, type1sequence)
-        elif name == 'rlineto':
-            self._add_command_list(stack, 2, command, type1sequence)
-        elif name == 'hlineto':
-            self._draw_alternating_line(stack, True, type1sequence)
-        elif name == 'vlineto':
-            self._draw_alternating_line(stack, False, type1sequence)
-        elif name == 'rrcurveto':
-            self._add_command_list(stack, 6, command, type1sequence)
-        elif name == 'endchar':
-            stack = self._clear_stack(stack, len(stack) == 5, type1sequence)
-            self._close_path(type1sequence)
-            if len(stack) == 4:
-                stack.insert(0, 0)
-                self._add_command(Command((12, 6)), stack, type1sequence)
-            else:
-                self._add_command(command, stack, type1sequence)
-        elif name == 'rmoveto':
-            stack = self._clear_stack(stack, len(stack) > 2, type1sequence)
-            self._mark_path(type1sequence)
-            self._add_command(command, stack, type1sequence)
-        elif name == 'hmoveto':
-            stack = self._clear_stack(stack, len(stack) > 1, type1sequence)
-            self._mark_path(type1sequence)
-            self._add_command(command, stack, type1sequence)
-        elif name == 'vhcurveto':
-            self._draw_alternating_curve(stack, False, type1sequence)
-        elif name == 'hvcurveto':
-            self._draw_alternating_curve(stack, True, type1sequence)
-        elif name == 'hflex':
-            stack = [stack[0], 0, stack[1], stack[2], stack[3], 0, stack[4], 0, stack[5], -stack[2], stack[6], 0]
-            self._add_command_list(stack, 6, Command((8,)), type1sequence)
-        elif name == 'flex':
-            self._add_command_list(stack, 6, Command((8,)), type1sequence)
-        elif name == 'hflex1':
-            stack.insert(5, 0)
-            stack.insert(7, 0)
-            stack.append(0)
-            self._add_command_list(stack, 6, Command((8,)), type1sequence)
-        elif name == 'flex1':
-            dx = 0
-            dy = 0
-            for i in range(start=0, stop=10, step=2):
-                dx += stack[i]
-                dy += stack[i + 1]
-            if abs(dx) > abs(dy):
-                self._add_command_list(stack[0:11].append(-dy), 6, Command((8,)), type1sequence)
-            else:
-                stack.insert(10, -dx)
-                self._add_command_list(stack[0:12], 6, Command((8,)), type1sequence)
-        elif name == 'hstemhm':
-            stack = self._clear_stack(stack, len(stack) % 2 != 0, type1sequence)
-            self._expand_stem_hints(stack, True, type1sequence)
-        elif name == 'hintmask' or name == 'cntrmask':
-            stack = self._clear_stack(stack, len(stack) % 2 != 0, type1sequence)
-            if len(stack) > 0:
-                self._expand_stem_hints(stack, False, type1sequence)
-        elif name == 'vstemhm':
-            stack = self._clear_stack(stack, len(stack) % 2 != 0, type1sequence)
+    def _convert_stem(self, stack, command, type1sequence):
+        stack = self._clear_stack(stack, len(stack) % 2 != 0, type1sequence)
+        self._expand_stem_hints(stack, command.key in (HSTEM.key, HSTEMHM.key), type1sequence)
+
+    def _convert_mask(self, stack, command, type1sequence):
+        stack = self._clear_stack(stack, len(stack) % 2 != 0, type1sequence)
+        if len(stack) > 0:
+            # stems right before the mask are an implied vstemhm
             self._expand_stem_hints(stack, False, type1sequence)
-        elif name == 'rcurveline':
-            self._add_command_list(stack[0:-2], 6, Command((8,)), type1sequence)
-            self._add_command(stack[-2:], Command((5,)), type1sequence)
-        elif name == 'rlinecurve':
-            self._add_command_list(stack[0:-6], 2, Command((5,)), type1sequence)
-            self._add_command(Command((8,)), stack[-6:], type1sequence)
-        elif name == 'vvcurveto':
-            self._draw_curve(stack, False, type1sequence)
-        elif name == 'hhcurveto':
-            self._draw_curve(stack, True, type1sequence)
+
+    def _convert_move(self, stack, command, type1sequence):
+        argument_count = 2 if command is RMOVETO else 1
+        stack = self._clear_stack(stack, len(stack) > argument_count, type1sequence)
+        self._mark_path(type1sequence)
+        self._add_command(command, stack, type1sequence)
+
+    def _convert_rlineto(self, stack, command, type1sequence):
+        self._add_command_list(stack, 2, RLINETO, type1sequence)
+
+    def _convert_hlineto(self, stack, command, type1sequence):
+        self._draw_alternating_line(stack, True, type1sequence)
+
+    def _convert_vlineto(self, stack, command, type1sequence):
+        self._draw_alternating_line(stack, False, type1sequence)
+
+    def _convert_rrcurveto(self, stack, command, type1sequence):
+        self._add_command_list(stack, 6, RRCURVETO, type1sequence)
+
+    def _convert_endchar(self, stack, command, type1sequence):
+        # endchar takes either nothing or the four seac arguments, so an odd count means a width is present
+        stack = self._clear_stack(stack, len(stack) % 2 == 1, type1sequence)
+        self._close_path(type1sequence)
+        if len(stack) == 4:
+            self._add_command(SEAC, [0] + stack, type1sequence)
         else:
             self._add_command(command, stack, type1sequence)
 
+    def _convert_vhcurveto(self, stack, command, type1sequence):
+        self._draw_alternating_curve(stack, False, type1sequence)
+
+    def _convert_hvcurveto(self, stack, command, type1sequence):
+        self._draw_alternating_curve(stack, True, type1sequence)
+
+    def _convert_hflex(self, stack, command, type1sequence):
+        stack = [stack[0], 0, stack[1], stack[2], stack[3], 0, stack[4], 0, stack[5], -stack[2], stack[6], 0]
+        self._add_command_list(stack, 6, RRCURVETO, type1sequence)
+
+    def _convert_flex(self, stack, command, type1sequence):
+        # the flex depth at the end is only a rendering hint
+        self._add_command_list(stack[0:12], 6, RRCURVETO, type1sequence)
+
+    def _convert_hflex1(self, stack, command, type1sequence):
+        # the last point returns to the starting y
+        last_dy = -(stack[1] + stack[3] + stack[7])
+        stack = stack[0:5] + [0] + stack[5:6] + [0] + stack[6:9] + [last_dy]
+        self._add_command_list(stack, 6, RRCURVETO, type1sequence)
+
+    def _convert_flex1(self, stack, command, type1sequence):
+        dx = sum(stack[0:10:2])
+        dy = sum(stack[1:10:2])
+        # the last argument is along whichever axis the flex travels furthest, the other returns to the start
+        if abs(dx) > abs(dy):
+            stack = stack[0:11] + [-dy]
+        else:
+            stack = stack[0:10] + [-dx, stack[10]]
+        self._add_command_list(stack, 6, RRCURVETO, type1sequence)
+
+    def _convert_rcurveline(self, stack, command, type1sequence):
+        self._add_command_list(stack[0:-2], 6, RRCURVETO, type1sequence)
+        self._add_command(RLINETO, stack[-2:], type1sequence)
+
+    def _convert_rlinecurve(self, stack, command, type1sequence):
+        self._add_command_list(stack[0:-6], 2, RLINETO, type1sequence)
+        self._add_command(RRCURVETO, stack[-6:], type1sequence)
+
+    def _convert_vvcurveto(self, stack, command, type1sequence):
+        self._draw_curve(stack, False, type1sequence)
+
+    def _convert_hhcurveto(self, stack, command, type1sequence):
+        self._draw_curve(stack, True, type1sequence)
+
+    def _convert_div(self, stack, command, type1sequence):
+        # evaluated here rather than passed on, so the quotient is converted along with the operands that follow it
+        return self._div(stack)
+
+    def _convert_other(self, stack, command, type1sequence):
+        self._add_command(command, stack, type1sequence)
+
+    _conversions = {
+        (1,): _convert_stem,
+        (3,): _convert_stem,
+        (18,): _convert_stem,
+        (23,): _convert_stem,
+        (19,): _convert_mask,
+        (20,): _convert_mask,
+        (4,): _convert_move,
+        (21,): _convert_move,
+        (22,): _convert_move,
+        (5,): _convert_rlineto,
+        (6,): _convert_hlineto,
+        (7,): _convert_vlineto,
+        (8,): _convert_rrcurveto,
+        (14,): _convert_endchar,
+        (30,): _convert_vhcurveto,
+        (31,): _convert_hvcurveto,
+        (12, 34): _convert_hflex,
+        (12, 35): _convert_flex,
+        (12, 36): _convert_hflex1,
+        (12, 37): _convert_flex1,
+        (24,): _convert_rcurveline,
+        (25,): _convert_rlinecurve,
+        (26,): _convert_vvcurveto,
+        (27,): _convert_hhcurveto,
+        (12, 12): _convert_div,
+    }
+
     def _clear_stack(self, stack, width_present, sequence):
         if len(sequence) == 0:
             if width_present:
                 width = stack.pop(0) + self._nominal_width
             else:
                 width = self._default_width
-            self._add_command(Command((13,)), [0, width], sequence)
+            self._add_command(HSBW, [0, width], sequence)
         return stack
 
     def _expand_stem_hints(self, stack, is_horizontal, sequence):
@@ -474,75 +764,51 @@ class Type2CharString(Type1CharString):
         self._path_count += 1
 
     def _close_path(self, sequence):
-        if self._path_count > 0:
-            command = sequence[-1]
-        else:
-            command = None
-
-        close_path_command = Command((9,))
-
-        if command and command.key != close_path_command.key:
-            self._add_command(close_path_command, [], sequence)
+        if self._path_count > 0 and sequence[-1] is not CLOSEPATH:
+            self._add_command(CLOSEPATH, [], sequence)
 
     def _draw_alternating_line(self, stack, is_horizontal, sequence):
-        while len(stack) > 0:
+        for value in stack:
             if is_horizontal:
-                command = Command((6,))
+                self._add_command(HLINETO, [value], sequence)
             else:
-                command = Command((7,))
-
-            value = stack.pop(0)
-            self._add_command(command, [value], sequence)
+                self._add_command(VLINETO, [value], sequence)
             is_horizontal = not is_horizontal
 
     def _draw_alternating_curve(self, stack, is_horizontal, sequence):
-        while len(stack) > 0:
-            is_last = len(stack) == 5
-
+        start = 0
+        while len(stack) - start >= 4:
+            is_last = len(stack) - start == 5
+            (d1, d2, d3, d4) = stack[start:start + 4]
+            last = stack[start + 4] if is_last else 0
             if is_horizontal:
-                curve_stack = [stack[0], 0, stack[1], stack[2]]
-                if is_last:
-                    curve_stack.append(stack[4])
-                else:
-                    curve_stack.append(0)
-                curve_stack.append(stack[3])
+                curve_stack = [d1, 0, d2, d3, last, d4]
             else:
-                curve_stack = [0]
-                curve_stack.extend(stack[0:4])
-                if is_last:
-                    curve_stack.append(stack[4])
-                else:
-                    curve_stack.append(0)
-            if is_last:
-                del stack[0:5]
-            else:
-                del stack[0:4]
-            self._add_command(Command((8,)), curve_stack, sequence)
+                curve_stack = [0, d1, d2, d3, d4, last]
+            start += 5 if is_last else 4
+            self._add_command(RRCURVETO, curve_stack, sequence)
             is_horizontal = not is_horizontal
 
     def _draw_curve(self, stack, is_horizontal, sequence):
-        while len(stack) > 0:
-            is_first = len(stack) % 4 == 1
+        start = 0
+        first = 0
+        if len(stack) % 4 == 1:
+            # an odd argument at the start moves the first curve off the axis
+            first = stack[0]
+            start = 1
+        while len(stack) - start >= 4:
+            (da, db_x, db_y, dc) = stack[start:start + 4]
             if is_horizontal:
-                if is_first:
-                    curve_stack = [stack[1], stack[0], stack[2], stack[3], stack[4]]
-                else:
-                    curve_stack = [stack[0], 0, stack[1], stack[2], stack[3]]
+                curve_stack = [da, first, db_x, db_y, dc, 0]
             else:
-                if is_first:
-                    curve_stack = stack[0:5]
-                else:
-                    curve_stack = [0].extend(stack[0:4])
-            if is_first:
-                del stack[0:5]
-            else:
-                del stack[0:4]
-            self._add_command(Command((8,)), curve_stack, sequence)
+                curve_stack = [first, da, db_x, db_y, 0, dc]
+            first = 0
+            start += 4
+            self._add_command(RRCURVETO, curve_stack, sequence)
 
     def _add_command_list(self, stack, slice_length, command, sequence):
-        while len(stack) >= slice_length:
-            self._add_command(command, stack[0:slice_length], sequence)
-            del stack[0:slice_length]
+        for start in range(0, len(stack) - slice_length + 1, slice_length):
+            self._add_command(command, stack[start:start + slice_length], sequence)
 
 
 class Point(object):
@@ -560,46 +826,84 @@ class BoundingBox(object):
 
 
 class Type2CharStringParser(object):
-    def __init__(self):
+    """
+    Flattens a Type 2 charstring into Type2Bytecode, inlining any subroutine calls.
+    """
+    _mask_operators = ((19,), (20,))
+
+    def __init__(self, subroutine_cache=None):
+        """
+        :param dict subroutine_cache: decoded subroutines, shared by every glyph that uses the same subroutine
+        indexes, so each subroutine is only decoded once per font (or font dict for CID fonts)
+        """
         self._hstem_count = 0
         self._vstem_count = 0
-        self._sequence = []
+        # number of operands since the last stack clearing operator
+        self._stack_depth = 0
+        self._codes = array('i')
+        self._reals = array('d')
+        self._subroutine_cache = subroutine_cache
+        # [codes start, depends on calling context, cacheable, reals start] for each subroutine being decoded
+        self._subroutine_frames = []
 
     def parse(self, data, global_subr_index, local_subr_index, init=True):
-
+        """
+        :param WalkableString data:
+        :param Index global_subr_index:
+        :param Index local_subr_index:
+        :param bool init: start a new charstring rather than adding to the current one
+        :rtype: Type2Bytecode
+        """
         local_subroutine_index_provided = local_subr_index and len(local_subr_index) > 0
         global_subroutine_index_provided = global_subr_index and len(global_subr_index) > 0
         if init:
             self._hstem_count = 0
             self._vstem_count = 0
-            self._sequence = []
-        while not data.is_exhausted():
-            (operand_type, value) = read_unknown_thing(data, True)
-            if value == (10,) and local_subroutine_index_provided:
-                # process local subr command
-                self.parse_subroutine(local_subr_index, global_subr_index, True)
-            elif value == (29,) and global_subroutine_index_provided:
-                self.parse_subroutine(global_subr_index, local_subr_index, False)
-            elif value == (28,):
-                # special handling for shortint which is a forward looking operator
-                self._sequence.append(data.read_integer(2, True))
-            elif operand_type == OPERAND_OPERATION:
-                command = Command(value)
-                if value == (1,) or value == (18,):
-                    self._hstem_count += self._stack_size() / 2
-                elif value == (3,) or value == (19,) or value == (20,) or value == (23,):
-                    self._vstem_count += self._stack_size() / 2
+            self._stack_depth = 0
+            self._codes = array('i')
+            self._reals = array('d')
+            self._subroutine_frames = []
+        codes = self._codes
+        stack_depth = self._stack_depth
+        while data.get_position() < len(data):
+            # tokenizing stops after any hintmask, since the mask bytes that follow it aren't tokens
+            for value in read_tokens(data, True, self._mask_operators):
+                if value.__class__ is int:
+                    codes.append(value << 2)
+                    stack_depth += 1
+                elif not isinstance(value, tuple):
+                    codes.append(len(self._reals) << 2 | REAL_TAG)
+                    self._reals.append(value)
+                    stack_depth += 1
+                elif (value == (10,) and local_subroutine_index_provided or
+                      value == (29,) and global_subroutine_index_provided):
+                    self._stack_depth = stack_depth
+                    if value == (10,):
+                        self.parse_subroutine(local_subr_index, global_subr_index, True)
+                    else:
+                        self.parse_subroutine(global_subr_index, local_subr_index, False)
+                    stack_depth = self._stack_depth
+                elif value == (11,):
+                    # return leaves the stack alone, it's removed once the subroutine is done
+                    codes.append(RETURN_CODE)
+                else:
+                    self._count_hints(value, stack_depth)
                     if value == (19,) or value == (20,):
+                        # the number of mask bytes depends on the hints declared so far, which can come from the caller
+                        for frame in self._subroutine_frames:
+                            frame[1] = True
                         mask_length = self._get_mask_length()
-                        for i in range(1, mask_length + 1):
-                            data.read_integer(1)  # need to clear hintmask bytes, just throwing them out for now
-                self._sequence.append(command)
-            else:
-                self._sequence.append(value)
-        return self._sequence
+                        data.set_position(mask_length, data.RELATIVE_TO_CURRENT)  # just throwing them out for now
+                    codes.append(CODES_BY_KEY[value] << 2 | OPERATOR_TAG)
+                    stack_depth = 0
+        self._stack_depth = stack_depth
+        return Type2Bytecode(self._codes, self._reals)
 
     def parse_subroutine(self, index, other_index, local_routine):
-        operand = self._sequence.pop(-1)
+        if self._subroutine_frames and len(self._codes) <= self._subroutine_frames[-1][0]:
+            # the subroutine number was pushed by the caller, so this subroutine decodes differently per call
+            self._subroutine_frames[-1][2] = False
+        operand = self._pop_operand()
         number_subroutines = len(index)
         if number_subroutines < 1240:
             bias = 107
@@ -609,14 +913,93 @@ class Type2CharStringParser(object):
             bias = 32768
         subroutine_index = bias + operand
         if subroutine_index < len(index):
+            key = (local_routine, subroutine_index)
+            context = (self._hstem_count + self._vstem_count, self._stack_depth)
+            if self._subroutine_cache is not None:
+                cached = self._subroutine_cache.get(key)
+                if cached is not None and (cached[0] is None or cached[0] == context):
+                    self._splice(cached)
+                    return
+
+            frame = [len(self._codes), False, True, len(self._reals)]
+            self._subroutine_frames.append(frame)
             subroutine_bytes = index[subroutine_index]
             if local_routine:
                 self.parse(subroutine_bytes, other_index, index, False)
             else:
                 self.parse(subroutine_bytes, index, other_index, False)
-            last_item = self._sequence[-1]
-            if isinstance(last_item, Command) and last_item.key == (11,):
-                self._sequence.pop(-1)  # remove "return" command
+            if len(self._codes) > frame[0] and self._codes[-1] == RETURN_CODE:
+                self._codes.pop()  # remove "return" command
+            self._subroutine_frames.pop()
+            if self._subroutine_frames:
+                self._subroutine_frames[-1][1] = self._subroutine_frames[-1][1] or frame[1]
+                self._subroutine_frames[-1][2] = self._subroutine_frames[-1][2] and frame[2]
+
+            if self._subroutine_cache is not None and frame[2]:
+                self._subroutine_cache[key] = self._build_cache_entry(frame, context)
+
+    def _pop_operand(self):
+        self._stack_depth -= 1
+        code = self._codes.pop()
+        tag = code & 3
+        if tag == OPERAND_TAG:
+            return code >> 2
+        elif tag == REAL_TAG:
+            return int(self._reals.pop())
+        raise ValueError("Subroutine call without a subroutine number")
+
+    def _build_cache_entry(self, frame, context):
+        """
+        Captures a freshly decoded subroutine along with how it changes the hint counts and stack depth, so splicing
+        it in later doesn't need to look at each code.
+        """
+        codes = self._codes[frame[0]:]
+        reals = self._reals[frame[3]:]
+        if reals:
+            # fractional operands are stored relative to the subroutine's first one
+            codes = array('i', (code - (frame[3] << 2) if code & 3 == REAL_TAG else code for code in codes))
+        stems = []
+        depth = 0
+        has_operator = False
+        for code in codes:
+            if code & 3 != OPERATOR_TAG:
+                depth += 1
+            elif code != RETURN_CODE:
+                command = COMMANDS_BY_CODE[code >> 2]
+                if command.key in _stem_keys:
+                    # stems before the first operator also count operands left by the caller
+                    stems.append((command.key, depth, not has_operator))
+                depth = 0
+                has_operator = True
+        return context if frame[1] else None, codes, reals, stems, has_operator, depth
+
+    def _splice(self, entry):
+        """
+        Appends an already decoded subroutine, replaying its stem hints so the hint counts stay correct.
+        """
+        (context, codes, reals, stems, has_operator, depth) = entry
+        if self._subroutine_frames and context is not None:
+            self._subroutine_frames[-1][1] = True
+        for (key, stem_depth, counts_caller_operands) in stems:
+            if counts_caller_operands:
+                stem_depth += self._stack_depth
+            self._count_hints(key, stem_depth)
+        if reals:
+            real_start = len(self._reals) << 2
+            self._codes.extend(code + real_start if code & 3 == REAL_TAG else code for code in codes)
+            self._reals.extend(reals)
+        else:
+            self._codes.extend(codes)
+        if has_operator:
+            self._stack_depth = depth
+        else:
+            self._stack_depth += depth
+
+    def _count_hints(self, value, stack_depth):
+        if value == (1,) or value == (18,):
+            self._hstem_count += stack_depth / 2
+        elif value == (3,) or value == (19,) or value == (20,) or value == (23,):
+            self._vstem_count += stack_depth / 2
 
     def _get_mask_length(self):
         hint_count = self._hstem_count + self._vstem_count
@@ -624,13 +1007,3 @@ class Type2CharStringParser(object):
             return int(ceil(hint_count / 8.0))
         else:
             return 1
-
-    def _stack_size(self):
-        count = 0
-        index = -1
-        while index > -len(self._sequence):
-            if isinstance(self._sequence[index], Command):
-                return count
-            count += 1
-            index -= 1
-        return count
\ No newline at end of file
@@ -16,3 +16,25 @@ class Operation(object):
 class Command(Operation):
     def __init__(self, key):
         super(Command, self).__init__(key, ())
+
+
+_commands = {}
+
+
+def get_command(key):
+    """
+    Returns the shared Command for an operator key. Commands never change once built, so every charstring can use the
+    same instance rather than allocating one per operator.
+    :param tuple key: operator code bytes, like (8,) or (12, 35)
+    :rtype: Command
+    """
+    command = _commands.get(key)
+    if command is None:
+        command = _commands.setdefault(key, Command(key))
+    return command
+
+
+for _b0 in range(32):
+    get_command((_b0,))
+for _b1 in range(256):
+    get_command((12, _b1))
@@ -1,6 +1,25 @@
 class Encoding(object):
     def __init__(self):
         self._entries = []
+        # indexes into _entries in both directions, the first entry wins when a code or SID repeats
+        self._codes_by_sid = {}
+        self._sids_by_code = {}
+        self._frozen = False
+
+    @classmethod
+    def get_instance(cls):
+        """
+        Returns the shared instance of a predefined encoding, building it the first time it's needed. Every font using
+        the encoding references this instance, so it can't be changed.
+        :rtype: Encoding
+        """
+        instance = cls.__dict__.get('_instance')
+        if instance is None:
+            instance = cls()
+            instance._entries = tuple(instance._entries)
+            instance._frozen = True
+            cls._instance = instance
+        return instance
 
     @staticmethod
     def is_font_specific():
@@ -16,10 +35,7 @@ class Encoding(object):
         :param int sid:
         :rtype: int
         """
-        for entry in self._entries:
-            if entry.sid == sid:
-                return entry.code
-        return -1
+        return self._codes_by_sid.get(sid, -1)
 
     def get_sid(self, code):
         """
@@ -27,10 +43,7 @@ class Encoding(object):
         :param int code:
         :rtype: int
         """
-        for entry in self._entries:
-            if entry.code == code:
-                return entry.sid
-        return -1
+        return self._sids_by_code.get(code, -1)
 
     def register(self, code, sid):
         """
@@ -39,13 +52,19 @@ class Encoding(object):
         :param int code:
         :param int sid:
         """
+        if self._frozen:
+            raise TypeError("Shared predefined encodings can't be changed")
         self._entries.append(Entry(code, sid))
+        self._codes_by_sid.setdefault(sid, code)
+        self._sids_by_code.setdefault(code, sid)
 
 
 class Entry(object):
     """
     This class represents a single code/SID mapping of the encoding.
     """
+    __slots__ = ('code', 'sid')
+
     def __init__(self, code, sid):
         self.code = code
         self.sid = sid
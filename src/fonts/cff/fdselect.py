@@ -0,0 +1,56 @@
+import array
+import bisect
+import struct
+
+
+class FdSelect(object):
+    """
+    Maps glyph ids to font dict indexes for CID fonts, kept in the compact form it's stored in. Format 0 is one byte
+    per glyph, format 3 is a list of glyph ranges that is searched with bisect.
+    """
+    def __init__(self, data, num_glyphs):
+        """
+        Reads the FDSelect table at the current position of data.
+        :param WalkableString data:
+        :param int num_glyphs:
+        :raises IndexError: if the table runs past the end of data
+        """
+        self._num_glyphs = num_glyphs
+        self.format = data.read_integer(1)
+        if self.format == 0:
+            self._check_length(data, num_glyphs)
+            self._font_dict_indexes = data.read_chunk(num_glyphs).get_data()
+        elif self.format == 3:
+            num_ranges = data.read_integer(2)
+            # each range is a 2 byte first glyph and a 1 byte font dict index, followed by a 2 byte sentinel
+            self._check_length(data, num_ranges * 3 + 2)
+            values = struct.unpack_from('>' + 'HB' * num_ranges, data.get_buffer(), data.get_offset())
+            data.set_position(num_ranges * 3, data.RELATIVE_TO_CURRENT)
+            self._range_starts = array.array('H', values[0::2])
+            self._range_font_dict_indexes = array.array('B', values[1::2])
+            # the sentinel is one past the last glyph of the last range
+            self._range_end = data.read_integer(2)
+        else:
+            raise ValueError("Unsupported FDSelect format {0}".format(self.format))
+
+    @staticmethod
+    def _check_length(data, length):
+        if data.get_position() + length > len(data):
+            raise IndexError("FDSelect runs past the end of the font data")
+
+    def __getitem__(self, glyph_id):
+        """
+        :param int glyph_id:
+        :rtype: int
+        """
+        if not 0 <= glyph_id < self._num_glyphs:
+            raise IndexError("Glyph id {0} out of range".format(glyph_id))
+        if self.format == 0:
+            return ord(self._font_dict_indexes[glyph_id])
+        range_index = bisect.bisect_right(self._range_starts, glyph_id) - 1
+        if range_index < 0 or glyph_id >= self._range_end:
+            raise IndexError("Glyph id {0} isn't covered by FDSelect".format(glyph_id))
+        return self._range_font_dict_indexes[range_index]
+
+    def __len__(self):
+        return self._num_glyphs
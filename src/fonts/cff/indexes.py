@@ -0,0 +1,55 @@
+import array
+from fonts.walkable import WalkableString as WalkableString
+
+
+class Index(object):
+    """
+    A CFF INDEX that only keeps its offset array, entries are sliced out of the underlying data when requested.
+    """
+    def __init__(self, data):
+        """
+        Reads the INDEX header and offsets, leaving data positioned just past the end of the INDEX.
+        :param WalkableString data:
+        """
+        self._buffer = data.get_buffer()
+        count = data.read_integer(2)
+        if count == 0:
+            self._offsets = array.array('I')
+            self._base = data.get_offset()
+            return
+        offset_size = data.read_integer(1)
+        self._offsets = array.array('I', data.read_integers(count + 1, offset_size))
+        # offsets are 1-based, relative to the byte before the first entry
+        self._base = data.get_offset() - 1
+        data.set_position(self._offsets[-1] - 1, WalkableString.RELATIVE_TO_CURRENT)
+
+    def __getitem__(self, index):
+        """
+        Returns a fresh walkable view over one entry, so entries can be walked any number of times.
+        :param int index:
+        :rtype: WalkableString
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("INDEX entry {0} out of range".format(index))
+        return WalkableString(self._buffer, self._base + self._offsets[index], self._base + self._offsets[index + 1])
+
+    def release_content(self):
+        """
+        Copies the entries out of the shared buffer, so the buffer can be released.
+        """
+        if len(self):
+            start = self._base + self._offsets[0]
+            self._buffer = self._buffer[start:self._base + self._offsets[-1]]
+            self._base = -self._offsets[0]
+        else:
+            self._buffer = ''
+            self._base = 0
+
+    def __len__(self):
+        return max(len(self._offsets) - 1, 0)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
@@ -1,3 +1,5 @@
+import struct
+
 OPERAND_SID = 'SID'
 OPERAND_BOOLEAN = 'boolean'
 OPERAND_NUMBER = 'number'
@@ -7,51 +9,180 @@ OPERAND_OPERATION = 'operation'
 
 
 def read_unknown_thing(data, is_charstring=False):
-    b0 = data.read_integer(1)
-    if b0 == 12:
-        # this is a two byte operator code
-        return OPERAND_OPERATION, (b0, data.read_integer(1))
-    elif b0 < 28 or (b0 < 32 and is_charstring):  # dict entries have operands in the 29-31 range, but charstring
-                                                  # has operators in that range
-        # this is a one byte operator code
-        return OPERAND_OPERATION, (b0,)
-    elif b0 == 28:
-        # this is a 2 byte integer (-32768 -> +32767) in b1 and b2
-        return OPERAND_NUMBER, data.read_integer(2)
-    elif b0 == 29:
-        # this is a 4 bit integer (-2^31 -> 2^31 - 1) in b1 -> b4
-        return OPERAND_NUMBER, data.read_integer(4)
-    elif b0 == 30:
-        # real number (sort of a bcd encoding with extra values for '.', '-' and 'e')
-        return OPERAND_NUMBER, get_real_number(data)
-    elif b0 < 32 or b0 > 254:
-        raise ValueError("Invalid CFF operand {0}".format(b0))
-    elif b0 <= 246:
-        # value between -107 and 107
-        return OPERAND_NUMBER, b0 - 139
-    elif b0 <= 250:
-        # mid-size positive value (108 -> 1131)
-        return OPERAND_NUMBER, (b0 - 247) * 256 + data.read_integer(1) + 108
-    else:
-        # mid-size negative value (-1131 -> -108)
-        return OPERAND_NUMBER, (251 - b0) * 256 - data.read_integer(1) - 108
+    offset = data.get_offset()
+    (value, next_offset) = _read_token(data.get_buffer(), offset, _get_end(data), is_charstring)
+    data.set_position(next_offset - offset, data.RELATIVE_TO_CURRENT)
+    if isinstance(value, tuple):
+        return OPERAND_OPERATION, value
+    return OPERAND_NUMBER, value
+
+
+def read_tokens(data, is_charstring=False, stop_at=()):
+    """
+    Decodes the rest of a DICT or charstring in one pass. Operators come back as tuples of their code bytes, the same
+    as read_unknown_thing, and operands as numbers, so the type of each token is just whether it's a tuple.
+    :param WalkableString data: left positioned after the last token read
+    :param bool is_charstring: decode using the charstring encoding rather than the DICT encoding
+    :param tuple stop_at: operators to stop after, for operators followed by data that isn't tokens like hintmask
+    :rtype: list
+    :raises IndexError: if the last token runs past the end of data
+    """
+    decoders = _charstring_decoders if is_charstring else _dict_decoders
+    buffer = data.get_buffer()
+    start = data.get_offset()
+    end = _get_end(data)
+    offset = start
+    tokens = []
+    while offset < end:
+        (value, decoder) = decoders[ord(buffer[offset])]
+        if decoder is None:
+            offset += 1
+        else:
+            (value, offset) = decoder(buffer, offset, end)
+        tokens.append(value)
+        if stop_at and isinstance(value, tuple) and value in stop_at:
+            break
+    data.set_position(offset - start, data.RELATIVE_TO_CURRENT)
+    return tokens
 
 
 def get_real_number(data):
-    # first decode nibbles into a string based on the character mapping
+    offset = data.get_offset()
+    (value, next_offset) = _read_real_number(data.get_buffer(), offset, _get_end(data))
+    data.set_position(next_offset - offset, data.RELATIVE_TO_CURRENT)
+    return value
+
+
+def _get_end(data):
+    """
+    Returns the absolute offset of the end of a walkable region, tokens can't be read past it.
+    """
+    return data.get_offset() + len(data) - data.get_position()
+
+
+def _check_size(offset, size, end):
+    if offset + size > end:
+        raise IndexError("Token runs past the end of the data")
+
+
+def _read_token(buffer, offset, end, is_charstring):
+    _check_size(offset, 1, end)
+    decoders = _charstring_decoders if is_charstring else _dict_decoders
+    (value, decoder) = decoders[ord(buffer[offset])]
+    if decoder is None:
+        return value, offset + 1
+    return decoder(buffer, offset, end)
+
+
+def _read_escaped_operator(buffer, offset, end):
+    # this is a two byte operator code
+    _check_size(offset, 2, end)
+    return _escaped_operators[ord(buffer[offset + 1])], offset + 2
+
+
+def _read_short_integer(buffer, offset, end):
+    # this is a 2 byte integer (-32768 -> +32767) in b1 and b2
+    _check_size(offset, 3, end)
+    return struct.unpack_from('>h', buffer, offset + 1)[0], offset + 3
+
+
+def _read_long_integer(buffer, offset, end):
+    # this is a 4 byte integer (-2^31 -> 2^31 - 1) in b1 -> b4
+    _check_size(offset, 5, end)
+    return struct.unpack_from('>i', buffer, offset + 1)[0], offset + 5
+
+
+def _read_fixed(buffer, offset, end):
+    # charstrings only, a 16.16 fixed point number in b1 -> b4
+    _check_size(offset, 5, end)
+    return struct.unpack_from('>i', buffer, offset + 1)[0] / 65536.0, offset + 5
+
+
+def _read_positive_integer(buffer, offset, end):
+    # mid-size positive value (108 -> 1131)
+    _check_size(offset, 2, end)
+    return (ord(buffer[offset]) - 247) * 256 + ord(buffer[offset + 1]) + 108, offset + 2
+
+
+def _read_negative_integer(buffer, offset, end):
+    # mid-size negative value (-1131 -> -108)
+    _check_size(offset, 2, end)
+    return (251 - ord(buffer[offset])) * 256 - ord(buffer[offset + 1]) - 108, offset + 2
+
+
+def _read_real_number(buffer, offset, end):
+    # real number (sort of a bcd encoding with extra values for '.', '-' and 'e'), decoded a byte at a time
+    offset += 1
+    parts = []
+    while True:
+        _check_size(offset, 1, end)
+        (characters, is_last) = _real_number_bytes[ord(buffer[offset])]
+        if characters is None:
+            raise ValueError("Invalid CFF real number nibble in {0}".format(ord(buffer[offset])))
+        offset += 1
+        parts.append(characters)
+        if is_last:
+            return float(''.join(parts)), offset
+
+
+def _invalid_operand(buffer, offset, end):
+    raise ValueError("Invalid CFF operand {0}".format(ord(buffer[offset])))
+
+
+def _build_real_number_bytes():
     nibble_to_char = {
         0: '0', 1: '1', 2: '2', 3: '3', 4: '4', 5: '5', 6: '6', 7: '7', 8: '8', 9: '9',
-        10: '.', 11: 'e+', 12: 'e-', 14: '-'
+        10: '.', 11: 'e+', 12: 'e-', 13: None, 14: '-', 15: None
     }
-    number_as_string = ''
-    done = False
-    while not done:
-        next_byte = data.read_integer(1)
-        first_nibble = (next_byte & 0xF0) >> 4
-        second_nibble = next_byte & 0xF
-        for nibble in (first_nibble, second_nibble):
-            if nibble < 15:
-                number_as_string += nibble_to_char[nibble]
-            else:
-                done = True
-    return float(number_as_string)
+    real_number_bytes = []
+    for byte in range(256):
+        first_nibble = byte >> 4
+        second_nibble = byte & 0xF
+        if first_nibble == 15:
+            real_number_bytes.append(('', True))
+        elif first_nibble == 13 or second_nibble == 13:
+            real_number_bytes.append((None, True))  # 13 is a reserved nibble
+        elif second_nibble == 15:
+            real_number_bytes.append((nibble_to_char[first_nibble], True))
+        else:
+            real_number_bytes.append((nibble_to_char[first_nibble] + nibble_to_char[second_nibble], False))
+    return real_number_bytes
+
+
+def _build_decoders(is_charstring):
+    """
+    Builds the table used to decode a token from its first byte. Each entry is either (value, None) for single byte
+    tokens, or (None, decoder) where decoder takes the buffer, offset and end offset and returns the value and the next
+    offset, raising IndexError rather than reading past the end.
+    """
+    decoders = []
+    for b0 in range(256):
+        if b0 == 12:
+            decoders.append((None, _read_escaped_operator))
+        elif b0 == 28:
+            decoders.append((None, _read_short_integer))
+        elif b0 < 28 or (b0 < 32 and is_charstring):  # dict entries have operands in the 29-31 range, but charstring
+                                                      # has operators in that range
+            decoders.append(((b0,), None))
+        elif b0 == 29:
+            decoders.append((None, _read_long_integer))
+        elif b0 == 30:
+            decoders.append((None, _read_real_number))
+        elif b0 == 255 and is_charstring:
+            decoders.append((None, _read_fixed))
+        elif b0 < 32 or b0 > 254:
+            decoders.append((None, _invalid_operand))
+        elif b0 <= 246:
+            # value between -107 and 107
+            decoders.append((b0 - 139, None))
+        elif b0 <= 250:
+            decoders.append((None, _read_positive_integer))
+        else:
+            decoders.append((None, _read_negative_integer))
+    return decoders
+
+
+_escaped_operators = [(12, b1) for b1 in range(256)]
+_real_number_bytes = _build_real_number_bytes()
+_dict_decoders = _build_decoders(False)
+_charstring_decoders = _build_decoders(True)
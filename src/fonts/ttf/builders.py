@@ -1,8 +1,52 @@
+import array
+import bisect
+import collections
 import datetime
+from fonts.cache import LruCache
 from fonts.walkable import WalkableString as WalkableString
 import re
+import struct
+import sys
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_native_utf_32 = 'utf-32-le' if sys.byteorder == 'little' else 'utf-32-be'
+# the unicode variation selectors, as inclusive ranges of code points
+_variation_selector_ranges = ((0x180B, 0x180D), (0x180F, 0x180F), (0xFE00, 0xFE0F), (0xE0100, 0xE01EF))
+
+
+def _code_points(text):
+    """
+    :param text: a unicode string, a UTF-8 encoded str, or a sequence of code points
+    :rtype: array.array
+    """
+    codes = array.array('I')
+    if isinstance(text, str):
+        text = text.decode('utf-8')
+    if isinstance(text, unicode):
+        # utf-32 joins surrogate pairs on narrow builds
+        codes.fromstring(text.encode(_native_utf_32))
+    else:
+        codes.extend(text)
+    return codes
+
+
+def _is_variation_selector(code):
+    for (start, end) in _variation_selector_ranges:
+        if start <= code <= end:
+            return True
+    return False
+
 
 class TtfGlyph(object):
+    __slots__ = ('_min_x', '_min_y', '_max_x', '_max_y', '_end_points', '_instructions', '_flags',
+                 'x_coordinates', 'y_coordinates')
+    # glyphs with at least this many points are decoded with numpy when it's available, below that the per-call
+    # overhead of numpy costs more than the python loop
+    numpy_min_points = 40
+
     def __init__(self, content):
         """
         :type content: WalkableString
@@ -12,93 +56,192 @@ class TtfGlyph(object):
         self._min_y = content.read_integer(2, True)
         self._max_x = content.read_integer(2, True)
         self._max_y = content.read_integer(2, True)
-        self._end_points = []
-        self._instructions = []
+        self._end_points = array.array('H')
+        self._instructions = ''
+        self._flags = ''
+        self.x_coordinates = array.array('i')
+        self.y_coordinates = array.array('i')
         if contour_count > 0:
-            max_point_index = -1
-            for i in range(contour_count):
-                self._end_points.append(content.read_integer(2))
-                if self._end_points[-1] > max_point_index:
-                    max_point_index = self._end_points[-1]
+            self._end_points.extend(content.read_integers(contour_count, 2))
+            max_point_index = max(self._end_points)
             number_of_instructions = content.read_integer(2)
-            for i in range(number_of_instructions):
-                self._instructions.append(content.read_integer(1))
-            self._flags = []
-            while len(self._flags) <= max_point_index:
-                flags = content.read_integer(1)
-                self._flags.append(flags)
-                if flags & 1 << 3 > 0:
-                    repeat_count = content.read_integer(1)
-                    for i in range(repeat_count):
-                        self._flags.append(flags)
-            self.x_coordinates = []
-            current_x = 0
-            for i in range(max_point_index + 1):
-                flags = self._flags[i]
-                if flags & 1 << 1 > 0:
-                    x_coord = content.read_integer(1)
-                    if flags & 1 << 4 == 0:
-                        x_coord = -x_coord
-
-                else:
-                    if flags & 1 << 4 > 0:
-                        x_coord = 0
-                    else:
-                        x_coord = content.read_integer(2, True)
-                current_x += x_coord
-                self.x_coordinates.append(current_x)
-            self.y_coordinates = []
-            current_y = 0
-            for i in range(max_point_index + 1):
-                flags = self._flags[i]
-                if flags & 1 << 2 > 0:
-                    y_coord = content.read_integer(1)
-                    if flags & 1 << 4 == 0:
-                        y_coord = -y_coord
-
-                else:
-                    if flags & 1 << 5 > 0:
-                        y_coord = 0
-                    else:
-                        y_coord = content.read_integer(2, True)
-                current_y += y_coord
-                self.y_coordinates.append(current_y)
+            self._instructions = content.read_chunk(number_of_instructions).get_data()
+            point_count = max_point_index + 1
+            if numpy is not None and self.numpy_min_points is not None and point_count >= self.numpy_min_points:
+                (flags, x_coordinates, y_coordinates) = decode_points_numpy(content, point_count)
+                self._flags = flags.tostring()
+                self.x_coordinates.fromstring(x_coordinates.tostring())
+                self.y_coordinates.fromstring(y_coordinates.tostring())
+            else:
+                (self._flags, self.x_coordinates, self.y_coordinates) = decode_points(content, point_count)
 
     def __eq__(self, other):
         if not isinstance(other, TtfGlyph):
             return False
-        if self.__dict__ == other.__dict__:
-            return True
-        if self.__dict__.keys() != other.__dict__.keys():
-            return False
-        for (key, value) in self.__dict__.items():
+        for key in self.__slots__:
             if key in ('x_coordinates', 'y_coordinates'):
-                for (my_coord, other_coord) in zip(self.__dict__[key], other.__dict__[key]):
+                for (my_coord, other_coord) in zip(getattr(self, key), getattr(other, key)):
                     if not -1 <= other_coord - my_coord <= 1:
                         return False
             else:
-                if self.__dict__[key] != other.__dict__[key]:
+                if getattr(self, key) != getattr(other, key):
                     return False
         return True
 
-        return self.__dict__ == other.__dict__
-
     def __ne__(self, other):
         return not self == other
 
 
+def decode_points(content, point_count):
+    """
+    Decodes the flags and absolute coordinates of a simple glyph's points.
+    :param WalkableString content: positioned at the start of the flags
+    :param int point_count:
+    :rtype: tuple of (str, array, array)
+    """
+    flag_list = bytearray()
+    while len(flag_list) < point_count:
+        flags = content.read_integer(1)
+        flag_list.append(flags)
+        if flags & 1 << 3 > 0:
+            repeat_count = content.read_integer(1)
+            flag_list.extend([flags] * repeat_count)
+    x_coordinates = array.array('i')
+    current_x = 0
+    for i in range(point_count):
+        flags = flag_list[i]
+        if flags & 1 << 1 > 0:
+            x_coord = content.read_integer(1)
+            if flags & 1 << 4 == 0:
+                x_coord = -x_coord
+
+        else:
+            if flags & 1 << 4 > 0:
+                x_coord = 0
+            else:
+                x_coord = content.read_integer(2, True)
+        current_x += x_coord
+        x_coordinates.append(current_x)
+    y_coordinates = array.array('i')
+    current_y = 0
+    for i in range(point_count):
+        flags = flag_list[i]
+        if flags & 1 << 2 > 0:
+            y_coord = content.read_integer(1)
+            if flags & 1 << 5 == 0:
+                y_coord = -y_coord
+
+        else:
+            if flags & 1 << 5 > 0:
+                y_coord = 0
+            else:
+                y_coord = content.read_integer(2, True)
+        current_y += y_coord
+        y_coordinates.append(current_y)
+    return str(flag_list), x_coordinates, y_coordinates
+
+
+def decode_points_numpy(content, point_count):
+    """
+    Vectorized version of decode_points, flags are expanded with numpy.repeat and the coordinate deltas are
+    gathered with masks and summed with numpy.cumsum.
+    :param WalkableString content: positioned at the start of the flags
+    :param int point_count:
+    :rtype: tuple of (numpy.ndarray, numpy.ndarray, numpy.ndarray) with uint8 flags and int32 coordinates
+    """
+    # the flags have to be walked to find the repeat counts, but there's only one entry per run
+    flag_values = []
+    run_lengths = []
+    flag_count = 0
+    while flag_count < point_count:
+        flags = content.read_integer(1)
+        run_length = 1
+        if flags & 1 << 3 > 0:
+            run_length += content.read_integer(1)
+        flag_values.append(flags)
+        run_lengths.append(run_length)
+        flag_count += run_length
+    flags = numpy.repeat(numpy.array(flag_values, numpy.uint8), run_lengths)
+    point_flags = flags[:point_count]
+    data = numpy.frombuffer(content.get_buffer(), numpy.uint8, len(content) - content.get_position(),
+                            content.get_offset())
+    (x_coordinates, x_length) = _decode_coordinates_numpy(data, 0, point_flags, 1 << 1, 1 << 4)
+    (y_coordinates, y_length) = _decode_coordinates_numpy(data, x_length, point_flags, 1 << 2, 1 << 5)
+    content.set_position(x_length + y_length, WalkableString.RELATIVE_TO_CURRENT)
+    return flags, x_coordinates, y_coordinates
+
+
+def _decode_coordinates_numpy(data, offset, flags, short_bit, same_bit):
+    """
+    :param numpy.ndarray data: the glyph bytes following the flags
+    :param int offset: where this coordinate array starts in data
+    :param numpy.ndarray flags: one flag per point
+    :param int short_bit: flag bit marking a one byte delta
+    :param int same_bit: flag bit marking a positive short delta, or a repeated coordinate for long ones
+    :rtype: tuple of (numpy.ndarray, int) with the absolute coordinates and the number of bytes read
+    """
+    is_short = flags & short_bit != 0
+    is_same = flags & same_bit != 0
+    is_long = ~(is_short | is_same)
+    sizes = is_short + is_long * 2
+    starts = offset + numpy.cumsum(sizes) - sizes
+    deltas = numpy.zeros(len(flags), numpy.int32)
+    short_values = data[starts[is_short]].astype(numpy.int32)
+    deltas[is_short] = numpy.where(is_same[is_short], short_values, -short_values)
+    long_starts = starts[is_long]
+    long_values = data[long_starts].astype(numpy.int32) << 8 | data[long_starts + 1]
+    deltas[is_long] = long_values - (long_values & 0x8000) * 2
+    return numpy.cumsum(deltas, dtype=numpy.int32), int(sizes.sum())
+
+
 class CmapFormat(object):
+    """
+    A cmap subtable, kept as its segments sorted by start code rather than a dict entry per character code, so memory
+    scales with the number of segments and a lookup is a bisect. Each segment either maps a code to code + delta, or
+    indexes the glyph id array from its offset and adds delta to any glyph id that isn't 0.
+    """
+    # glyph offset for segments that map by delta alone
+    _NO_GLYPH_IDS = -2 ** 31
+    # format 14 offsets are from the start of the subtable, which is 6 bytes before its content
+    _FORMAT_FOURTEEN_HEADER_SIZE = 6
+    # returned by variation_to_glyph_id for sequences that use the character's default glyph
+    DEFAULT_VARIATION = -1
+    # batches of at least this many codes are looked up with numpy when it's available
+    numpy_min_codes = 64
+    # lookup tables built on first use, which aren't part of the subtable's contents
+    _cache_attributes = ('_bmp_glyph_ids', '_numpy_segments')
+
     def __init__(self, sub_table_format, content):
         self.sub_table_format = sub_table_format
         self.content = content
-        self.language = self.content.read_integer(2)
-        self.char_to_glyph_id_map = {}
+        if sub_table_format == 14:
+            self.language = 0  # format 14 has no language
+        else:
+            # the long formats have a 32 bit language
+            self.language = self.content.read_integer(4 if sub_table_format in (8, 10, 12, 13) else 2)
         self.segment_count = 0
         self.end_code = []
         self.start_code = []
         self.id_delta = []
         self.id_range_offset = []
         self.glyph_index_array = []
+        self._starts = array.array('L')
+        self._ends = array.array('L')
+        self._deltas = array.array('l')
+        self._glyph_offsets = array.array('l')
+        self._glyph_ids = array.array('H')
+        self._glyph_mask = 0xFFFF
+        self._bmp_glyph_ids = None
+        self._numpy_segments = None
+        # format 14 records, sorted by selector. The default ranges and non default mappings of every selector are
+        # stored one after the other, the bounds give the slice for the selector at the same index
+        self._selectors = array.array('L')
+        self._default_starts = array.array('L')
+        self._default_ends = array.array('L')
+        self._default_bounds = array.array('L', [0])
+        self._mapping_codes = array.array('L')
+        self._mapping_glyph_ids = array.array('H')
+        self._mapping_bounds = array.array('L', [0])
 
         if sub_table_format == 0:
             self.handle_format_zero()
@@ -109,24 +252,32 @@ class CmapFormat(object):
         elif sub_table_format == 12:
             self.handle_format_twelve()
         elif sub_table_format == 14:
-            pass
+            self.handle_format_fourteen()
         else:
             raise ValueError("Unhandled cmap subtable format")
 
+    @property
+    def char_to_glyph_id_map(self):
+        """
+        :rtype: CmapMapping
+        """
+        return CmapMapping(self)
+
     def handle_format_zero(self):
-        for i in range(256):
-            self.char_to_glyph_id_map[i] = self.content.read_integer(1)
+        self._glyph_ids = array.array('H', self.content.read_integers(256, 1))
+        self._set_segments([0], [255], [0], [0])
 
     def handle_format_twelve(self):
         number_of_groups = self.content.read_integer(4)
-        for i in range(number_of_groups):
-            self.start_code.append(self.content.read_integer(4))
-            self.end_code.append(self.content.read_integer(4))
-            self.id_delta.append(self.content.read_integer(4))
-
-        for (start_code, end_code, glyph_index) in zip(self.start_code, self.end_code, self.id_delta):
-            for code in range(start_code, end_code + 1):
-                self.char_to_glyph_id_map[code] = glyph_index + code - start_code
+        groups = self.content.read_integers(number_of_groups * 3, 4)
+        self.start_code = groups[0::3]
+        self.end_code = groups[1::3]
+        self.id_delta = groups[2::3]
+        self._glyph_mask = 0xFFFFFFFF
+        self._set_segments(self.start_code, self.end_code,
+                           [start_glyph_id - start_code
+                            for (start_code, start_glyph_id) in zip(self.start_code, self.id_delta)],
+                           [self._NO_GLYPH_IDS] * number_of_groups)
 
     def handle_format_four(self):
         segment_count_times_two = self.content.read_integer(2)
@@ -134,67 +285,338 @@ class CmapFormat(object):
         search_range = self.content.read_integer(2)
         entry_selector = self.content.read_integer(2)
         range_shift = self.content.read_integer(2)
-        for i in range(self.segment_count):
-            self.end_code.append(self.content.read_integer(2))
+        self.end_code = self.content.read_integers(self.segment_count, 2)
         reserved_pad = self.content.read_integer(2)
-        for i in range(self.segment_count):
-            self.start_code.append(self.content.read_integer(2))
-        for i in range(self.segment_count):
-            self.id_delta.append(self.content.read_integer(2))
-        for i in range(self.segment_count):
-            self.id_range_offset.append(self.content.read_integer(2))
-        while not self.content.is_exhausted():
-            self.glyph_index_array.append(self.content.read_integer(2))
-
-        for i in range(len(self.start_code)):
-            start_code = self.start_code[i]
-            end_code = self.end_code[i]
-            id_delta = self.id_delta[i]
-            id_range_offset = self.id_range_offset[i]
-            for code in range (start_code, end_code + 1):
-                if id_range_offset:
-                    self.char_to_glyph_id_map[code] = self.glyph_index_array[
-                        id_range_offset / 2 - len(self.id_range_offset) + code - start_code + i
-                ]
-                else:
-                    self.char_to_glyph_id_map[code] = (code + id_delta) % 0x100
-
+        self.start_code = self.content.read_integers(self.segment_count, 2)
+        self.id_delta = self.content.read_integers(self.segment_count, 2)
+        self.id_range_offset = self.content.read_integers(self.segment_count, 2)
+        remaining_length = len(self.content) - self.content.get_position()
+        self.glyph_index_array = self.content.read_integers(remaining_length / 2, 2)
+        self._glyph_ids = array.array('H', self.glyph_index_array)
+
+        # id range offset is a byte offset from its own entry in the id_range_offset array, so the index into the
+        # glyph index array is half of it, less the id_range_offset entries that follow this one. For example if you
+        # had {1 => 2, 2 => 6, 15 => 19, 16 => 35} start_code would be [1, 15], end_code would be [2, 16],
+        # id_range_offset would be [4 6] and the glyph index array [2 6 19 35]
+        glyph_offsets = []
+        for (i, id_range_offset) in enumerate(self.id_range_offset):
+            if id_range_offset:
+                glyph_offsets.append(id_range_offset / 2 - self.segment_count + i)
+            else:
+                glyph_offsets.append(self._NO_GLYPH_IDS)
+        self._set_segments(self.start_code, self.end_code, self.id_delta, glyph_offsets)
 
     def handle_format_six(self):
         first_code = self.content.read_integer(2)
         entry_count = self.content.read_integer(2)
-        for i in range(first_code, first_code + entry_count):
-            self.char_to_glyph_id_map[i] = self.content.read_integer(2)
+        self._glyph_ids = array.array('H', self.content.read_integers(entry_count, 2))
         assert(self.content.is_exhausted())
+        if entry_count:
+            self._set_segments([first_code], [first_code + entry_count - 1], [0], [0])
+
+    def handle_format_fourteen(self):
+        record_count = self.content.read_integer(4)
+        # selectors and character codes are 24 bit, read as a byte and a short
+        records = self._unpack_records('BHII', record_count)
+        for (selector_high, selector_low, default_offset, non_default_offset) in zip(*[iter(records)] * 4):
+            self._selectors.append(selector_high << 16 | selector_low)
+            if default_offset:
+                self.content.set_position(default_offset - self._FORMAT_FOURTEEN_HEADER_SIZE)
+                range_count = self.content.read_integer(4)
+                # each range is a 24 bit start code and an 8 bit count of the codes after it
+                for value in self.content.read_integers(range_count, 4):
+                    self._default_starts.append(value >> 8)
+                    self._default_ends.append((value >> 8) + (value & 0xFF))
+            self._default_bounds.append(len(self._default_starts))
+            if non_default_offset:
+                self.content.set_position(non_default_offset - self._FORMAT_FOURTEEN_HEADER_SIZE)
+                mapping_count = self.content.read_integer(4)
+                mappings = self._unpack_records('BHH', mapping_count)
+                self._mapping_codes.extend([code_high << 16 | code_low
+                                            for (code_high, code_low) in zip(mappings[0::3], mappings[1::3])])
+                self._mapping_glyph_ids.extend(mappings[2::3])
+            self._mapping_bounds.append(len(self._mapping_codes))
+
+    def _unpack_records(self, record_format, record_count):
+        """
+        :raises IndexError: if the records run past the end of the subtable, checked before the count is trusted
+        """
+        if self.content.get_position() + struct.calcsize('>' + record_format) * record_count > len(self.content):
+            raise IndexError("cmap subtable records run past the end of the subtable")
+        record_format = '>' + record_format * record_count
+        values = struct.unpack_from(record_format, self.content.get_buffer(), self.content.get_offset())
+        self.content.set_position(struct.calcsize(record_format), WalkableString.RELATIVE_TO_CURRENT)
+        return values
+
+    def get_variation_selectors(self):
+        """
+        :return: the selectors a format 14 subtable has sequences for
+        :rtype: array.array
+        """
+        return self._selectors
 
-    def character_to_glyph_id(self, character_code):
-        if character_code in self.char_to_glyph_id_map:
-            return self.char_to_glyph_id_map[character_code]
-        glyph_id = 0
-        for i in range(self.segment_count):
-            if character_code <= self.end_code[i]:
-                if character_code < self.start_code[i]:
-                    glyph_id = 0
-                elif self.id_range_offset[i] == 0:
-                    glyph_id = character_code + self.id_delta[i]
-                else:
-                    # id range offset is a byte value, (so we divide by 2 to get an index)
-                    # id_range_offset is relative to it's actual location, so we need to add the current
-                    # index back in. for example if you had {1 => 2, 2 => 6, 15 => 19, 16 => 35)
-                    # start_code would be [1, 15], end_code would be [2, 16], id_range_offset would be [4 6]
-                    # [4 6] [2 6 19 35]
-                    index = self.id_range_offset[i] / 2 + i - self.segment_count + character_code - self.start_code[i]
-                    glyph_id = self.glyph_index_array[index]
-                glyph_id %= 65536
-        self.char_to_glyph_id_map[character_code] = glyph_id
+    def variation_to_glyph_id(self, character_code, selector):
+        """
+        Looks up a variation sequence in a format 14 subtable.
+        :param int character_code: the base character
+        :param int selector: the variation selector following it
+        :return: the glyph id of the variant, DEFAULT_VARIATION if the sequence uses the character's default glyph,
+        or None if the subtable doesn't have the sequence
+        """
+        record = bisect.bisect_left(self._selectors, selector)
+        if record == len(self._selectors) or self._selectors[record] != selector:
+            return None
+        (start, end) = (self._mapping_bounds[record], self._mapping_bounds[record + 1])
+        index = bisect.bisect_left(self._mapping_codes, character_code, start, end)
+        if index < end and self._mapping_codes[index] == character_code:
+            return self._mapping_glyph_ids[index]
+        (start, end) = (self._default_bounds[record], self._default_bounds[record + 1])
+        index = bisect.bisect_right(self._default_starts, character_code, start, end) - 1
+        if index >= start and character_code <= self._default_ends[index]:
+            return self.DEFAULT_VARIATION
+        return None
+
+    def _set_segments(self, starts, ends, deltas, glyph_offsets):
+        segments = zip(starts, ends, deltas, glyph_offsets)
+        if any(segments[i][0] > segments[i + 1][0] for i in range(len(segments) - 1)):
+            segments.sort()
+        self._starts = array.array('L', [segment[0] for segment in segments])
+        self._ends = array.array('L', [segment[1] for segment in segments])
+        self._deltas = array.array('l', [segment[2] for segment in segments])
+        self._glyph_offsets = array.array('l', [segment[3] for segment in segments])
+
+    def find_segment(self, character_code):
+        """
+        :param int character_code:
+        :return: the index of the segment covering the code, or -1 if no segment does
+        :rtype: int
+        """
+        segment = bisect.bisect_right(self._starts, character_code) - 1
+        if segment >= 0 and character_code > self._ends[segment]:
+            return -1
+        return segment
+
+    def segment_glyph_id(self, segment, character_code):
+        """
+        :param int segment: a segment index from find_segment
+        :param int character_code: a code covered by the segment
+        :rtype: int
+        """
+        glyph_offset = self._glyph_offsets[segment]
+        if glyph_offset == self._NO_GLYPH_IDS:
+            return (character_code + self._deltas[segment]) & self._glyph_mask
+        index = glyph_offset + character_code - self._starts[segment]
+        if not 0 <= index < len(self._glyph_ids):
+            return 0
+        glyph_id = self._glyph_ids[index]
+        if glyph_id:
+            glyph_id = (glyph_id + self._deltas[segment]) & self._glyph_mask
         return glyph_id
 
+    def character_to_glyph_id(self, character_code):
+        segment = self.find_segment(character_code)
+        if segment < 0:
+            return 0
+        return self.segment_glyph_id(segment, character_code)
+
+    def iter_mappings(self):
+        """
+        Yields (character code, glyph id) in code order for every code a segment maps to a glyph. Codes that come out
+        as glyph 0, like the 0xFFFF that ends a format 4 subtable, aren't mapped.
+        """
+        for segment in range(len(self._starts)):
+            for code in xrange(self._starts[segment], self._ends[segment] + 1):
+                glyph_id = self.segment_glyph_id(segment, code)
+                if glyph_id:
+                    yield code, glyph_id
+
+    def code_count(self):
+        """
+        :return: the number of codes iter_mappings yields
+        :rtype: int
+        """
+        count = 0
+        period = self._glyph_mask + 1
+        for segment in range(len(self._starts)):
+            (start, end) = (self._starts[segment], self._ends[segment])
+            if start > end:
+                continue
+            if self._glyph_offsets[segment] != self._NO_GLYPH_IDS:
+                count += sum(1 for code in xrange(start, end + 1) if self.segment_glyph_id(segment, code))
+                continue
+            # a delta segment maps every code to a glyph except the ones where code + delta wraps round to 0
+            first_unmapped = start + (-self._deltas[segment] - start) % period
+            unmapped = (end - first_unmapped) // period + 1 if first_unmapped <= end else 0
+            count += end - start + 1 - unmapped
+        return count
+
+    def characters_to_glyph_ids(self, codes):
+        """
+        Maps a batch of character codes in one call. Codes in the BMP are read from a 64K entry table built on first
+        use, anything above it is looked up from the segments.
+        :param array.array codes: character codes, array('I')
+        :rtype: array.array
+        """
+        bmp_glyph_ids = self.get_bmp_glyph_ids()
+        glyph_ids = array.array('I')
+        if numpy is not None and self.numpy_min_codes is not None and len(codes) >= self.numpy_min_codes:
+            numpy_codes = numpy.frombuffer(codes, numpy.uint32).astype(numpy.int64)
+            numpy_glyph_ids = numpy.frombuffer(bmp_glyph_ids, numpy.uint32)[numpy_codes & 0xFFFF]
+            is_astral = numpy_codes > 0xFFFF
+            if is_astral.any():
+                numpy_glyph_ids[is_astral] = self._numpy_glyph_ids(numpy_codes[is_astral])
+            glyph_ids.fromstring(numpy_glyph_ids.astype(numpy.uint32).tostring())
+        else:
+            lookup = self.character_to_glyph_id
+            glyph_ids.extend([bmp_glyph_ids[code] if code <= 0xFFFF else lookup(code) for code in codes])
+        return glyph_ids
+
+    def get_bmp_glyph_ids(self):
+        """
+        :return: the glyph id of every code from 0 to 0xFFFF
+        :rtype: array.array
+        """
+        if self._bmp_glyph_ids is None:
+            bmp_glyph_ids = array.array('I')
+            if numpy is not None:
+                bmp_glyph_ids.fromstring(self._numpy_glyph_ids(numpy.arange(0x10000)).tostring())
+            else:
+                bmp_glyph_ids.extend([0] * 0x10000)
+                for segment in range(len(self._starts)):
+                    start = self._starts[segment]
+                    end = min(self._ends[segment], 0xFFFF)
+                    if start > end:
+                        continue
+                    bmp_glyph_ids[start:end + 1] = array.array(
+                        'I', [self.segment_glyph_id(segment, code) for code in xrange(start, end + 1)])
+            self._bmp_glyph_ids = bmp_glyph_ids
+        return self._bmp_glyph_ids
+
+    def build_reverse_index(self):
+        """
+        Builds the glyph id to character code index in compressed sparse row form, the codes for glyph id g are
+        codes[offsets[g]:offsets[g + 1]] in code order. Codes that map to glyph 0 aren't included.
+        :rtype: tuple of (array.array, array.array) with the offsets and codes
+        """
+        offsets = array.array('I')
+        codes = array.array('I')
+        if numpy is not None:
+            (numpy_offsets, numpy_codes) = self._build_reverse_index_numpy()
+            offsets.fromstring(numpy_offsets.astype(numpy.uint32).tostring())
+            codes.fromstring(numpy_codes.astype(numpy.uint32).tostring())
+        else:
+            mappings = sorted((glyph_id, code) for (code, glyph_id) in self.iter_mappings() if glyph_id)
+            glyph_count = mappings[-1][0] + 1 if mappings else 0
+            counts = [0] * (glyph_count + 1)
+            for (glyph_id, code) in mappings:
+                counts[glyph_id + 1] += 1
+                codes.append(code)
+            total = 0
+            for count in counts:
+                total += count
+                offsets.append(total)
+        return offsets, codes
+
+    def _build_reverse_index_numpy(self):
+        """
+        Vectorized version of the reverse index build, every covered code is generated from the segment bounds and
+        the codes are grouped by glyph id with a stable sort.
+        :rtype: tuple of (numpy.ndarray, numpy.ndarray) with the offsets and codes
+        """
+        starts = numpy.array(self._starts, numpy.int64)
+        lengths = numpy.maximum(numpy.array(self._ends, numpy.int64) - starts + 1, 0)
+        segment_firsts = numpy.cumsum(lengths) - lengths
+        codes = numpy.repeat(starts - segment_firsts, lengths) + numpy.arange(lengths.sum(), dtype=numpy.int64)
+        glyph_ids = self._numpy_glyph_ids(codes).astype(numpy.int64)
+        is_mapped = glyph_ids != 0
+        codes = codes[is_mapped]
+        glyph_ids = glyph_ids[is_mapped]
+        order = numpy.argsort(glyph_ids, kind='mergesort')
+        counts = numpy.bincount(glyph_ids)
+        offsets = numpy.zeros(len(counts) + 1, numpy.int64)
+        numpy.cumsum(counts, out=offsets[1:])
+        return offsets, codes[order]
+
+    def _numpy_glyph_ids(self, codes):
+        """
+        Vectorized version of character_to_glyph_id, the segments are found with numpy.searchsorted.
+        :param numpy.ndarray codes: int64 character codes
+        :rtype: numpy.ndarray of uint32
+        """
+        if self._numpy_segments is None:
+            self._numpy_segments = (
+                numpy.array(self._starts, numpy.int64), numpy.array(self._ends, numpy.int64),
+                numpy.array(self._deltas, numpy.int64), numpy.array(self._glyph_offsets, numpy.int64),
+                numpy.array(self._glyph_ids, numpy.int64))
+        (starts, ends, deltas, glyph_offsets, glyph_id_array) = self._numpy_segments
+        glyph_ids = numpy.zeros(len(codes), numpy.uint32)
+        if not len(starts):
+            return glyph_ids
+        segments = numpy.searchsorted(starts, codes, 'right') - 1
+        is_covered = segments >= 0
+        segments[~is_covered] = 0
+        is_covered &= codes <= ends[segments]
+        segment_deltas = deltas[segments]
+        segment_glyph_offsets = glyph_offsets[segments]
+        by_delta = is_covered & (segment_glyph_offsets == self._NO_GLYPH_IDS)
+        glyph_ids[by_delta] = (codes[by_delta] + segment_deltas[by_delta]) & self._glyph_mask
+        by_index = is_covered & ~by_delta
+        indexes = segment_glyph_offsets[by_index] + codes[by_index] - starts[segments[by_index]]
+        is_in_range = (indexes >= 0) & (indexes < len(glyph_id_array))
+        indexed_glyph_ids = numpy.zeros(len(indexes), numpy.int64)
+        indexed_glyph_ids[is_in_range] = glyph_id_array[indexes[is_in_range]]
+        is_mapped = indexed_glyph_ids != 0
+        indexed_glyph_ids[is_mapped] = (indexed_glyph_ids[is_mapped] + segment_deltas[by_index][is_mapped]) & \
+            self._glyph_mask
+        glyph_ids[by_index] = indexed_glyph_ids
+        return glyph_ids
+
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, CmapFormat):
+            return False
+        for key in self.__dict__:
+            if key not in self._cache_attributes and self.__dict__[key] != other.__dict__.get(key):
+                return False
+        return True
 
     def __ne__(self, other):
         return not self == other
 
+
+class CmapMapping(collections.Mapping):
+    """
+    A read only view of a cmap subtable as a dict of character code to glyph id, looked up from its segments. Codes
+    that map to glyph 0 aren't in it.
+    """
+    def __init__(self, sub_table):
+        """
+        :param CmapFormat sub_table:
+        """
+        self._sub_table = sub_table
+
+    def __getitem__(self, character_code):
+        glyph_id = self._sub_table.character_to_glyph_id(character_code)
+        if not glyph_id:
+            raise KeyError(character_code)
+        return glyph_id
+
+    def __contains__(self, character_code):
+        return self._sub_table.character_to_glyph_id(character_code) != 0
+
+    def __iter__(self):
+        for (code, glyph_id) in self._sub_table.iter_mappings():
+            yield code
+
+    def iteritems(self):
+        return self._sub_table.iter_mappings()
+
+    def items(self):
+        return list(self._sub_table.iter_mappings())
+
+    def __len__(self):
+        return self._sub_table.code_count()
+
+
 class TtfTable(object):
     def __init__(self, content):
         """
@@ -210,6 +632,12 @@ class TtfTable(object):
     def serialize(self):
         return self.content
 
+    def release_content(self):
+        """
+        Copies the table's bytes out of the font data, so the font data can be released.
+        """
+        self.content = self.content.detach()
+
     def __eq__(self, other):
         return self.__dict__ == other.__dict__
 
@@ -233,20 +661,58 @@ class TtfTable(object):
 
 
 class TtfGlyfTable(TtfTable):
+    default_cache_size = 1024
+
     def __init__(self, content):
         super(TtfGlyfTable, self).__init__(content)
-        self._glyphs = []
+        self._locations = []
+        self._glyph_cache = LruCache(self.default_cache_size)
 
-    def parse(self, start, length):
-        if length == 0:
-            self._glyphs.append(None)
-        else:
-            self.content.set_position(start)
-            content = self.content.read_chunk(length)
-            self._glyphs.append(TtfGlyph(content))
+    def parse(self, loca_table):
+        """
+        Glyphs are decoded the first time they are requested, so parsing only keeps track of where they are.
+        :param TtfLocaTable loca_table:
+        """
+        self._locations = loca_table.locations
 
     def get_glyph(self, glyph_id):
-        return self._glyphs[glyph_id]
+        glyph = self._glyph_cache.get(glyph_id, self)  # empty glyphs are cached as None, so miss with self
+        if glyph is self:
+            glyph = self._decode_glyph(glyph_id)
+            self._glyph_cache.put(glyph_id, glyph)
+        return glyph
+
+    def _decode_glyph(self, glyph_id):
+        if not 0 <= glyph_id < self.glyph_count():
+            raise IndexError("Glyph id {0} out of range".format(glyph_id))
+        start = self._locations[glyph_id]
+        length = self._locations[glyph_id + 1] - start
+        if length == 0:
+            return None
+        self.content.set_position(start)
+        return TtfGlyph(self.content.read_chunk(length))
+
+    def glyph_count(self):
+        return max(len(self._locations) - 1, 0)
+
+    def set_cache_size(self, cache_size):
+        """
+        :param int cache_size: number of decoded glyphs to keep, 0 disables caching and None keeps every glyph
+        """
+        self._glyph_cache.set_max_size(cache_size)
+
+    def get_cache(self):
+        """
+        The cache of decoded glyphs, which keeps hit and miss counts
+        :rtype: LruCache
+        """
+        return self._glyph_cache
+
+    def __eq__(self, other):
+        # glyphs are decoded from the content at the loca locations, so comparing those covers every glyph
+        if not isinstance(other, TtfGlyfTable):
+            return False
+        return self.content == other.content and list(self._locations) == list(other._locations)
 
 
 class TtfHeadTable(TtfTable):
@@ -319,9 +785,11 @@ class TtfMaxpTable(TtfTable):
         self.glyph_count = 0
 
     def parse(self):
-        self.content.set_position(4, WalkableString.RELATIVE_TO_START)  # skip over version
+        version = self.content.read_integer(4)
         self.glyph_count = self.content.read_integer(2)
-        self.content.set_position(26, WalkableString.RELATIVE_TO_CURRENT)  # skipping 13 shorts
+        if version == 0x00010000:
+            self.content.set_position(26, WalkableString.RELATIVE_TO_CURRENT)  # skipping 13 shorts
+        # version 0.5 (fonts with CFF outlines) stops after the glyph count
         assert(self.content.is_exhausted())
 
 
@@ -336,32 +804,44 @@ class TtfLocaTable(TtfTable):
         self.locations = []
 
     def parse(self, glyph_count, index_to_loc_is_long):
-        for i in range(glyph_count + 1):
-            if index_to_loc_is_long:
-                self.locations.append(self.content.read_integer(4))
-            else:
-                self.locations.append(self.content.read_integer(2) * 2)
+        if index_to_loc_is_long:
+            self.locations = self.content.read_integers(glyph_count + 1, 4)
+        else:
+            self.locations = [location * 2 for location in self.content.read_integers(glyph_count + 1, 2)]
 
     def parse_glyphs(self, glyph_table):
-        for (start, end) in zip(self.locations[:-1], self.locations[1:]):
-            glyph_table.parse(start, end - start)
+        glyph_table.parse(self)
 
     def get_glyph_offsets(self, glyph_id):
         return self.locations[glyph_id], self.locations[glyph_id + 1]
 
 
 class TtfCmapTable(TtfTable):
+    # (platform id, platform specific id) of the subtables that map unicode, best first
+    unicode_sub_table_keys = ((3, 10), (0, 6), (0, 4), (3, 1), (0, 3), (0, 2), (0, 1), (0, 0))
+    # where the unicode variation sequences subtable lives
+    variation_sub_table_key = (0, 5)
+
     def __init__(self, content):
         super(TtfCmapTable, self).__init__(content)
         self.sub_tables = {}
+        # built from the preferred unicode subtable on first use, every encoding shares it
+        self._reverse_index = None
+        self.exclude_from_comparison = ['_reverse_index']
 
     def parse(self):
         version = self.content.read_integer(2)
         number_of_sub_tables = self.content.read_integer(2)
+        # encodings often share a subtable, like unicode and windows unicode BMP, so they share the CmapFormat and
+        # its lookup tables too
+        sub_tables_by_offset = {}
         for i in range(number_of_sub_tables):
             platform_id = self.content.read_integer(2)
             platform_specific_id = self.content.read_integer(2)
             offset = self.content.read_integer(4)
+            if offset in sub_tables_by_offset:
+                self.sub_tables[(platform_id, platform_specific_id)] = sub_tables_by_offset[offset]
+                continue
             current_position = self.content.get_position()
             self.content.set_position(offset, WalkableString.RELATIVE_TO_START)
             # There's some weirdness where we are running out of the cmap table data here
@@ -370,14 +850,154 @@ class TtfCmapTable(TtfTable):
                 if sub_table_format < 8:
                     length = self.content.read_integer(2)
                     sub_table_content = self.content.read_chunk(length - 4)
+                elif sub_table_format == 14:
+                    # format 14 has a 32 bit length but no '.0' before it
+                    length = self.content.read_integer(4)
+                    sub_table_content = self.content.read_chunk(length - 6)
                 else:
                     self.content.set_position(2, WalkableString.RELATIVE_TO_CURRENT)  # skip the '.0' for the long formats
                     length = self.content.read_integer(4)
                     sub_table_content = self.content.read_chunk(length - 8)
                 self.sub_tables[(platform_id, platform_specific_id)] = self.create_subtable(
                     sub_table_format, sub_table_content)
+                sub_tables_by_offset[offset] = self.sub_tables[(platform_id, platform_specific_id)]
             self.content.set_position(current_position)
 
+    def get_unicode_sub_table(self):
+        """
+        :return: the subtable to map unicode text with, the first of unicode_sub_table_keys that the font has
+        :rtype: CmapFormat
+        """
+        for key in self.unicode_sub_table_keys:
+            if key in self.sub_tables:
+                return self.sub_tables[key]
+        return None
+
+    def text_to_glyph_ids(self, text, sub_table_key=None):
+        """
+        Maps a whole string to glyph ids in one call, characters the subtable doesn't map come back as glyph 0.
+        :param text: a unicode string, a UTF-8 encoded str, or a sequence of code points
+        :param tuple sub_table_key: (platform id, platform specific id) of the subtable to use, by default the best
+        unicode one
+        :rtype: array.array
+        """
+        return self._codes_to_glyph_ids(_code_points(text), sub_table_key)
+
+    def text_to_glyph_ids_with_variations(self, text, sub_table_key=None):
+        """
+        Like text_to_glyph_ids, except that a variation selector picks the variant glyph of the character before it
+        rather than getting a glyph of its own, so there's one glyph id per character that isn't a selector.
+        Sequences the font doesn't have fall back to the character's default glyph.
+        :param text: a unicode string, a UTF-8 encoded str, or a sequence of code points
+        :param tuple sub_table_key: (platform id, platform specific id) of the subtable to use for default glyphs, by
+        default the best unicode one
+        :rtype: array.array
+        """
+        codes = _code_points(text)
+        glyph_ids = self._codes_to_glyph_ids(codes, sub_table_key)
+        selector_positions = self._find_variation_selectors(codes)
+        if not selector_positions:
+            return glyph_ids
+        variations = self.get_variation_sub_table()
+        variant_glyph_ids = array.array('I')
+        start = 0
+        for position in selector_positions:
+            if variations is not None and position > start:
+                glyph_id = variations.variation_to_glyph_id(codes[position - 1], codes[position])
+                if glyph_id is not None and glyph_id != variations.DEFAULT_VARIATION:
+                    glyph_ids[position - 1] = glyph_id
+            variant_glyph_ids.extend(glyph_ids[start:position])
+            start = position + 1
+        variant_glyph_ids.extend(glyph_ids[start:])
+        return variant_glyph_ids
+
+    def variation_to_glyph_id(self, character_code, selector, sub_table_key=None):
+        """
+        :param int character_code: the base character
+        :param int selector: the variation selector following it
+        :param tuple sub_table_key: (platform id, platform specific id) of the subtable to use for default glyphs, by
+        default the best unicode one
+        :return: the glyph id for the sequence, or 0 if the font doesn't have it
+        :rtype: int
+        """
+        variations = self.get_variation_sub_table()
+        if variations is None:
+            return 0
+        glyph_id = variations.variation_to_glyph_id(character_code, selector)
+        if glyph_id is None:
+            return 0
+        if glyph_id == variations.DEFAULT_VARIATION:
+            return self._codes_to_glyph_ids(array.array('I', [character_code]), sub_table_key)[0]
+        return glyph_id
+
+    def glyph_id_to_codes(self, glyph_id):
+        """
+        :param int glyph_id:
+        :return: the character codes the preferred unicode subtable maps to the glyph, in code order. Glyph 0 and
+        glyphs nothing maps to have none
+        :rtype: array.array
+        """
+        (offsets, codes) = self.get_reverse_index()
+        if not 0 < glyph_id < len(offsets) - 1:
+            return array.array('I')
+        return codes[offsets[glyph_id]:offsets[glyph_id + 1]]
+
+    def get_reverse_index(self):
+        """
+        The glyph id to character code index of the preferred unicode subtable, built on first use.
+        :rtype: tuple of (array.array, array.array) with the offsets and codes, see CmapFormat.build_reverse_index
+        """
+        if self._reverse_index is None:
+            sub_table = self.get_unicode_sub_table()
+            if sub_table is None:
+                self._reverse_index = (array.array('I', [0]), array.array('I'))
+            else:
+                self._reverse_index = sub_table.build_reverse_index()
+        return self._reverse_index
+
+    def get_variation_sub_table(self):
+        """
+        :return: the format 14 subtable, if the font has one
+        :rtype: CmapFormat
+        """
+        return self.sub_tables.get(self.variation_sub_table_key)
+
+    def _codes_to_glyph_ids(self, codes, sub_table_key):
+        if sub_table_key is None:
+            sub_table = self.get_unicode_sub_table()
+        else:
+            sub_table = self.sub_tables.get(sub_table_key)
+        if sub_table is None:
+            return array.array('I', [0]) * len(codes)
+        return sub_table.characters_to_glyph_ids(codes)
+
+    @staticmethod
+    def _find_variation_selectors(codes):
+        """
+        :param array.array codes:
+        :return: the positions of the variation selectors in codes
+        :rtype: list of int
+        """
+        if numpy is not None and CmapFormat.numpy_min_codes is not None and len(codes) >= CmapFormat.numpy_min_codes:
+            numpy_codes = numpy.frombuffer(codes, numpy.uint32)
+            is_selector = numpy.zeros(len(codes), numpy.bool_)
+            for (start, end) in _variation_selector_ranges:
+                is_selector |= (numpy_codes >= start) & (numpy_codes <= end)
+            return numpy.flatnonzero(is_selector).tolist()
+        first_selector = _variation_selector_ranges[0][0]
+        return [position for (position, code) in enumerate(codes)
+                if code >= first_selector and _is_variation_selector(code)]
+
+    def __eq__(self, other):
+        return self._custom_comparison(other)
+
+    def release_content(self):
+        super(TtfCmapTable, self).release_content()
+        # encodings can share a subtable, which only needs copying once
+        sub_tables = dict((id(sub_table), sub_table) for sub_table in self.sub_tables.values())
+        for sub_table in sub_tables.values():
+            sub_table.content = sub_table.content.detach()
+
     def code_to_gid_maps(self):
         code_to_gid_maps = {}
         for key, table in self.sub_tables.items():
@@ -389,6 +1009,48 @@ class TtfCmapTable(TtfTable):
         return CmapFormat(sub_table_format, content)
 
 
+class TtfTableDirectory(collections.Mapping):
+    """
+    Maps table tags to table objects, building and parsing each table the first time it is looked up.
+    """
+    def __init__(self, load_table):
+        """
+        :param load_table: callable taking (tag, content) that builds and parses a table
+        """
+        self._load_table = load_table
+        self._content = WalkableString('')
+        self._entries = {}
+        self._tables = {}
+
+    def set_content(self, content):
+        """
+        :param WalkableString content: the whole font, table offsets are relative to it
+        """
+        self._content = content
+
+    def add_entry(self, tag, offset, length):
+        self._entries[tag] = (offset, length)
+
+    def is_loaded(self, tag):
+        return tag in self._tables
+
+    def __getitem__(self, tag):
+        if tag not in self._tables:
+            (offset, length) = self._entries[tag]
+            self._content.set_position(offset, WalkableString.RELATIVE_TO_START)
+            self._tables[tag] = self._load_table(tag, self._content.read_chunk(length))
+        return self._tables[tag]
+
+    def __contains__(self, tag):
+        return tag in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+
 class TtfFont(object):
     """
         { CHR('a','c','n','t'), N_("accent attachment table") },
@@ -474,8 +1136,9 @@ class TtfFont(object):
         self.onlystrikes = False
         self.onlyonestrike = False
         self.use_typo_metrics = True
-        self._tables = {}
+        self._tables = TtfTableDirectory(self._load_table)
         self.name = ''
+        self.sfnt_version = '\x00\x01\x00\x00'
 
     def glyph_count(self):
         loca_length = len(self._tables['loca'].data)
@@ -511,43 +1174,74 @@ class TtfFont(object):
         content = font_file.read()
         self.read_from_content(content)
 
-    def read_from_content(self, content):
+    def read_from_content(self, content, lazy=False):
+        """
+        :param content: the font data
+        :param bool lazy: only read the table directory now, parsing each table the first time it is requested
+        """
         walkable_content = WalkableString(content)
         version = walkable_content.read_chunk(4)
         if version == 'ttcf':
             raise ValueError("Collections not supported")
+        self.sfnt_version = version.get_data()
         table_count = walkable_content.read_integer(2)
         # skip searchRange, entrySelector, rangeshift
         walkable_content.set_position(6, WalkableString.RELATIVE_TO_CURRENT)
         for i in range(table_count):
-            tag = walkable_content.read_chunk(4).data
+            tag = walkable_content.read_chunk(4).get_data()
             checksum = walkable_content.read_integer(4)
             offset = walkable_content.read_integer(4)
             length = walkable_content.read_integer(4)
             if offset and length:
-                current_position = walkable_content.get_position()
-                walkable_content.set_position(offset, WalkableString.RELATIVE_TO_START)
-                if tag in self._table_parser_map:
-                    table_class = self._table_parser_map[tag]
-                    self._tables[tag] = table_class(walkable_content.read_chunk(length))
-                else:
-                    self._tables[tag] = TtfTable(walkable_content.read_chunk(length))
-                if tag != 'loca' and tag != 'glyf':
-                    self._tables[tag].parse()
-                walkable_content.set_position(current_position, WalkableString.RELATIVE_TO_START)
-        if 'loca' in self._tables and 'head' in self._tables and 'maxp' in self._tables:
-            self._tables['loca'].parse(self._tables['maxp'].glyph_count, self._tables['head'].index_to_loc_is_long)
-            if 'glyf' in self._tables:
-                self._tables['loca'].parse_glyphs(self._tables['glyf'])
+                self._tables.add_entry(tag, offset, length)
+        self._tables.set_content(walkable_content)
+        if not lazy:
+            for tag in self._tables:
+                self._tables[tag]  # looking a table up is enough to build and parse it
 
         self.check_table_conflicts()
 
+    def release_content(self):
+        """
+        Parses every table that hasn't been, and copies the bytes each table still reads from out of the font data,
+        so the font no longer refers to the data it was read from and that can be closed or freed.
+        """
+        for tag in self._tables:
+            self._tables[tag].release_content()
+        self._tables.set_content(WalkableString(''))
+
+    def _load_table(self, tag, content):
+        """
+        Builds and parses a single table, resolving the tables it depends on through the table directory.
+        :param str tag:
+        :param WalkableString content:
+        :rtype: TtfTable
+        """
+        table = self._table_parser_map.get(tag, TtfTable)(content)
+        if tag == 'loca':
+            if 'head' in self._tables and 'maxp' in self._tables:
+                table.parse(self._tables['maxp'].glyph_count, self._tables['head'].index_to_loc_is_long)
+        elif tag == 'glyf':
+            if 'loca' in self._tables:
+                self._tables['loca'].parse_glyphs(table)
+        else:
+            table.parse()
+        return table
+
     def get_tables(self):
         """
-        :rtype: dict
+        :rtype: TtfTableDirectory
         """
         return self._tables
 
+    def get_table(self, tag):
+        """
+        Returns the table for tag, parsing it if it hasn't been already, or None if the font doesn't have it.
+        :param str tag:
+        :rtype: TtfTable
+        """
+        return self._tables.get(tag)
+
     def __eq__(self, other):
         if not other:
             return False
@@ -0,0 +1,297 @@
+import array
+import struct
+import sys
+
+# composite glyph component flags
+ARG_1_AND_2_ARE_WORDS = 1 << 0
+WE_HAVE_A_SCALE = 1 << 3
+MORE_COMPONENTS = 1 << 5
+WE_HAVE_AN_X_AND_Y_SCALE = 1 << 6
+WE_HAVE_A_TWO_BY_TWO = 1 << 7
+
+# tables that don't refer to glyph ids, copied into the subset unchanged
+COPIED_TABLES = ('OS/2', 'cvt ', 'fpgm', 'gasp', 'name', 'prep')
+# the subset's cmap encodings, all unicode ones share a subtable for each format
+BMP_ENCODINGS = ((0, 3), (3, 1))
+FULL_UNICODE_ENCODINGS = ((0, 4), (3, 10))
+
+
+class TtfSubsetter(object):
+    """
+    Builds fonts holding only the glyphs needed for a set of code points. Everything that doesn't depend on the code
+    points is read from the font once, so each subset only costs work in proportion to the glyphs it keeps. Glyph
+    data is copied as is, only the glyph ids of composite glyph components are rewritten.
+
+    The subset keeps the tables that don't refer to glyph ids and rebuilds glyf, loca, hmtx, cmap, maxp, hhea, head
+    and post, with post dropping to version 3 so it has no glyph names. Layout tables like GSUB, GPOS and kern aren't
+    subset, so they're left out, as is the variation sequences cmap subtable.
+    """
+    def __init__(self, font):
+        """
+        :param TtfFont font: a font with TrueType outlines
+        """
+        for tag in ('cmap', 'glyf', 'head', 'hhea', 'hmtx', 'loca', 'maxp'):
+            if font.get_table(tag) is None:
+                raise ValueError("Can't subset a font without a {0} table".format(tag))
+        self._sub_table = font.get_table('cmap').get_unicode_sub_table()
+        if self._sub_table is None:
+            raise ValueError("Can't subset a font without a unicode cmap")
+        self._sub_table.get_bmp_glyph_ids()
+        self._glyph_count = font.get_table('maxp').glyph_count
+        self._locations = array.array('I', font.get_table('loca').locations)
+        self._glyph_data = font.get_table('glyf').content.get_data()
+        self._components = {}
+        self._read_metrics(font.get_table('hmtx').content.get_data(), font.get_table('hhea').width_count)
+        self._version = font.sfnt_version
+        self._tables = {}
+        for tag in COPIED_TABLES + ('head', 'hhea', 'maxp', 'post'):
+            table = font.get_table(tag)
+            if table is not None:
+                self._tables[tag] = table.content.get_data()
+
+    def _read_metrics(self, data, width_count):
+        width_count = min(width_count, self._glyph_count)
+        metrics = array.array('h', data[:width_count * 4])
+        side_bearings = array.array('h', data[width_count * 4:(width_count + self._glyph_count) * 2])
+        if sys.byteorder == 'little':
+            metrics.byteswap()
+            side_bearings.byteswap()
+        # advances are unsigned, so they're masked when they're read back
+        self._advances = metrics[0::2]
+        self._left_side_bearings = metrics[1::2] + side_bearings
+        # glyphs past the last long metric use its advance
+        self._advances.extend([self._advances[-1]] * (self._glyph_count - width_count))
+
+    def subset(self, codes):
+        """
+        :param Iterable codes: the code points the subset has to cover
+        :return: the subset font
+        :rtype: str
+        """
+        codes = array.array('I', sorted(set(codes)))
+        glyph_ids = self._sub_table.characters_to_glyph_ids(codes)
+        old_glyph_ids = self.glyph_closure([glyph_id for glyph_id in glyph_ids if glyph_id < self._glyph_count])
+        new_glyph_ids = dict((glyph_id, new_glyph_id) for (new_glyph_id, glyph_id) in enumerate(old_glyph_ids))
+        mappings = [(code, new_glyph_ids[glyph_id]) for (code, glyph_id) in zip(codes, glyph_ids)
+                    if glyph_id and glyph_id in new_glyph_ids and code != 0xFFFF]
+
+        (glyph_data, locations) = self._build_glyphs(old_glyph_ids, new_glyph_ids)
+        index_to_loc_is_long = locations[-1] > 0x1FFFE
+        tables = dict(self._tables)
+        tables['glyf'] = glyph_data
+        tables['loca'] = _pack_integers('I' if index_to_loc_is_long else 'H',
+                                        locations if index_to_loc_is_long else [offset / 2 for offset in locations])
+        (tables['hmtx'], width_count, advance_width_max) = self._build_metrics(old_glyph_ids)
+        tables['cmap'] = _build_cmap(mappings)
+        tables['maxp'] = _patch(tables['maxp'], 4, '>H', len(old_glyph_ids))
+        tables['hhea'] = _patch(_patch(tables['hhea'], 10, '>H', advance_width_max), 34, '>H', width_count)
+        # the checksum adjustment is filled in once the whole font is built
+        tables['head'] = _patch(_patch(tables['head'], 8, '>I', 0), 50, '>h', int(index_to_loc_is_long))
+        if 'post' in tables:
+            tables['post'] = _patch(tables['post'][:32], 0, '>I', 0x00030000)
+        if 'OS/2' in tables and mappings:
+            tables['OS/2'] = _patch(_patch(tables['OS/2'], 64, '>H', min(mappings[0][0], 0xFFFF)), 66, '>H',
+                                    min(mappings[-1][0], 0xFFFF))
+        return _build_font(self._version, tables)
+
+    def glyph_closure(self, glyph_ids):
+        """
+        :param Iterable glyph_ids:
+        :return: the glyph ids with .notdef and every composite glyph's components added, in glyph id order
+        :rtype: list of int
+        """
+        closure = set()
+        pending = [0]
+        pending.extend(glyph_ids)
+        while pending:
+            glyph_id = pending.pop()
+            if glyph_id not in closure:
+                closure.add(glyph_id)
+                pending.extend(component_id for (position, component_id) in self._get_components(glyph_id))
+        return sorted(closure)
+
+    def _get_components(self, glyph_id):
+        """
+        :param int glyph_id:
+        :return: (offset in the glyph data, glyph id) of each component, empty for simple glyphs. Components that
+                 refer past the last glyph get glyph id 0
+        :rtype: tuple
+        """
+        components = self._components.get(glyph_id)
+        if components is None:
+            components = ()
+            start = self._locations[glyph_id]
+            if self._locations[glyph_id + 1] - start >= 10 and \
+                    struct.unpack_from('>h', self._glyph_data, start)[0] < 0:
+                components = []
+                offset = start + 10  # skip the contour count and bounding box
+                flags = MORE_COMPONENTS
+                while flags & MORE_COMPONENTS:
+                    (flags, component_id) = struct.unpack_from('>HH', self._glyph_data, offset)
+                    if component_id >= self._glyph_count:
+                        # point a component past the last glyph at .notdef, which every subset keeps as glyph 0,
+                        # rather than leaving an id that means another glyph once the subset is renumbered
+                        component_id = 0
+                    components.append((offset + 2 - start, component_id))
+                    offset += 8 if flags & ARG_1_AND_2_ARE_WORDS else 6
+                    if flags & WE_HAVE_A_SCALE:
+                        offset += 2
+                    elif flags & WE_HAVE_AN_X_AND_Y_SCALE:
+                        offset += 4
+                    elif flags & WE_HAVE_A_TWO_BY_TWO:
+                        offset += 8
+                components = tuple(components)
+            self._components[glyph_id] = components
+        return components
+
+    def _build_glyphs(self, old_glyph_ids, new_glyph_ids):
+        """
+        :return: the glyf table and its loca offsets
+        :rtype: tuple of (str, list)
+        """
+        pieces = []
+        locations = [0]
+        for glyph_id in old_glyph_ids:
+            glyph = self._glyph_data[self._locations[glyph_id]:self._locations[glyph_id + 1]]
+            components = self._get_components(glyph_id)
+            if components:
+                glyph = bytearray(glyph)
+                for (position, component_id) in components:
+                    struct.pack_into('>H', glyph, position, new_glyph_ids[component_id])
+                glyph = str(glyph)
+            if len(glyph) % 2:
+                glyph += '\0'  # short loca offsets need every glyph to start at an even offset
+            pieces.append(glyph)
+            locations.append(locations[-1] + len(glyph))
+        return ''.join(pieces), locations
+
+    def _build_metrics(self, old_glyph_ids):
+        """
+        :return: the hmtx table, the number of long metrics in it and the largest advance
+        :rtype: tuple of (str, int, int)
+        """
+        advances = [self._advances[glyph_id] & 0xFFFF for glyph_id in old_glyph_ids]
+        left_side_bearings = [self._left_side_bearings[glyph_id] for glyph_id in old_glyph_ids]
+        # trailing glyphs with the same advance as the last long metric only need a side bearing
+        width_count = len(advances)
+        while width_count > 1 and advances[width_count - 1] == advances[width_count - 2]:
+            width_count -= 1
+        metrics = [0] * (width_count * 2)
+        metrics[0::2] = advances[:width_count]
+        metrics[1::2] = left_side_bearings[:width_count]
+        data = struct.pack('>' + 'Hh' * width_count, *metrics) + _pack_integers('h', left_side_bearings[width_count:])
+        return data, width_count, max(advances)
+
+
+def _pack_integers(type_code, values):
+    """
+    :param str type_code: array type code of the integers
+    :param Iterable values:
+    :return: the values as big-endian integers
+    :rtype: str
+    """
+    values = array.array(type_code, values)
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values.tostring()
+
+
+def _patch(data, offset, value_format, value):
+    return data[:offset] + struct.pack(value_format, value) + data[offset + struct.calcsize(value_format):]
+
+
+def _binary_search_fields(count, item_size):
+    """
+    :return: the search range, entry selector and range shift used by the table directory and cmap format 4
+    :rtype: tuple of (int, int, int)
+    """
+    entry_selector = max(count.bit_length() - 1, 0)
+    search_range = (1 << entry_selector) * item_size
+    return search_range, entry_selector, count * item_size - search_range
+
+
+def _build_cmap(mappings):
+    """
+    :param list mappings: (code, glyph id) in code order
+    :return: a cmap with format 4 for the BMP, and format 12 if there are codes above it or the BMP has too many
+    runs for format 4
+    :rtype: str
+    """
+    sub_tables = []
+    bmp_runs = _find_runs([(code, glyph_id) for (code, glyph_id) in mappings if code <= 0xFFFF])
+    # format 4 needs a last segment for 0xFFFF, which maps to glyph 0
+    bmp_runs.append((0xFFFF, 0xFFFF, 0))
+    segment_count = len(bmp_runs)
+    # format 4 has a 16 bit length, fragmented subsets like CJK ones can need more segments than fit in it
+    fits_format_four = 16 + segment_count * 8 <= 0xFFFF
+    if fits_format_four:
+        (search_range, entry_selector, range_shift) = _binary_search_fields(segment_count, 2)
+        format_four = struct.pack('>7H', 4, 16 + segment_count * 8, 0, segment_count * 2, search_range,
+                                  entry_selector, range_shift)
+        format_four += _pack_integers('H', [end for (start, end, glyph_id) in bmp_runs]) + '\0\0'
+        format_four += _pack_integers('H', [start for (start, end, glyph_id) in bmp_runs])
+        format_four += _pack_integers('H', [(glyph_id - start) & 0xFFFF for (start, end, glyph_id) in bmp_runs])
+        format_four += '\0\0' * segment_count  # every segment maps by delta, so there are no id range offsets
+        sub_tables.append((BMP_ENCODINGS, format_four))
+
+    if not fits_format_four or (mappings and mappings[-1][0] > 0xFFFF):
+        runs = _find_runs(mappings)
+        format_twelve = struct.pack('>2H3I', 12, 0, 16 + len(runs) * 12, 0, len(runs))
+        format_twelve += _pack_integers('I', [value for run in runs for value in run])
+        sub_tables.append((FULL_UNICODE_ENCODINGS, format_twelve))
+
+    records = []
+    offset = 4 + 8 * sum(len(encodings) for (encodings, sub_table) in sub_tables)
+    for (encodings, sub_table) in sub_tables:
+        records.extend((platform_id, platform_specific_id, offset) for (platform_id, platform_specific_id) in encodings)
+        offset += len(sub_table)
+    records.sort()
+    header = struct.pack('>2H', 0, len(records)) + ''.join(struct.pack('>2HI', *record) for record in records)
+    return header + ''.join(sub_table for (encodings, sub_table) in sub_tables)
+
+
+def _find_runs(mappings):
+    """
+    :param list mappings: (code, glyph id) in code order
+    :return: (start code, end code, start glyph id) for each run of consecutive codes mapped to consecutive glyphs
+    :rtype: list of tuples
+    """
+    runs = []
+    for (code, glyph_id) in mappings:
+        if runs and code == runs[-1][1] + 1 and glyph_id == runs[-1][2] + code - runs[-1][0]:
+            runs[-1] = (runs[-1][0], code, runs[-1][2])
+        else:
+            runs.append((code, code, glyph_id))
+    return runs
+
+
+def _checksum(data):
+    data += '\0' * (-len(data) % 4)
+    values = array.array('I', data)
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return sum(values) & 0xFFFFFFFF
+
+
+def _build_font(version, tables):
+    """
+    :param str version: the sfnt version from the original font
+    :param dict tables: table data by tag
+    :rtype: str
+    """
+    tags = sorted(tables)
+    (search_range, entry_selector, range_shift) = _binary_search_fields(len(tags), 16)
+    pieces = [version, struct.pack('>4H', len(tags), search_range, entry_selector, range_shift)]
+    offset = 12 + 16 * len(tags)
+    head_offset = 0
+    for tag in tags:
+        data = tables[tag]
+        if tag == 'head':
+            head_offset = offset
+        pieces.append(struct.pack('>4s3I', tag, _checksum(data), offset, len(data)))
+        offset += len(data) + -len(data) % 4
+    for tag in tags:
+        pieces.append(tables[tag] + '\0' * (-len(tables[tag]) % 4))
+    font = ''.join(pieces)
+    adjustment = (0xB1B0AFBA - _checksum(font)) & 0xFFFFFFFF
+    return font[:head_offset + 8] + struct.pack('>I', adjustment) + font[head_offset + 12:]
@@ -1,30 +1,71 @@
 import datetime
+import struct
 
 
 class WalkableString(object):
     RELATIVE_TO_START = 0
     RELATIVE_TO_CURRENT = 1
     RELATIVE_TO_END = 2
+    _struct_codes = {1: 'B', 2: 'H', 4: 'I'}
 
-    def __init__(self, data):
-        self.data = data
+    def __init__(self, data, start=0, end=None):
+        """
+        :param data: the buffer to walk, chunks read from this share the same buffer rather than copying it
+        :param int start: offset into data where this walkable region begins
+        :param int end: offset into data where this walkable region ends, defaults to the end of data
+        """
+        if end is None:
+            end = len(data)
+        self._buffer = data
+        self._start = start
+        self._end = end
         self.position = 0
 
+    @property
+    def data(self):
+        return self.get_data()
+
     def read_integer(self, count, signed=False):
         value = 0
         negative = False
+        offset = self._start + self.position
+        if offset + count > self._end:
+            raise IndexError("Read past the end of the walkable region")
         for i in range(count):
             value <<= 8
-            value += ord(self.data[self.position])
-            self.position += 1
+            value += ord(self._buffer[offset + i])
             if i == 0 and signed and value & 0x80 == 0x80:
                 negative = True
+        self.position += count
         if negative:
             value -= 2 ** (count * 8)
         return value
 
+    def read_integers(self, number, count, signed=False):
+        """
+        Reads a run of big-endian integers that are all the same size.
+        :param int number: how many integers to read
+        :param int count: size in bytes of each integer
+        :param bool signed:
+        :rtype: list
+        """
+        offset = self._start + self.position
+        if offset + number * count > self._end:
+            raise IndexError("Read past the end of the walkable region")
+        if count in self._struct_codes:
+            code = self._struct_codes[count]
+            if signed:
+                code = code.lower()
+            values = list(struct.unpack_from('>%d%s' % (number, code), self._buffer, offset))
+            self.position += number * count
+        else:
+            # odd sizes (like the 3 byte offsets in CFF INDEX tables) have no struct code
+            values = [self.read_integer(count, signed) for i in range(number)]
+        return values
+
     def read_chunk(self, chunk_size):
-        chunk = WalkableString(self.data[self.position:self.position + chunk_size])
+        chunk_start = self._start + self.position
+        chunk = WalkableString(self._buffer, chunk_start, min(chunk_start + chunk_size, self._end))
         self.position += chunk_size
         return chunk
 
@@ -34,11 +75,24 @@ class WalkableString(object):
         elif reference_point == 1:
             self.position += new_position
         else:
-            self.position = len(self.data) - new_position
+            self.position = len(self) - new_position
 
     def get_position(self):
         return self.position
 
+    def get_offset(self):
+        """
+        Returns the absolute offset of the current position within the shared buffer.
+        :rtype: int
+        """
+        return self._start + self.position
+
+    def get_buffer(self):
+        """
+        Returns the shared buffer this walkable region is a view over.
+        """
+        return self._buffer
+
     def read_font_epoch_time(self):
         seconds_adjustment = 2082844800  # seconds between 1904 and 1970
         time_read = self.read_integer(8)
@@ -46,19 +100,36 @@ class WalkableString(object):
         return datetime.datetime.fromtimestamp(seconds_since_epoch)
 
     def is_exhausted(self):
-        return self.position == len(self.data)
+        return self.position == len(self)
 
     def get_data(self):
-        return self.data
+        """
+        Returns a copy of the bytes in this walkable region.
+        :rtype: str
+        """
+        return self._buffer[self._start:self._end]
+
+    def detach(self):
+        """
+        Returns a walkable over a copy of just this region, at the same position, so the shared buffer can be
+        released.
+        :rtype: WalkableString
+        """
+        detached = WalkableString(self.get_data())
+        detached.position = self.position
+        return detached
+
+    def __len__(self):
+        return self._end - self._start
 
     def __eq__(self, other):
         if isinstance(other, basestring):
-            return self.data == other
+            return self.get_data() == other
         else:
-            return self.data == other.get_data()
+            return self.get_data() == other.get_data()
 
     def __ne__(self, other):
         return not self == other
 
     def __str__(self):
-        return ":".join("{:02x}".format(ord(c)) for c in self.data)
\ No newline at end of file
+        return ":".join("{:02x}".format(ord(c)) for c in self.get_data())
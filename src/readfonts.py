@@ -1,26 +1,86 @@
 import os
-import fontTools.cffLib
+import sys
+import multiprocessing
+import StringIO
 import fonts.builders
 import argparse
 
 
-def print_font(file_name):
-    font_file = open(file_name, "rb")
-    font = fontTools.cffLib.CFFFontSet()
-    font.decompile(font_file, 'unused')
+def describe_font(file_name, check_with_fonttools=False):
+    """
+    Parses a font and returns the lines to print for it, so it can run in a worker process.
+    Failures are reported as a line rather than raised, so one bad file doesn't stop the rest.
+    Anything the parsers print is captured and returned ahead of the description, so it stays next to its file.
+    :param str file_name:
+    :param bool check_with_fonttools: also decompile the font with fontTools
+    :rtype: list of str
+    """
+    original_stdout = sys.stdout
+    captured_output = StringIO.StringIO()
+    sys.stdout = captured_output
+    try:
+        lines = _describe_font(file_name, check_with_fonttools)
+    except Exception as e:
+        lines = ['{0}: failed {1!r}'.format(file_name, e)]
+    finally:
+        sys.stdout = original_stdout
+    return captured_output.getvalue().splitlines() + lines
+
+
+def _describe_font(file_name, check_with_fonttools):
+    if check_with_fonttools:
+        import fontTools.cffLib
+        with open(file_name, "rb") as font_file:
+            font = fontTools.cffLib.CFFFontSet()
+            font.decompile(font_file, 'unused')
     new_font = fonts.builders.parse_file(file_name)
-    for item in new_font:
-        print item
+    if hasattr(new_font, 'get_tables'):
+        return ['{0}: {1}'.format(file_name, tag) for tag in sorted(new_font.get_tables())]
+    else:
+        return ['{0}: {1} ({2} glyphs)'.format(file_name, new_font.name, new_font.glyph_count())]
+
+
+def _describe_font_star(arguments):
+    return describe_font(*arguments)
+
+
+def find_files(directory):
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for found_file in sorted(files):
+            yield os.path.join(root, found_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parse and print font information')
+    parser.add_argument('--directory', help="treat file name as a directory structure to walk")
+    parser.add_argument('--jobs', type=int, default=1, help="number of processes used to parse fonts")
+    parser.add_argument('--check-fonttools', action='store_true', help="also decompile every font with fontTools")
+    parser.add_argument('target', help="File or directory to open")
+    args = parser.parse_args()
+    if args.directory:
+        file_names = find_files(args.target)
+    else:
+        file_names = [args.target]
+    work = ((file_name, args.check_fonttools) for file_name in file_names)
 
+    if args.jobs > 1:
+        pool = multiprocessing.Pool(args.jobs)
+        # imap hands results back in submission order, so output is stable no matter which worker finishes first
+        results = pool.imap(_describe_font_star, work, chunksize=16)
+    else:
+        pool = None
+        results = (_describe_font_star(item) for item in work)
+    try:
+        for lines in results:
+            for line in lines:
+                print line
+    finally:
+        # every result has been read unless something went wrong, so there's nothing left to wait for
+        if pool:
+            pool.terminate()
+            pool.join()
 
-parser = argparse.ArgumentParser(description='Parse and print font information')
-parser.add_argument('--directory', help="treat file name as a directory structure to walk")
-parser.add_argument('target', help="File or directory to open")
-args = parser.parse_args()
-if args.directory:
-    for root, dirs, files in os.walk(args.target):
-        for found_file in files:
-            print_font(os.path.join(root, found_file))
-else:
-    print_font(args.target)
 
+if __name__ == '__main__':
+    main()
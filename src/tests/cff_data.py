@@ -0,0 +1,98 @@
+import struct
+from fonts.cff.indexes import Index
+from fonts.walkable import WalkableString
+
+# subroutine numbers are stored minus this bias in fonts with fewer than 1240 subroutines
+SUBROUTINE_BIAS = 107
+
+
+def encode_charstring(*tokens):
+    """
+    :param tokens: ints and floats are operands, tuples are operator keys like (21,) and strs are copied as is, for
+                   hintmask bytes or deliberately broken data
+    :rtype: str
+    """
+    pieces = []
+    for token in tokens:
+        if isinstance(token, tuple):
+            pieces.append(''.join(chr(byte) for byte in token))
+        elif isinstance(token, str):
+            pieces.append(token)
+        elif isinstance(token, float):
+            pieces.append('\xff' + struct.pack('>i', int(round(token * 65536))))
+        elif -107 <= token <= 107:
+            pieces.append(chr(token + 139))
+        elif 108 <= token <= 1131:
+            pieces.append(chr((token - 108 >> 8) + 247) + chr(token - 108 & 0xFF))
+        elif -1131 <= token <= -108:
+            pieces.append(chr((-token - 108 >> 8) + 251) + chr(-token - 108 & 0xFF))
+        else:
+            pieces.append('\x1c' + struct.pack('>h', token))
+    return ''.join(pieces)
+
+
+def call(subroutine_number):
+    """
+    The operand that calls a subroutine in a font with fewer than 1240 of them.
+    """
+    return subroutine_number - SUBROUTINE_BIAS
+
+
+def build_index(entries):
+    """
+    :param list entries: str data of each entry
+    :rtype: str
+    """
+    if not entries:
+        return '\0\0'
+    offsets = [1]
+    for entry in entries:
+        offsets.append(offsets[-1] + len(entry))
+    return struct.pack('>HB', len(entries), 4) + struct.pack('>{0}I'.format(len(offsets)), *offsets) + \
+        ''.join(entries)
+
+
+def encode_dict(entries):
+    """
+    :param list entries: (operator key, list of integer operands), operands always take 5 bytes so offsets can be
+                         filled in without changing the size
+    :rtype: str
+    """
+    pieces = []
+    for (key, operands) in entries:
+        pieces.extend('\x1d' + struct.pack('>i', operand) for operand in operands)
+        pieces.append(''.join(chr(byte) for byte in key))
+    return ''.join(pieces)
+
+
+def build_cff(charstrings, local_subrs=(), global_subrs=(), default_width=0, nominal_width=0):
+    """
+    A single font CFF with the predefined ISOAdobe charset, so it can have at most 229 glyphs.
+    :param list charstrings: charstring data by glyph id
+    :rtype: str
+    """
+    header = '\x01\x00\x04\x04'
+    names = build_index(['Test'])
+    strings = build_index([])
+    global_index = build_index(list(global_subrs))
+    char_string_index = build_index(list(charstrings))
+    private_entries = [((20,), [default_width]), ((21,), [nominal_width])]
+    local_index = ''
+    if local_subrs:
+        # Subrs is relative to the start of the Private DICT, the entry itself takes 6 more bytes
+        private_entries.append(((19,), [len(encode_dict(private_entries)) + 6]))
+        local_index = build_index(list(local_subrs))
+    private = encode_dict(private_entries)
+    top_size = len(build_index([encode_dict([((17,), [0]), ((18,), [0, 0])])]))
+    char_strings_offset = len(header) + len(names) + top_size + len(strings) + len(global_index)
+    private_offset = char_strings_offset + len(char_string_index)
+    top = build_index([encode_dict([((17,), [char_strings_offset]), ((18,), [len(private), private_offset])])])
+    return header + names + top + strings + global_index + char_string_index + private + local_index
+
+
+def read_index(entries):
+    """
+    :param list entries: str data of each entry
+    :rtype: Index
+    """
+    return Index(WalkableString(build_index(entries)))
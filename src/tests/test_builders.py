@@ -0,0 +1,75 @@
+import os
+import shutil
+import sys
+import tempfile
+import traceback
+import unittest
+from fonts.builders import iter_fonts, parse_file, parse_font
+from tests.ttf_data import build_sample_font
+
+
+class ParseFontTest(unittest.TestCase):
+    def setUp(self):
+        (self.data, self.mappings) = build_sample_font()
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'sample.ttf')
+        with open(self.file_name, 'wb') as font_file:
+            font_file.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lazy_parse_font(self):
+        font = parse_font(self.data, lazy=True)
+        tables = font.get_tables()
+        self.assertEqual(sorted(tables), sorted(parse_font(self.data).get_tables()))
+        self.assertFalse(any(tables.is_loaded(tag) for tag in tables))
+        # glyf resolves loca, which resolves head and maxp
+        font.get_table('glyf')
+        self.assertEqual(['glyf', 'head', 'loca', 'maxp'], sorted(tag for tag in tables if tables.is_loaded(tag)))
+        self.assertEqual(parse_font(self.data), font)
+
+    def test_lazy_parse_file(self):
+        font = parse_file(self.file_name, lazy=True)
+        self.assertFalse(font.get_tables().is_loaded('cmap'))
+        self.assertEqual(parse_file(self.file_name), font)
+
+    def test_lazy_iter_fonts(self):
+        [(name, font)] = list(iter_fonts([self.file_name], lazy=True))
+        self.assertEqual(self.file_name, name)
+        self.assertFalse(font.get_tables().is_loaded('glyf'))
+        self.assertEqual(parse_font(self.data), font)
+
+    def test_released_content(self):
+        other_file_name = os.path.join(self.directory, 'other.ttf')
+        shutil.copy(self.file_name, other_file_name)
+        # each mapped file is closed when the next font is requested, so both are closed once the list is built
+        fonts = list(iter_fonts([self.file_name, other_file_name], keep_content=False))
+        self.assertEqual([self.file_name, other_file_name], [name for (name, font) in fonts])
+        expected = parse_font(self.data)
+        codes = [code for (code, glyph_id) in self.mappings]
+        for (name, font) in fonts:
+            self.assertEqual(list(expected.get_table('cmap').text_to_glyph_ids(codes)),
+                             list(font.get_table('cmap').text_to_glyph_ids(codes)))
+            for glyph_id in range(expected.get_table('maxp').glyph_count):
+                self.assertEqual(expected.get_table('glyf').get_glyph(glyph_id),
+                                 font.get_table('glyf').get_glyph(glyph_id))
+
+    def test_source_error_traceback(self):
+        def sources():
+            yield self.file_name
+            raise ValueError("no more sources")
+
+        fonts = iter_fonts(sources())
+        self.assertEqual(self.file_name, next(fonts)[0])
+        try:
+            next(fonts)
+            self.fail("the error iterating the sources wasn't raised")
+        except ValueError:
+            # the traceback still runs through the generator that raised
+            functions = [function for (file_name, line, function, text) in traceback.extract_tb(sys.exc_info()[2])]
+            self.assertEqual('sources', functions[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
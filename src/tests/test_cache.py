@@ -0,0 +1,59 @@
+import unittest
+from fonts.cache import LruCache
+
+
+class LruCacheTest(unittest.TestCase):
+    def test_eviction_order(self):
+        cache = LruCache(3)
+        for key in 'abc':
+            cache.put(key, key.upper())
+        # reading a marks it as used more recently than b and c
+        self.assertEqual('A', cache.get('a'))
+        cache.put('d', 'D')
+        self.assertEqual(['a', 'c', 'd'], sorted(key for key in 'abcd' if key in cache))
+        # replacing c marks it as used, leaving a the oldest
+        cache.put('c', 'C2')
+        cache.put('e', 'E')
+        self.assertEqual(['c', 'd', 'e'], sorted(key for key in 'abcde' if key in cache))
+        self.assertEqual('C2', cache.get('c'))
+        self.assertEqual(3, len(cache))
+
+    def test_counters(self):
+        cache = LruCache(2)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(-1, cache.get('a', -1))
+        cache.put('a', 1)
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual(1, cache.get('a'))
+        self.assertEqual((2, 2), (cache.hits, cache.misses))
+        # membership tests don't count as lookups
+        self.assertIn('a', cache)
+        self.assertEqual((2, 2), (cache.hits, cache.misses))
+        cache.clear()
+        self.assertEqual((0, 0, 0), (cache.hits, cache.misses, len(cache)))
+
+    def test_shrink(self):
+        cache = LruCache(4)
+        for key in 'abcd':
+            cache.put(key, key)
+        cache.get('a')
+        cache.set_max_size(2)
+        self.assertEqual(['a', 'd'], sorted(key for key in 'abcd' if key in cache))
+        cache.put('e', 'e')
+        self.assertEqual(['a', 'e'], sorted(key for key in 'abcde' if key in cache))
+        cache.set_max_size(0)
+        self.assertEqual(0, len(cache))
+        cache.put('f', 'f')
+        self.assertNotIn('f', cache)
+
+    def test_unbounded(self):
+        cache = LruCache(None)
+        for key in range(1000):
+            cache.put(key, key)
+        self.assertEqual(1000, len(cache))
+        cache.set_max_size(10)
+        self.assertEqual(range(990, 1000), [key for key in range(1000) if key in cache])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+import unittest
+from fonts.builders import parse_font
+from fonts.cff.charstrings import Type1CharString, Type2CharString, Type2CharStringParser
+from fonts.cff.commands import Command, get_command
+from fonts.walkable import WalkableString
+from tests.cff_data import build_cff, call, encode_charstring, read_index
+
+HSTEMHM = (18,)
+HINTMASK = (19,)
+CALLSUBR = (10,)
+CALLGSUBR = (29,)
+RETURN = (11,)
+RMOVETO = (21,)
+RLINETO = (5,)
+ENDCHAR = (14,)
+HMOVETO = (22,)
+RRCURVETO = (8,)
+DIV = (12, 12)
+FLEX = (12, 35)
+HFLEX1 = (12, 36)
+FLEX1 = (12, 37)
+RCURVELINE = (24,)
+VVCURVETO = (26,)
+HHCURVETO = (27,)
+HSBW = (13,)
+DEFAULT_WIDTH = 500
+NOMINAL_WIDTH = 100
+
+
+def _stems(count):
+    return [10, 20] * count
+
+
+class SubroutineCacheTest(unittest.TestCase):
+    def check_cache(self, charstrings, local_subrs, global_subrs=()):
+        """
+        Parses every charstring on its own, then with one cache shared across all of them in both orders, which has
+        to give the same codes and fractional operands each time.
+        """
+        local_index = read_index(local_subrs)
+        global_index = read_index(global_subrs)
+
+        def parse(charstring, cache):
+            bytecode = Type2CharStringParser(cache).parse(WalkableString(charstring), global_index, local_index)
+            return list(bytecode.get_codes()), list(bytecode.get_reals())
+
+        expected = [parse(charstring, None) for charstring in charstrings]
+        for order in (range(len(charstrings)), reversed(range(len(charstrings)))):
+            cache = {}
+            results = dict((i, parse(charstrings[i], cache)) for i in order)
+            self.assertTrue(cache)
+            self.assertEqual(expected, [results[i] for i in range(len(charstrings))])
+        return expected
+
+    def test_hintmask_after_different_stem_counts(self):
+        # the mask is one byte with up to 8 hints and two with more, so the second byte is either a mask or an operand
+        local_subrs = [encode_charstring(HINTMASK, '\xc0\x8b', 20, RMOVETO, RETURN)]
+        charstrings = [
+            encode_charstring(*(_stems(2) + [HSTEMHM, call(0), CALLSUBR, ENDCHAR])),
+            encode_charstring(*(_stems(9) + [HSTEMHM, call(0), CALLSUBR, ENDCHAR])),
+            # operands left for the hintmask are vertical stems too, 2 horizontal and 7 vertical
+            encode_charstring(*(_stems(2) + [HSTEMHM] + _stems(7) + [call(0), CALLSUBR, ENDCHAR])),
+            encode_charstring(*(_stems(2) + [HSTEMHM, call(0), CALLSUBR, call(0), CALLSUBR, ENDCHAR])),
+        ]
+        (short_mask, long_mask, implied_stems, twice) = self.check_cache(charstrings, local_subrs)
+        self.assertNotEqual(short_mask, long_mask)
+        self.assertEqual(long_mask[0][-4:], implied_stems[0][-4:])
+
+    def test_operands_left_on_stack(self):
+        local_subrs = [
+            encode_charstring(*(_stems(8) + [RETURN])),
+            encode_charstring(1.5, 2.25, RETURN),
+            # declares however many stems the caller left on the stack
+            encode_charstring(HSTEMHM, RETURN),
+        ]
+        # the stems pushed by the subroutine are only declared by the caller's hstemhm, along with any operands the
+        # caller pushed first, which decides whether the mask takes one byte or two
+        tail = [HSTEMHM, HINTMASK, '\x8b\x8b\x8b', RMOVETO, ENDCHAR]
+        charstrings = [
+            encode_charstring(*([call(0), CALLSUBR] + tail)),
+            encode_charstring(*([10, 20, call(0), CALLSUBR] + tail)),
+            encode_charstring(call(1), CALLSUBR, call(1), CALLSUBR, RLINETO, ENDCHAR),
+            encode_charstring(.5, .75, call(1), CALLSUBR, RLINETO, ENDCHAR),
+            encode_charstring(*(_stems(8) + [call(2), CALLSUBR] + tail[1:])),
+            encode_charstring(*(_stems(9) + [call(2), CALLSUBR] + tail[1:])),
+        ]
+        (eight_stems, nine_stems, twice, after_reals, eight_declared, nine_declared) = self.check_cache(charstrings,
+                                                                                                      local_subrs)
+        self.assertEqual(len(eight_stems[0]), len(nine_stems[0]) - 1)
+        self.assertEqual([1.5, 2.25, 1.5, 2.25], twice[1])
+        self.assertEqual([.5, .75, 1.5, 2.25], after_reals[1])
+        self.assertEqual(eight_stems, eight_declared)
+        self.assertEqual(nine_stems, nine_declared)
+
+    def test_nested_local_and_global_calls(self):
+        # local 0 calls global 0, which calls local 1 through the glyph's local subroutines, which calls global 1
+        local_subrs = [
+            encode_charstring(5, call(0), CALLGSUBR, RETURN),
+            encode_charstring(7, RLINETO, call(1), CALLGSUBR, RETURN),
+            encode_charstring(HINTMASK, '\xff\x8b', 3, RLINETO, RETURN),
+            # calls whichever subroutine the caller pushed, so it can't be cached
+            encode_charstring(CALLSUBR, RETURN),
+        ]
+        global_subrs = [
+            encode_charstring(6, call(1), CALLSUBR, RETURN),
+            encode_charstring(.5, 8, RLINETO, RETURN),
+            encode_charstring(call(2), CALLSUBR, RETURN),
+        ]
+        charstrings = [
+            encode_charstring(call(0), CALLSUBR, ENDCHAR),
+            encode_charstring(1, 2, RMOVETO, call(0), CALLGSUBR, 9, RLINETO, ENDCHAR),
+            encode_charstring(call(1), CALLSUBR, 4, call(0), CALLSUBR, ENDCHAR),
+            encode_charstring(*(_stems(2) + [HSTEMHM, call(2), CALLGSUBR, ENDCHAR])),
+            encode_charstring(*(_stems(9) + [HSTEMHM, call(2), CALLGSUBR, ENDCHAR])),
+            encode_charstring(call(0), call(3), CALLSUBR, ENDCHAR),
+            encode_charstring(call(1), call(3), CALLSUBR, ENDCHAR),
+        ]
+        results = self.check_cache(charstrings, local_subrs, global_subrs)
+        self.assertEqual([.5], results[0][1])
+        self.assertNotEqual(results[3][0][9:], results[4][0][19:])
+        self.assertEqual(results[0], results[5])
+        self.assertNotEqual(results[5], results[6])
+
+
+class MetricsTest(unittest.TestCase):
+    def check_metrics(self, charstring, width, bounds, local_subrs=()):
+        """
+        Checks the width and bounds render gets from the Type 2 codes, and that rendering the Type 1 conversion of the
+        same glyph gets the same.
+        :param tuple bounds: min x, min y, max x, max y
+        """
+        font = parse_font(build_cff([encode_charstring(ENDCHAR), encode_charstring(*charstring)], local_subrs,
+                                    default_width=DEFAULT_WIDTH, nominal_width=NOMINAL_WIDTH))
+        glyph = font.get_glyph(1)
+        box = glyph.get_bounds()
+        self.assertEqual(bounds, (box.min_x, box.min_y, box.max_x, box.max_y))
+        self.assertEqual(width, glyph.get_width())
+        converted = Type1CharString('Test', 'converted', glyph.get_sequence())
+        self.assertEqual(vars(box), vars(converted.get_bounds()))
+        self.assertEqual(width, converted.get_width())
+
+    def test_real_operands(self):
+        self.check_metrics([10.5, -20.25, RMOVETO, 30.5, 40, -1.75, -50.5, RLINETO, ENDCHAR], DEFAULT_WIDTH,
+                           (0, -30.75, 41, 19.75))
+
+    def test_div(self):
+        self.check_metrics([10, 20, RMOVETO, 30, 4, DIV, 7, RLINETO, ENDCHAR], DEFAULT_WIDTH, (0, 0, 17.5, 27))
+
+    def test_width_before_div(self):
+        # the width is only known to be there once the quotient has replaced div's two arguments
+        self.check_metrics([50, 15, 2, DIV, 5, RMOVETO, ENDCHAR], 50 + NOMINAL_WIDTH, (0, 0, 7.5, 5))
+
+    def test_flex(self):
+        self.check_metrics([10, 0, RMOVETO, 10, 20, 30, 40, 50, 60, 70, -80, 90, -100, 110, -120, 50, FLEX, ENDCHAR],
+                           DEFAULT_WIDTH, (0, -180, 370, 120))
+
+    def test_hflex1(self):
+        # the line after it shows whether the flex came back down to where it started
+        charstring = [100, HMOVETO, 10, 5, 20, 10, 30, 40, 50, -8, 60, HFLEX1, 0, -20, RLINETO, ENDCHAR]
+        self.check_metrics(charstring, DEFAULT_WIDTH, (0, -20, 310, 15))
+
+    def test_endchar_width(self):
+        self.check_metrics([250, ENDCHAR], 250 + NOMINAL_WIDTH, (0, 0, 0, 0))
+        self.check_metrics([ENDCHAR], DEFAULT_WIDTH, (0, 0, 0, 0))
+
+    def test_endchar_width_after_path(self):
+        # endchar only carries a width when nothing before it cleared the stack
+        self.check_metrics([-30, 40, RMOVETO, 10, 10, 10, 10, 10, 10, RRCURVETO, ENDCHAR], DEFAULT_WIDTH,
+                           (-30, 0, 0, 70))
+
+    def test_subroutine_with_real_and_div(self):
+        local_subrs = [encode_charstring(1.5, 3, DIV, RETURN)]
+        self.check_metrics([80, 0, 0, RMOVETO, call(0), CALLSUBR, call(0), CALLSUBR, RLINETO, ENDCHAR],
+                           80 + NOMINAL_WIDTH, (0, 0, .5, .5), local_subrs)
+
+
+def _convert(*tokens):
+    """
+    Converts a Type 2 sequence to Type 1, with operator keys standing in for Commands on both sides.
+    :rtype: list
+    """
+    sequence = [get_command(token) if isinstance(token, tuple) else token for token in tokens]
+    glyph = Type2CharString('Test', 'test', sequence, DEFAULT_WIDTH, NOMINAL_WIDTH)
+    return [item.key if isinstance(item, Command) else item for item in glyph.get_sequence()]
+
+
+class ConversionTest(unittest.TestCase):
+    def test_rcurveline(self):
+        self.assertEqual([0, DEFAULT_WIDTH, HSBW, 0, 0, RMOVETO, 1, 2, 3, 4, 5, 6, RRCURVETO, 7, 8, RLINETO],
+                         _convert(0, 0, RMOVETO, 1, 2, 3, 4, 5, 6, 7, 8, RCURVELINE))
+
+    def test_flex1(self):
+        # travels further vertically, so the last argument is the end's y and x returns to the start
+        self.assertEqual([1, 2, 3, 4, 5, 6, RRCURVETO, 7, 8, 9, 10, -25, 11, RRCURVETO],
+                         _convert(1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, FLEX1))
+        self.assertEqual([10, 1, 10, 1, 10, 1, RRCURVETO, 10, 1, 10, 1, 5, -5, RRCURVETO],
+                         _convert(10, 1, 10, 1, 10, 1, 10, 1, 10, 1, 5, FLEX1))
+
+    def test_vvcurveto(self):
+        self.assertEqual([0, 1, 2, 3, 0, 4, RRCURVETO, 0, 5, 6, 7, 0, 8, RRCURVETO],
+                         _convert(1, 2, 3, 4, 5, 6, 7, 8, VVCURVETO))
+        self.assertEqual([9, 1, 2, 3, 0, 4, RRCURVETO], _convert(9, 1, 2, 3, 4, VVCURVETO))
+
+    def test_hhcurveto(self):
+        self.assertEqual([1, 0, 2, 3, 4, 0, RRCURVETO, 5, 0, 6, 7, 8, 0, RRCURVETO],
+                         _convert(1, 2, 3, 4, 5, 6, 7, 8, HHCURVETO))
+        self.assertEqual([1, 9, 2, 3, 4, 0, RRCURVETO], _convert(9, 1, 2, 3, 4, HHCURVETO))
+
+    def test_hflex1(self):
+        # the second curve comes back down by the first curve's rise and its own
+        self.assertEqual([1, 2, 3, 4, 5, 0, RRCURVETO, 6, 0, 7, 8, 9, -14, RRCURVETO],
+                         _convert(1, 2, 3, 4, 5, 6, 7, 8, 9, HFLEX1))
+
+    def test_endchar_width(self):
+        self.assertEqual([0, 250 + NOMINAL_WIDTH, HSBW, ENDCHAR], _convert(250, ENDCHAR))
+        self.assertEqual([0, DEFAULT_WIDTH, HSBW, ENDCHAR], _convert(ENDCHAR))
+
+    def test_div(self):
+        # div only replaces its own two arguments, the operand below them is kept
+        glyph = Type1CharString('Test', 'test', [0, 300, get_command(HSBW), 5, 30, 4, get_command(DIV),
+                                                 get_command(RLINETO)])
+        box = glyph.get_bounds()
+        self.assertEqual((5, 7.5), (box.max_x, box.max_y))
+
+    def test_rendered_once(self):
+        glyph = Type1CharString('Test', 'test', [0, 300, get_command(HSBW), 5, 6, get_command(RLINETO)])
+        renders = []
+        original_render = glyph.render
+        glyph.render = lambda: renders.append(original_render())
+        glyph.get_width()
+        glyph.get_bounds()
+        self.assertEqual(1, len(renders))
+
+
+if __name__ == '__main__':
+    unittest.main()
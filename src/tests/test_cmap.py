@@ -0,0 +1,193 @@
+import struct
+import unittest
+from fonts.ttf import builders
+from fonts.ttf import subset
+from fonts.ttf.builders import TtfCmapTable
+from fonts.walkable import WalkableString
+from tests.ttf_data import build_sample_font, read_font
+
+BASE_MAPPINGS = [(0x41, 1), (0x42, 2), (0x8FA8, 3), (0x1F600, 4)]
+# glyph 3 has three codes, the terminating code is mapped to glyph 0 and glyph 4 has no code at all
+REVERSE_MAPPINGS = [(0x41, 3), (0x42, 1), (0x61, 3), (0xFFFF, 0), (0x1F600, 3), (0x1F601, 5)]
+# (selector, default ranges as (start, additional count), non default (code, glyph id) mappings)
+VARIATIONS = [
+    (0xFE0E, [(0x41, 1)], [(0x8FA8, 10)]),
+    (0xE0100, [], [(0x8FA8, 11)]),
+]
+
+
+def _format_twelve(mappings):
+    groups = ''.join(struct.pack('>3I', code, code, glyph_id) for (code, glyph_id) in mappings)
+    return struct.pack('>2H3I', 12, 0, 16 + len(groups), 0, len(mappings)) + groups
+
+
+def _format_fourteen(variations):
+    offset = 10 + 11 * len(variations)
+    records = []
+    tables = []
+    for (selector, default_ranges, mappings) in variations:
+        offsets = []
+        for (items, item_format) in ((default_ranges, '>I'), (mappings, '>BHH')):
+            if not items:
+                offsets.append(0)
+                continue
+            if item_format == '>I':
+                packed = [struct.pack(item_format, start << 8 | count) for (start, count) in items]
+            else:
+                packed = [struct.pack(item_format, code >> 16, code & 0xFFFF, glyph_id) for (code, glyph_id) in items]
+            table = struct.pack('>I', len(items)) + ''.join(packed)
+            offsets.append(offset)
+            tables.append(table)
+            offset += len(table)
+        records.append(struct.pack('>BH2I', selector >> 16, selector & 0xFFFF, *offsets))
+    return struct.pack('>HII', 14, offset, len(variations)) + ''.join(records) + ''.join(tables)
+
+
+def _build_cmap(sub_tables):
+    """
+    :param list sub_tables: ((platform id, platform specific id), subtable data), subtables with the same data share
+                            an offset
+    :rtype: str
+    """
+    offsets = {}
+    data = ''
+    header_size = 4 + 8 * len(sub_tables)
+    records = []
+    for (key, sub_table) in sub_tables:
+        if sub_table not in offsets:
+            offsets[sub_table] = header_size + len(data)
+            data += sub_table
+        records.append(struct.pack('>2HI', key[0], key[1], offsets[sub_table]))
+    return struct.pack('>2H', 0, len(sub_tables)) + ''.join(records) + data
+
+
+def _read_cmap(data):
+    cmap = TtfCmapTable(WalkableString(data))
+    cmap.parse()
+    return cmap
+
+
+class VariationSequenceTest(unittest.TestCase):
+    def setUp(self):
+        self.cmap = _read_cmap(_build_cmap([((0, 5), _format_fourteen(VARIATIONS)),
+                                            ((3, 10), _format_twelve(BASE_MAPPINGS))]))
+
+    def test_default_variation(self):
+        # the default ranges cover A and B, which keep the glyphs the base cmap gives them
+        self.assertEqual(1, self.cmap.variation_to_glyph_id(0x41, 0xFE0E))
+        self.assertEqual(2, self.cmap.variation_to_glyph_id(0x42, 0xFE0E))
+        sub_table = self.cmap.get_variation_sub_table()
+        self.assertEqual(sub_table.DEFAULT_VARIATION, sub_table.variation_to_glyph_id(0x41, 0xFE0E))
+
+    def test_non_default_variation(self):
+        self.assertEqual(10, self.cmap.variation_to_glyph_id(0x8FA8, 0xFE0E))
+        self.assertEqual(11, self.cmap.variation_to_glyph_id(0x8FA8, 0xE0100))
+
+    def test_missing_sequences(self):
+        self.assertEqual(0, self.cmap.variation_to_glyph_id(0x41, 0xFE00))
+        self.assertEqual(0, self.cmap.variation_to_glyph_id(0x43, 0xFE0E))
+        self.assertEqual(0, self.cmap.variation_to_glyph_id(0x41, 0xE0100))
+        self.assertEqual(None, self.cmap.get_variation_sub_table().variation_to_glyph_id(0x41, 0xFE00))
+
+    def test_text_with_variations(self):
+        # a selector the font doesn't know leaves the character's default glyph, a selector with nothing in front of
+        # it is dropped
+        text = u'\ufe0eA\ufe0e\u8fa8\ufe0eB\ufe00\u8fa8\U000e0100C\U0001f600'
+        expected = [1, 10, 2, 11, 0, 4]
+        self.assertEqual(expected, list(self.cmap.text_to_glyph_ids_with_variations(text)))
+        # long enough for the batched lookups
+        self.assertEqual(expected * 20, list(self.cmap.text_to_glyph_ids_with_variations(text * 20)))
+
+    def test_text_without_variation_sub_table(self):
+        cmap = _read_cmap(_build_cmap([((3, 10), _format_twelve(BASE_MAPPINGS))]))
+        self.assertEqual([1, 3, 2], list(cmap.text_to_glyph_ids_with_variations(u'A\ufe0e\u8fa8\U000e0100B')))
+        self.assertEqual(0, cmap.variation_to_glyph_id(0x8FA8, 0xFE0E))
+
+    def test_truncated_records(self):
+        data = _format_fourteen(VARIATIONS)
+        # claims one more selector record than there is room for before the end of the subtable
+        too_many_records = data[:6] + struct.pack('>I', len(VARIATIONS) + 100) + data[10:]
+        self.assertRaises(IndexError, _read_cmap, _build_cmap([((0, 5), too_many_records)]))
+        # the mapping count of the last non default table
+        last_count = len(data) - 4 - 5
+        too_many_mappings = data[:last_count] + struct.pack('>I', 2) + data[last_count + 4:]
+        self.assertRaises(IndexError, _read_cmap, _build_cmap([((0, 5), too_many_mappings)]))
+
+
+class ReverseIndexTest(unittest.TestCase):
+    def setUp(self):
+        # the windows BMP subtable disagrees with the full unicode one, which is the one to use
+        self.cmap = _read_cmap(_build_cmap([((3, 1), _format_twelve([(0x41, 2), (0x42, 3)])),
+                                            ((3, 10), _format_twelve(REVERSE_MAPPINGS))]))
+
+    def test_several_codes(self):
+        self.assertEqual([0x41, 0x61, 0x1F600], list(self.cmap.glyph_id_to_codes(3)))
+        self.assertEqual([0x42], list(self.cmap.glyph_id_to_codes(1)))
+        self.assertEqual([0x1F601], list(self.cmap.glyph_id_to_codes(5)))
+
+    def test_unmapped_glyphs(self):
+        self.assertEqual([], list(self.cmap.glyph_id_to_codes(2)))
+        self.assertEqual([], list(self.cmap.glyph_id_to_codes(4)))
+        self.assertEqual([], list(self.cmap.glyph_id_to_codes(6)))
+        self.assertEqual([], list(self.cmap.glyph_id_to_codes(0)))
+
+    def test_built_once(self):
+        index = self.cmap.get_reverse_index()
+        self.assertIs(index, self.cmap.get_reverse_index())
+        self.cmap.glyph_id_to_codes(3)
+        self.assertIs(index, self.cmap.get_reverse_index())
+        # the index isn't part of the table's contents
+        self.assertEqual(_read_cmap(_build_cmap([((3, 1), _format_twelve([(0x41, 2), (0x42, 3)])),
+                                                 ((3, 10), _format_twelve(REVERSE_MAPPINGS))])), self.cmap)
+
+    def test_without_numpy(self):
+        index = self.cmap.get_unicode_sub_table().build_reverse_index()
+        original_numpy = builders.numpy
+        builders.numpy = None
+        try:
+            self.assertEqual(index, self.cmap.get_unicode_sub_table().build_reverse_index())
+        finally:
+            builders.numpy = original_numpy
+
+    def test_without_unicode_sub_table(self):
+        cmap = _read_cmap(_build_cmap([((1, 0), _format_twelve([(0x41, 2)]))]))
+        self.assertEqual([], list(cmap.glyph_id_to_codes(2)))
+
+
+class CmapMappingTest(unittest.TestCase):
+    def test_format_four_terminator(self):
+        # the segment that ends a format 4 subtable maps 0xFFFF to glyph 0, which isn't a mapping
+        mappings = [(0x41, 1), (0x42, 2), (0x44, 3), (0x4E00, 4)]
+        cmap = _read_cmap(subset._build_cmap(mappings))
+        code_map = cmap.sub_tables[(3, 1)].char_to_glyph_id_map
+        self.assertEqual(4, cmap.sub_tables[(3, 1)].sub_table_format)
+        self.assertEqual(dict(mappings), dict(code_map.items()))
+        self.assertEqual(len(mappings), len(code_map))
+        self.assertEqual([code for (code, glyph_id) in mappings], list(code_map))
+        self.assertNotIn(0xFFFF, code_map)
+        self.assertRaises(KeyError, code_map.__getitem__, 0xFFFF)
+        self.assertEqual(2, code_map[0x42])
+
+    def test_delta_to_glyph_zero(self):
+        code_map = _read_cmap(_build_cmap([((3, 10), _format_twelve(REVERSE_MAPPINGS))])).sub_tables[(3, 10)]
+        code_map = code_map.char_to_glyph_id_map
+        expected = dict((code, glyph_id) for (code, glyph_id) in REVERSE_MAPPINGS if glyph_id)
+        self.assertEqual(expected, dict(code_map.iteritems()))
+        self.assertEqual(len(expected), len(code_map))
+        self.assertNotIn(0xFFFF, code_map)
+
+
+class TextToGlyphIdsTest(unittest.TestCase):
+    def setUp(self):
+        self.cmap = read_font(build_sample_font()[0]).get_table('cmap')
+
+    def test_text_types(self):
+        expected = list(self.cmap.text_to_glyph_ids([0x41, 0x42, 0x1F600]))
+        self.assertEqual([1, 2, 7], expected)
+        self.assertEqual(expected, list(self.cmap.text_to_glyph_ids(u'AB\U0001F600')))
+        self.assertEqual(expected, list(self.cmap.text_to_glyph_ids('AB\xf0\x9f\x98\x80')))
+        self.assertRaises(UnicodeDecodeError, self.cmap.text_to_glyph_ids, 'AB\xff')
+
+
+if __name__ == '__main__':
+    unittest.main()
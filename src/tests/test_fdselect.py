@@ -0,0 +1,44 @@
+import struct
+import unittest
+from fonts.cff.fdselect import FdSelect
+from fonts.walkable import WalkableString
+
+# glyphs 0 to 2 use font dict 0, 3 and 4 use font dict 2 and 5 uses font dict 1
+FORMAT_THREE = struct.pack('>BH', 3, 3) + struct.pack('>HBHBHB', 0, 0, 3, 2, 5, 1) + struct.pack('>H', 6)
+
+
+class FdSelectTest(unittest.TestCase):
+    def test_format_zero(self):
+        fd_select = FdSelect(WalkableString('\0\0\1\1\0\2'), 5)
+        self.assertEqual(0, fd_select.format)
+        self.assertEqual([0, 1, 1, 0, 2], [fd_select[glyph_id] for glyph_id in range(5)])
+        self.assertEqual(5, len(fd_select))
+        self.assertRaises(IndexError, fd_select.__getitem__, 5)
+
+    def test_format_three(self):
+        data = WalkableString(FORMAT_THREE + 'next')
+        fd_select = FdSelect(data, 6)
+        self.assertEqual(3, fd_select.format)
+        self.assertEqual([0, 0, 0, 2, 2, 1], [fd_select[glyph_id] for glyph_id in range(6)])
+        self.assertEqual(len(FORMAT_THREE), data.get_position())
+        self.assertRaises(IndexError, fd_select.__getitem__, 6)
+
+    def test_format_three_past_sentinel(self):
+        fd_select = FdSelect(WalkableString(FORMAT_THREE), 8)
+        self.assertRaises(IndexError, fd_select.__getitem__, 6)
+
+    def test_truncated_format_three(self):
+        for length in range(3, len(FORMAT_THREE)):
+            self.assertRaises(IndexError, FdSelect, WalkableString(FORMAT_THREE[:length]), 6)
+            # the bytes after the end of the region mustn't be read as ranges
+            self.assertRaises(IndexError, FdSelect, WalkableString(FORMAT_THREE, 0, length), 6)
+
+    def test_truncated_format_zero(self):
+        self.assertRaises(IndexError, FdSelect, WalkableString('\0\0\1\1', 0, 3), 3)
+
+    def test_unsupported_format(self):
+        self.assertRaises(ValueError, FdSelect, WalkableString('\1\0\0'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
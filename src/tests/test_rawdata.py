@@ -0,0 +1,47 @@
+import unittest
+from fonts.cff.rawdata import OPERAND_NUMBER, OPERAND_OPERATION, get_real_number, read_tokens, read_unknown_thing
+from fonts.walkable import WalkableString
+
+# (encoded token, is_charstring, value) for each multi-byte token
+MULTI_BYTE_TOKENS = [
+    ('\x0c\x23', True, (12, 35)),
+    ('\x1c\x80\x00', True, -32768),
+    ('\x1c\x12\x34', False, 0x1234),
+    ('\x1d\x00\x01\x00\x00', False, 65536),
+    ('\xff\x00\x01\x80\x00', True, 1.5),
+    ('\xf7\x00', True, 108),
+    ('\xfe\xff', False, -1131),
+    ('\x1e\x1a\x25\xff', False, 1.25),
+]
+# follows each token in the buffer, so reading past the end of the region would find something to decode
+NEIGHBOUR = '\x1c\x7f\xff\x1e\x1f'
+
+
+class RawDataTest(unittest.TestCase):
+    def test_tokens(self):
+        for (encoded, is_charstring, value) in MULTI_BYTE_TOKENS:
+            data = WalkableString(encoded + NEIGHBOUR, 0, len(encoded))
+            self.assertEqual([value], read_tokens(data, is_charstring))
+            self.assertEqual(len(encoded), data.get_position())
+
+    def test_truncated_tokens(self):
+        for (encoded, is_charstring, value) in MULTI_BYTE_TOKENS:
+            for length in range(1, len(encoded)):
+                buffer = encoded[:length] + NEIGHBOUR
+                self.assertRaises(IndexError, read_tokens, WalkableString(buffer, 0, length), is_charstring)
+                self.assertRaises(IndexError, read_tokens, WalkableString(encoded[:length]), is_charstring)
+                self.assertRaises(IndexError, read_unknown_thing, WalkableString(buffer, 0, length), is_charstring)
+
+    def test_read_unknown_thing(self):
+        data = WalkableString('\x8b\x0c\x23' + NEIGHBOUR, 0, 3)
+        self.assertEqual((OPERAND_NUMBER, 0), read_unknown_thing(data, True))
+        self.assertEqual((OPERAND_OPERATION, (12, 35)), read_unknown_thing(data, True))
+        self.assertRaises(IndexError, read_unknown_thing, data, True)
+
+    def test_truncated_real_number(self):
+        self.assertEqual(1.25, get_real_number(WalkableString('\x1e\x1a\x25\xff')))
+        self.assertRaises(IndexError, get_real_number, WalkableString('\x1e\x1a\x25\xff', 0, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
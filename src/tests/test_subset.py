@@ -0,0 +1,87 @@
+import struct
+import unittest
+from fonts.ttf.subset import TtfSubsetter
+from tests.ttf_data import build_font, build_sample_font, composite_glyph, read_font, simple_glyph
+
+
+def _glyph_data(font, glyph_id):
+    (start, end) = font.get_table('loca').get_glyph_offsets(glyph_id)
+    return font.get_table('glyf').content.get_data()[start:end]
+
+
+def _advance(font, glyph_id):
+    width_count = font.get_table('hhea').width_count
+    data = font.get_table('hmtx').content.get_data()
+    return struct.unpack_from('>H', data, min(glyph_id, width_count - 1) * 4)[0]
+
+
+class TtfSubsetterTest(unittest.TestCase):
+    def setUp(self):
+        (data, mappings) = build_sample_font()
+        self.source = read_font(data)
+        self.source_cmap = dict(mappings)
+
+    def check_round_trip(self, source, source_cmap, codes):
+        subset = read_font(TtfSubsetter(source).subset(codes))
+        cmap = subset.get_table('cmap')
+        new_glyph_ids = cmap.text_to_glyph_ids(codes)
+        kept = [code for code in codes if code in source_cmap]
+        self.assertEqual(len(kept), len([glyph_id for glyph_id in new_glyph_ids if glyph_id]))
+        for (code, new_glyph_id) in zip(codes, new_glyph_ids):
+            if code not in source_cmap:
+                self.assertEqual(0, new_glyph_id)
+                continue
+            old_glyph_id = source_cmap[code]
+            self.assertEqual(_advance(source, old_glyph_id), _advance(subset, new_glyph_id))
+            old_glyph = source.get_table('glyf').get_glyph(old_glyph_id)
+            self.assertEqual(old_glyph, subset.get_table('glyf').get_glyph(new_glyph_id))
+            old_data = _glyph_data(source, old_glyph_id)
+            new_data = _glyph_data(subset, new_glyph_id)
+            if struct.unpack_from('>h', old_data)[0] < 0:
+                # composites only differ in the component glyph id, which has to point at the same outline
+                self.assertEqual(old_data[:12] + old_data[14:], new_data[:12] + new_data[14:len(old_data)])
+                old_component_id = struct.unpack_from('>H', old_data, 12)[0]
+                new_component_id = struct.unpack_from('>H', new_data, 12)[0]
+                old_component = _glyph_data(source, old_component_id)
+                self.assertEqual(old_component, _glyph_data(subset, new_component_id)[:len(old_component)])
+                self.assertEqual(_advance(source, old_component_id), _advance(subset, new_component_id))
+            else:
+                self.assertEqual(old_data, new_data[:len(old_data)])
+        self.assertEqual(subset.get_table('maxp').glyph_count, subset.get_table('glyf').glyph_count())
+        return subset
+
+    def test_round_trip(self):
+        codes = [0x41, 0x43, 0x53, 0x57, 0x59, 0x1F600, 0x30]
+        subset = self.check_round_trip(self.source, self.source_cmap, codes)
+        # .notdef, the glyphs for the six mapped codes and the components of the composites for W and Y
+        self.assertEqual(9, subset.get_table('maxp').glyph_count)
+        self.assertEqual(sorted([(0, 3), (0, 4), (3, 1), (3, 10)]), sorted(subset.get_table('cmap').sub_tables))
+        # the segment that ends the format 4 subtable
+        self.assertEqual(0, subset.get_table('cmap').sub_tables[(3, 1)].character_to_glyph_id(0xFFFF))
+
+    def test_empty_subset(self):
+        subset = self.check_round_trip(self.source, self.source_cmap, [])
+        self.assertEqual(1, subset.get_table('maxp').glyph_count)
+
+    def test_fragmented_cmap(self):
+        # every code maps to a glyph in reverse order, so no two codes can share a format 4 segment
+        glyph_count = 9000
+        glyphs = [simple_glyph(glyph_id % 500 + 1) for glyph_id in range(glyph_count)]
+        mappings = [(0x4E00 + i, glyph_count - 1 - i) for i in range(glyph_count - 1)]
+        source = read_font(build_font(glyphs, [600] * glyph_count, mappings))
+        codes = [code for (code, glyph_id) in mappings]
+        subset = self.check_round_trip(source, dict(mappings), codes)
+        self.assertEqual([(0, 4), (3, 10)], sorted(subset.get_table('cmap').sub_tables))
+
+    def test_out_of_range_component(self):
+        glyphs = [simple_glyph(50), simple_glyph(60), simple_glyph(70), composite_glyph(999, 5, 5)]
+        source = read_font(build_font(glyphs, [500, 600, 700, 800], [(0x41, 1), (0x42, 2), (0x43, 3)]))
+        subset = read_font(TtfSubsetter(source).subset([0x43]))
+        # .notdef and the composite, whose component now refers to .notdef instead of whatever became glyph 999
+        self.assertEqual(2, subset.get_table('maxp').glyph_count)
+        self.assertEqual([0, 1], list(subset.get_table('cmap').text_to_glyph_ids([0x42, 0x43])))
+        self.assertEqual(0, struct.unpack_from('>H', _glyph_data(subset, 1), 12)[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
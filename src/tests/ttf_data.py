@@ -0,0 +1,66 @@
+import struct
+from fonts.ttf.builders import TtfFont
+from fonts.ttf.subset import _build_cmap, _build_font, _pack_integers
+
+# a composite glyph whose single component is placed by x and y offsets held as words
+COMPONENT_FLAGS = 0x0001 | 0x0002
+
+
+def simple_glyph(size):
+    """
+    A triangle, one contour of three on curve points with short coordinate deltas.
+    """
+    header = struct.pack('>5h', 1, 0, 0, size, size)
+    return header + struct.pack('>hh3B', 2, 0, 0x01, 0x01, 0x01) + struct.pack('>3h', 0, size, -size) + \
+        struct.pack('>3h', 0, 0, size)
+
+
+def composite_glyph(component_id, x_offset, y_offset):
+    return struct.pack('>5h', -1, 0, 0, 100, 100) + struct.pack('>2H2h', COMPONENT_FLAGS, component_id, x_offset,
+                                                              y_offset)
+
+
+def build_font(glyphs, advances, mappings, cmap=None):
+    """
+    :param list glyphs: glyph data by glyph id
+    :param list advances: advance width by glyph id
+    :param list mappings: (code, glyph id) in code order
+    :param str cmap: cmap table data to use instead of one built from mappings
+    :rtype: str
+    """
+    glyph_count = len(glyphs)
+    locations = [0]
+    for glyph in glyphs:
+        locations.append(locations[-1] + len(glyph))
+    tables = {
+        'head': struct.pack('>2I2I2H2Q4h2H3h', 0x00010000, 0x00010000, 0, 0x5F0F3CF5, 0, 1000, 3600000000,
+                            3600000000, 0, 0, 1000, 1000, 0, 8, 2, 1, 0),
+        'hhea': struct.pack('>I3hH11hH', 0x00010000, 800, -200, 0, max(advances), *([0] * 11 + [glyph_count])),
+        'maxp': struct.pack('>IH13H', 0x00010000, glyph_count, *([0] * 13)),
+        'hmtx': struct.pack('>' + 'Hh' * glyph_count, *[value for advance in advances for value in (advance, 7)]),
+        'loca': _pack_integers('I', locations),
+        'glyf': ''.join(glyphs),
+        'cmap': cmap if cmap is not None else _build_cmap(mappings),
+        'post': struct.pack('>2I2h5I', 0x00030000, 0, 0, 0, 0, 0, 0, 0, 0),
+    }
+    return _build_font('\x00\x01\x00\x00', tables)
+
+
+def build_sample_font():
+    """
+    Glyph 0 is .notdef, 1 to 20 are simple and mapped from A onwards, 21 to 25 are composites of the simple glyphs 2
+    to 6, and U+1F600 maps to glyph 7 as well as G does.
+    :return: the font data and its (code, glyph id) mappings
+    :rtype: tuple
+    """
+    glyphs = [simple_glyph(50)] + [simple_glyph(100 + glyph_id) for glyph_id in range(1, 21)]
+    glyphs.extend(composite_glyph(component_id, component_id * 3, -component_id) for component_id in range(2, 7))
+    advances = [500 + glyph_id * 10 for glyph_id in range(len(glyphs))]
+    mappings = [(0x41 + glyph_id - 1, glyph_id) for glyph_id in range(1, len(glyphs))] + [(0x1F600, 7)]
+    return build_font(glyphs, advances, mappings), mappings
+
+
+def read_font(data, lazy=False):
+    font = TtfFont()
+    font.read_from_content(data, lazy)
+    return font